@@ -0,0 +1,218 @@
+"""
+Implied forward rates and rolling spread volatility over the whole history, as daily series
+
+Computed from the treasury maturities of the shared panel once per data version and persisted next to
+the panel store. Forwards only depend on their own row and the rolling windows only look VOLATILITY_WINDOW
+rows back, so after a refresh appends days only rows from the first changed one onward are computed.
+"""
+import os
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import curves
+import derived
+from instrumentation import annotate, instrumented
+import utils
+
+# name -> (start, end) in years: "5y5y" is the 5 year rate 5 years forward
+FORWARD_TENORS = {"1y1y": (1, 2), "2y1y": (2, 3), "5y5y": (5, 10), "2y10y": (2, 12), "10y20y": (10, 30)}
+
+# name -> (long series, short series), None for the highest minus lowest treasury yield
+VOLATILITY_SPREADS = {"10y-2y": ("DGS10", "DGS2"), "10y-3m": ("DGS10", "DGS3MO"), "high-low": None}
+VOLATILITY_WINDOW = 63  # about three months of trading days
+TRADING_DAYS = 252
+
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+def forward_rates(years, values, tenors=FORWARD_TENORS):
+    """
+    Continuously compounded forwards (rows x tenors) from each row's yields, spline interpolated
+    between observed maturities; NaN where a tenor's end lies past the longest observed maturity
+    """
+    values = np.atleast_2d(values)
+    points = sorted({year for pair in tenors.values() for year in pair})
+    zero = curves.spline_yields(years, values, points)
+
+    observed = ~np.isnan(values)
+    longest = np.where(observed.any(axis=1), np.max(np.where(observed, years, -np.inf), axis=1), np.nan)
+
+    forwards = np.empty((len(values), len(tenors)))
+    for j, (start, end) in enumerate(tenors.values()):
+        rate = (zero[:, points.index(end)] * end - zero[:, points.index(start)] * start) / (end - start)
+        forwards[:, j] = np.where(longest >= end, rate, np.nan)
+    return forwards
+
+
+def spread_values(series, values, spreads=VOLATILITY_SPREADS):
+    """
+    Spreads (rows x spreads) in percentage points, NaN where a leg is missing
+    """
+    values = np.atleast_2d(values)
+    result = np.empty((len(values), len(spreads)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows
+        for j, legs in enumerate(spreads.values()):
+            if legs is None:
+                result[:, j] = np.nanmax(values, axis=1) - np.nanmin(values, axis=1)
+            else:
+                result[:, j] = values[:, series.index(legs[0])] - values[:, series.index(legs[1])]
+    return result
+
+
+def rolling_std(values, window, min_periods=None):
+    """
+    Sample std of each column over the last `window` rows, NaNs skipped
+
+    Prefix sums make it one pass whatever the window; NaN where fewer than min_periods values are present
+    """
+    values = np.atleast_2d(values)
+    min_periods = window // 2 if min_periods is None else min_periods
+
+    valid = ~np.isnan(values)
+    x = np.where(valid, values, 0.0)
+
+    def window_sums(a):
+        prefix = np.concatenate([np.zeros((1, a.shape[1])), np.cumsum(a, axis=0)])
+        starts = np.maximum(np.arange(1, len(a) + 1) - window, 0)
+        return prefix[1:] - prefix[starts]
+
+    count = window_sums(valid.astype(np.float64))
+    total = window_sums(x)
+    squares = window_sums(x * x)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (squares - total * total / count) / (count - 1)
+    return np.where(count >= max(min_periods, 2), np.sqrt(np.maximum(variance, 0)), np.nan)
+
+
+def spread_volatility(spreads, window=VOLATILITY_WINDOW):
+    """
+    Annualized rolling volatility of daily spread changes, in basis points
+    """
+    changes = np.diff(spreads, axis=0, prepend=np.nan)
+    return rolling_std(changes, window) * np.sqrt(TRADING_DAYS) * 100
+
+
+def _changed_from(dates, inputs, previous):
+    """
+    First row whose date or inputs differ from the previous computation (0 if none can be reused)
+    """
+    if (previous is None or previous["inputs"].shape[1:] != inputs.shape[1:]
+            or list(previous["forward_names"]) != list(FORWARD_TENORS)
+            or list(previous["spread_names"]) != list(VOLATILITY_SPREADS)
+            or int(previous["window"]) != VOLATILITY_WINDOW):
+        return 0
+
+    common = min(len(dates), len(previous["dates"]))
+    prev_inputs = previous["inputs"][:common]
+    same = ((dates.values[:common] == previous["dates"][:common])
+            & ((prev_inputs == inputs[:common]) | (np.isnan(prev_inputs) & np.isnan(inputs[:common]))).all(axis=1))
+    return common if same.all() else int(np.argmin(same))
+
+
+def compute_analytics(dates, series, years, inputs, previous=None):
+    """
+    Forwards, spreads and spread volatility for every row, reusing rows of `previous` before the first change
+
+    Returns:
+        dict of arrays, see daily_analytics
+    """
+    start = _changed_from(dates, inputs, previous)
+    # rows before `start` reuse their results, the rolling window needs its lookback recomputed
+    lookback = max(start - VOLATILITY_WINDOW, 0)
+
+    forwards = forward_rates(years, inputs[start:])
+    spreads = spread_values(series, inputs[lookback:])
+    volatility = spread_volatility(spreads)[start - lookback:]
+    spreads = spreads[start - lookback:]
+
+    if start:
+        forwards = np.concatenate([previous["forwards"][:start], forwards])
+        spreads = np.concatenate([previous["spreads"][:start], spreads])
+        volatility = np.concatenate([previous["volatility"][:start], volatility])
+
+    return {
+        "dates": dates.values,
+        "inputs": inputs,
+        "forwards": forwards,
+        "spreads": spreads,
+        "volatility": volatility,
+        "forward_names": np.array(list(FORWARD_TENORS)),
+        "spread_names": np.array(list(VOLATILITY_SPREADS)),
+        "window": np.array(VOLATILITY_WINDOW),
+        "computed_from": np.array(start),
+    }
+
+
+@instrumented()
+def daily_analytics(data_directory_path=utils.CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Daily forwards, spreads and spread volatility for the current data, computed once per data version
+
+    Returns:
+        dict of arrays: dates, inputs (treasury yields used), forwards (dates x FORWARD_TENORS),
+        spreads and volatility (dates x VOLATILITY_SPREADS)
+    """
+    panel = utils.load_yield_panel(data_directory_path)
+    analytics = _analytics.get(panel.version)
+    annotate(cache_hit=analytics is not None)
+    if analytics is not None:
+        return analytics
+
+    with _analytics_lock:
+        analytics = _analytics.get(panel.version)
+        if analytics is not None:
+            return analytics
+
+        cols = [panel.column(series_id) for series_id in curves.FIT_SERIES]
+        inputs = panel.values[:, cols]
+        rows = (~np.isnan(inputs)).sum(axis=1) >= 2
+        years = np.array([derived.maturity_years(panel.maturities[col]) for col in cols])
+
+        cache_file = os.path.join(panel.store_dir, "analytics.npz") if panel.store_dir else None
+        previous = derived.load_derived(cache_file, None) if cache_file else None
+
+        analytics = compute_analytics(panel.dates[rows], curves.FIT_SERIES, years, inputs[rows], previous)
+        annotate(rows=len(inputs[rows]) - int(analytics["computed_from"]))
+
+        if cache_file is not None and int(analytics["computed_from"]) < len(analytics["dates"]):
+            try:
+                derived.save_derived(cache_file, panel.version, analytics)
+            except OSError as e:
+                print(f"could not write analytics cache: {e}")
+
+        for array in analytics.values():
+            array.flags.writeable = False
+        _analytics.clear()
+        _analytics[panel.version] = analytics
+        return analytics
+
+
+def _frame(values, names, sample_rate):
+    analytics = daily_analytics()
+    dataframe = pd.DataFrame(analytics[values], columns=list(analytics[names]),
+                             index=pd.DatetimeIndex(analytics["dates"], name="observation_date"))
+    if sample_rate is not None:
+        dataframe = dataframe.resample(sample_rate).mean()
+    return dataframe
+
+
+@instrumented()
+def forward_rate_dataframe(sample_rate="W"):
+    """
+    Implied forward rates (percent), a column per FORWARD_TENORS entry, resampled to sample_rate
+    """
+    return _frame("forwards", "forward_names", sample_rate)
+
+
+@instrumented()
+def spread_volatility_dataframe(sample_rate="W"):
+    """
+    Annualized rolling volatility of daily spread changes (basis points), a column per VOLATILITY_SPREADS entry
+    """
+    return _frame("volatility", "spread_names", sample_rate)
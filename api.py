@@ -0,0 +1,346 @@
+"""
+Read-only HTTP/JSON API over the yield data, for services that want the numbers behind the charts
+
+    python api.py --port 8600
+    curl 'localhost:8600/curve?date=2024-01-02'
+    curl 'localhost:8600/spread?long=10-year&short=2-year&sample_rate=ME&start=2020-01-01'
+
+Endpoints (GET or HEAD):
+    /version                                  data version, snapshot token and latest observation date
+    /curve?date=                              yield curve on a date, as the compare page shows it
+    /curve?date=&maturity=&maturity=...       fitted zero, forward and par yields at any maturities (years)
+    /curves?date=&date=...                    several curves at once, a column per maturity
+    /spread?long=&short=&sample_rate=&start=&end=
+    /range?sample_rate=&start=&end=           highest/lowest yield and the spread between them
+    /extremes?sample_rate=&start=&end=        lowest/highest yielding maturity in years
+
+Plain asyncio, no framework. Responses are cached least recently used first by (data version, request),
+gzipped once, and carry an ETag and Last-Modified tied to the data version, so repeat requests are
+answered from memory or with a 304. Cache misses are computed on a thread pool, off the event loop.
+Data comes from load_yield_panel, so CMH_SHARED_PANEL_DIR serves the shared panel (see shared_panel.py).
+"""
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from email.utils import formatdate, parsedate_to_datetime
+import gzip
+import hashlib
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import curves
+import utils
+
+RESPONSE_CACHE_SIZE = 1024
+# how long a data version is trusted before the panel's source files are checked again
+VERSION_CHECK_SECONDS = 1.0
+GZIP_MIN_BYTES = 1024
+SAMPLE_RATES = ("D", "W", "ME", "QE", "YE")
+MAX_MATURITY_YEARS = 100
+
+_STATUS_TEXT = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _param(query, name, default=None):
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise BadRequest(f"missing parameter: {name}")
+        return default
+    return values[-1]
+
+
+def _date_param(query, name):
+    value = _param(query, name)
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be YYYY-MM-DD: {value!r}")
+
+
+def _sample_rate_param(query):
+    sample_rate = _param(query, "sample_rate", "W")
+    if sample_rate not in SAMPLE_RATES:
+        raise BadRequest(f"sample_rate must be one of {', '.join(SAMPLE_RATES)}")
+    return sample_rate
+
+
+def _series_payload(dataframe, query):
+    """
+    {"columns": [...], "index": ["YYYY-MM-DD", ...], "data": [[...], ...]}, NaN as null, between start and end
+    """
+    start = _date_param(query, "start") if "start" in query else None
+    end = _date_param(query, "end") if "end" in query else None
+    dataframe = dataframe.loc[start:end]
+    dataframe = dataframe.set_axis(dataframe.index.strftime("%Y-%m-%d"))
+    return json.loads(dataframe.to_json(orient="split"))
+
+
+def _derived_frame(sample_rate, columns):
+    derived_series = utils.load_yield_panel().derived_series(sample_rate)
+    return pd.DataFrame({column: derived_series[column] for column in columns},
+                        index=pd.DatetimeIndex(derived_series["dates"], name="observation_date"))
+
+
+def version_endpoint(query):
+    panel = utils.load_yield_panel()
+    return {"version": panel.version, "snapshot": utils.data_version(),
+            "latest_data_date": str(utils.get_latest_data_date())}
+
+
+def _maturities_param(query):
+    try:
+        years = [float(value) for value in query["maturity"]]
+    except ValueError:
+        raise BadRequest("maturity must be a number of years")
+    if not all(0 < maturity <= MAX_MATURITY_YEARS for maturity in years):
+        raise BadRequest(f"maturity must be above 0 and at most {MAX_MATURITY_YEARS} years")
+    return years
+
+
+def fitted_curve_payload(yc_date, years):
+    fitted = curves.fitted_curve_dataframe([yc_date], years)
+    if fitted.empty:
+        raise BadRequest(f"no fitted curve on or before {yc_date}")
+    return {"date": fitted["fit_date"].iloc[0], "model": "nss", "rmse": fitted["rmse"].iloc[0],
+            "curve": fitted[["years", "zero", "forward", "par"]].to_dict(orient="records")}
+
+
+def curve_endpoint(query):
+    yc_date = _date_param(query, "date")
+    if query.get("maturity"):
+        return fitted_curve_payload(yc_date, _maturities_param(query))
+    try:
+        yield_curve, res_date = utils.get_dated_yield_curve(yc_date)
+    except ValueError:
+        # no maturity has a value on or before the date
+        raise BadRequest(f"no curve on or before {yc_date}")
+    return {"date": res_date, "curve": [{"maturity": maturity, "yield": value} for maturity, value in yield_curve]}
+
+
+def curves_endpoint(query):
+    if not query.get("date"):
+        raise BadRequest("missing parameter: date")
+    yc_dates = [_date_param({"date": [value]}, "date") for value in query["date"]]
+    return _series_payload(utils.get_dated_yield_curves(yc_dates), {})
+
+
+def spread_endpoint(query):
+    try:
+        spreads = utils.yield_spreads([(_param(query, "long", "10-year"), _param(query, "short", "2-year"))],
+                                      sample_rate=_sample_rate_param(query))
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return _series_payload(spreads, query)
+
+
+def range_endpoint(query):
+    return _series_payload(_derived_frame(_sample_rate_param(query),
+                                          ["highest_yield", "lowest_yield", "min_max_spread"]), query)
+
+
+def extremes_endpoint(query):
+    return _series_payload(_derived_frame(_sample_rate_param(query),
+                                          ["lowest_rate_duration", "highest_rate_duration"]), query)
+
+
+ROUTES = {
+    "/version": version_endpoint,
+    "/curve": curve_endpoint,
+    "/curves": curves_endpoint,
+    "/spread": spread_endpoint,
+    "/range": range_endpoint,
+    "/extremes": extremes_endpoint,
+}
+
+
+class CachedResponse:
+    """
+    A rendered 200 response: json body, its gzipped form (None when too small to be worth it) and validators
+    """
+    def __init__(self, body, etag, last_modified):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class YieldApi:
+    """
+    Request handling independent of the transport: cache lookup, conditional requests, gzip
+    """
+    def __init__(self, cache_size=RESPONSE_CACHE_SIZE, executor=None):
+        self.cache_size = cache_size
+        self.executor = executor or ThreadPoolExecutor(max_workers=4, thread_name_prefix="yield-api")
+        self._responses = OrderedDict()
+        self._version = None
+        self._version_checked = 0.0
+        self._version_seen = {}
+
+    async def data_version(self):
+        """
+        (version, Last-Modified timestamp), rechecked at most every VERSION_CHECK_SECONDS
+        """
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > VERSION_CHECK_SECONDS:
+            # a changed source reloads the panel, which must not block the event loop
+            panel = await asyncio.get_running_loop().run_in_executor(self.executor, utils.load_yield_panel)
+            version = panel.version
+            # Last-Modified is when this server first saw the version
+            self._version_seen.setdefault(version, time.time())
+            self._version = version
+            self._version_checked = now
+        return self._version, self._version_seen[self._version]
+
+    async def handle(self, method, target, headers):
+        """
+        Returns:
+            (status, header list, body bytes)
+        """
+        if method not in ("GET", "HEAD"):
+            return self._error(405, f"method not allowed: {method}")
+
+        url = urlsplit(target)
+        endpoint = ROUTES.get(url.path)
+        if endpoint is None:
+            return self._error(404, f"not found: {url.path}")
+
+        query = parse_qs(url.query)
+        version, modified = await self.data_version()
+        key = (version, url.path, tuple(sorted((name, tuple(values)) for name, values in query.items())))
+
+        response = self._responses.get(key)
+        if response is not None:
+            self._responses.move_to_end(key)
+        else:
+            try:
+                payload = await asyncio.get_running_loop().run_in_executor(self.executor, endpoint, query)
+            except BadRequest as e:
+                return self._error(400, str(e))
+            except Exception as e:
+                return self._error(500, f"{type(e).__name__}: {e}")
+
+            body = json.dumps(payload, separators=(",", ":"), default=str).encode()
+            etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest()[:24] + '"'
+            response = CachedResponse(body, etag, formatdate(modified, usegmt=True))
+            self._responses[key] = response
+            while len(self._responses) > self.cache_size:
+                self._responses.popitem(last=False)
+
+        response_headers = [("ETag", response.etag), ("Last-Modified", response.last_modified),
+                            ("Cache-Control", "no-cache"), ("Vary", "Accept-Encoding")]
+        if self._not_modified(headers, response, modified):
+            return 304, response_headers, b""
+
+        body = response.body
+        if response.gzipped is not None and "gzip" in headers.get("accept-encoding", ""):
+            body = response.gzipped
+            response_headers.append(("Content-Encoding", "gzip"))
+        response_headers.append(("Content-Type", "application/json"))
+        return 200, response_headers, body
+
+    @staticmethod
+    def _not_modified(headers, response, modified):
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            return response.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+        if_modified_since = headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= int(modified)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _error(status, message):
+        body = json.dumps({"error": message}).encode()
+        return status, [("Content-Type", "application/json")], body
+
+
+async def _serve_connection(api, reader, writer):
+    """
+    HTTP/1.1 with keep-alive, one request at a time per connection
+    """
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, protocol = lines[0].split(" ")
+            except ValueError:
+                break
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+
+            # a read-only api takes no request bodies
+            if int(headers.get("content-length", 0) or 0):
+                status, response_headers, body = YieldApi._error(400, "request bodies are not accepted")
+                keep_alive = False
+            else:
+                status, response_headers, body = await api.handle(method, target, headers)
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if protocol == "HTTP/1.1" else connection == "keep-alive"
+
+            response = [f"HTTP/1.1 {status} {_STATUS_TEXT[status]}", f"Content-Length: {len(body)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+            response += [f"{name}: {value}" for name, value in response_headers]
+            writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+            if method != "HEAD":
+                writer.write(body)
+            await writer.drain()
+
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=8600, api=None, ready=None):
+    """
+    Serve until cancelled
+
+    ready: optional asyncio.Event set once the socket is listening
+    """
+    api = api or YieldApi()
+    # load before the first request, so it does not pay for it
+    await api.data_version()
+
+    server = await asyncio.start_server(lambda reader, writer: _serve_connection(api, reader, writer), host, port)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read-only HTTP/JSON API over the yield data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args()
+
+    print(f"serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -1,11 +1,15 @@
-import altair as alt
+import os
+
 import pandas as pd
 import streamlit as st
 
-from utils import (create_yield_df_dict, lowest_yield_dataframe, highest_yield_dataframe,
-                   fed_funds_rate_dataframe, create_yield_differential_dataframe,
-                   create_yield_dataframe, update_csv_files,
-                   RECESSIONS, RECESSION_ENDS, SP_500_PEAKS, SP_500_TROUGHS)
+import charts
+from episodes import episode_index
+import instrumentation
+from instrumentation import instrumented
+from refresher import get_refresher
+from spec_cache import chart_spec, vega_lite_spec
+from utils import create_yield_df_dict
 
 
 st.set_page_config(page_title="CMH Charts",
@@ -13,6 +17,10 @@ st.set_page_config(page_title="CMH Charts",
                    layout="wide",
                    initial_sidebar_state="collapsed")
 
+# "progressive": every chart section shows a placeholder at once, charts fill in top to bottom
+# "tabs": one chart section at a time, only the selected chart is computed
+CHART_LAYOUT = os.environ.get("CMH_CHART_LAYOUT", "progressive")
+
 
 def maturity_yield_time_series_chart():
     rate_data = create_yield_df_dict(fillna=True)
@@ -22,328 +30,104 @@ def maturity_yield_time_series_chart():
     st.line_chart(combined_df)
 
 
-def yield_range_time_series_chart():
-    #TODO: add in fed funds rate?
-    #TODO: add highest interest rate?
-    #TODO: add spread volatility??
-    yield_spread = create_yield_dataframe().reset_index()
-
-    df_recessions = pd.DataFrame({
-        "Date": pd.to_datetime(RECESSIONS)
-    })
-    df_recessions["Event"] = "Recession Starts"
-
-    df_recession_ends = pd.DataFrame({
-        "Date": pd.to_datetime(RECESSION_ENDS)
-    })
-    df_recession_ends["Event"] = "Recession Ends"
-
-    line_chart = (
-        alt.Chart(yield_spread)
-        .mark_line()
-        .encode(
-            x=alt.X("observation_date:T", title="Date"),
-            y=alt.Y("Min Max Spread:Q", title="High-Low Spread"),
-            tooltip=["observation_date:T", "Min Max Spread:Q"]
-        )
-        .properties(
-            width=700,
-            height=600,
-            title="Yield Differential: Highest Yield vs. Lowest Yield Spread"
-        )
-        .interactive()
-    )
+def render_spec(spec):
+    # cached specs are shared between sessions, each render gets its own parsed copy
+    st.vega_lite_chart(spec=vega_lite_spec(spec), use_container_width=True)
 
-    # Create vertical lines --> recession starts and ends
-    recession_start_lines = (
-        alt.Chart(df_recessions)
-        .mark_rule(color="red", strokeWidth=2)
-        .encode(
-            x="Date:T",
-            color=alt.Color(
-                "Event:N",
-                legend=alt.Legend(title="Events", orient='bottom'),  
-                # scale ensures the legend color matches the lines
-                scale=alt.Scale(domain=["Recession Starts", "Recession Ends"], range=["red", "blue"])
-            ),
-            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
-        )
-    )
 
-    recession_end_lines = (
-        alt.Chart(df_recession_ends)
-        .mark_rule(color="blue", strokeWidth=2)
-        .encode(
-            x="Date:T",
-            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
-        )
-    )
-
-    # Layer verticals on top of the main chart
-    layered_chart = alt.layer(
-        line_chart,
-        recession_start_lines,
-        recession_end_lines
-    ).interactive()
-
-    st.altair_chart(layered_chart, use_container_width=True)
+@instrumented("render.yield_range_time_series_chart")
+def yield_range_time_series_chart():
+    render_spec(chart_spec(charts.yield_range_time_series_chart))
 
 
+@instrumented("render.lowest_yielding_duration_time_series_chart")
 def lowest_yielding_duration_time_series_chart(sample_rate="W", start_date="1965-01-01"):
-    #TODO: add lowest interest rate line
-    #TODO: improve tooltips
-    lowest_yield_data = lowest_yield_dataframe(sample_rate=sample_rate)
-
-    # reset index for altair format
-    df_rate = lowest_yield_data.reset_index()
-
-    df_rate = df_rate[df_rate["observation_date"] >= start_date]
-
-    df_fed_funds = fed_funds_rate_dataframe(start_date=start_date).reset_index()
-
-    df_rate['Category'] = 'Lowest Yielding Maturity'
-    df_fed_funds['Category'] = 'Fed Funds Rate'
-
-    # Combine the DataFrames into a single DataFrame 
-    df_merged = pd.merge(df_rate, df_fed_funds, on="observation_date", how="inner")
-
-    lines = (
-        alt.Chart(df_merged)
-        .transform_fold(
-            ["lowest_rate_duration", "FF"],  # orig column names
-            as_=["variable", "value"]
-        )
-        .mark_line()
-        .encode(
-            x=alt.X(
-            "observation_date:T",
-            axis=alt.Axis(title="Date")
-            ),
-            y=alt.Y(
-                "value:Q",
-                axis=alt.Axis(title="Maturity Duration/Yield %")
-            ),
-            color=alt.Color(
-                "variable:N",
-            )
-        )
-        .properties(
-            width=700,
-            height=600,
-            title="Lowest Yielding Maturity (FF, 1mo, 3mo, 6mo, 1yr, 2yr, 3yr, 5yr, 7yr, 10yr, 20yr, 30yr)",
-        )
-    )
-
-    df_recessions = pd.DataFrame({
-        "Date": pd.to_datetime(RECESSIONS)
-    })
-    df_recessions["variable"] = "Recession Start"
-
-    df_sp_500_peaks = pd.DataFrame({
-        "Date": pd.to_datetime(SP_500_PEAKS)
-    })
-    df_sp_500_peaks["variable"] = "S&P 500 Peak"
-
-    df_sp_500_troughs = pd.DataFrame({
-        "Date": pd.to_datetime(SP_500_TROUGHS)
-    })
-    df_sp_500_troughs["variable"] = "S&P 500 Trough"
-
-    df_events = pd.concat([df_recessions, df_sp_500_peaks, df_sp_500_troughs], ignore_index=True)
-
-    # Create vertical lines, use a shared field 'variable'
-    rules = (
-        alt.Chart(df_events)
-        .mark_rule(strokeWidth=1)
-        .encode(
-            x="Date:T",
-            color=alt.Color(
-                "variable:N",
-                legend=alt.Legend(title="Legend"),
-            ),
-            tooltip=[
-                alt.Tooltip("Date:T", title="Event Date"),
-                alt.Tooltip("variable:N", title="Event"),
-            ],
-        )
-    )
-
-    # Unify color scale, make singel legend --> lines + events 
-    # list possible categories in 'variable':
-    # We can specify a single domain & range across both layered charts to unify them.
-    color_domain = [
-        "lowest_rate_duration",
-        "FF",
-        "Recession Start",
-        "S&P 500 Peak",
-        "S&P 500 Trough"
-    ]
-    color_range = [
-        "#1f77b4",  # blue
-        "#2ca02c",  # green
-        "red",
-        "greenyellow",
-        "gray"
-    ]
-
-    # Define a shared color scale
-    shared_color_scale = alt.Scale(
-        domain=color_domain,
-        range=color_range
-    )
-
-    # Apply scale to both layer encodings by setting scale=shared_color_scale
-    lines = lines.encode(
-        color=alt.Color(
-            "variable:N",
-            scale=shared_color_scale,
-            legend=alt.Legend(
-                title="Line Type",
-                orient="bottom",
-                labelExpr="""
-                {
-                    'lowest_rate_duration': 'Lowest Yielding Duration',
-                    'FF': 'Fed Funds Rate',
-                    'Recession Start': 'Recession Starts',
-                    'S&P 500 Peak': 'S&P 500 Peaks',
-                    'S&P 500 Trough': 'S&P 500 Troughs'
-                }[datum.value] || datum.value
-                """
-            )
-        )
-    )
-
-    rules = rules.encode(
-        color=alt.Color(
-            "variable:N",
-            scale=shared_color_scale,
-            legend=alt.Legend(
-                title="Line Type",
-                orient="bottom"
-            )
-        )
-    )
-
-    final_chart = alt.layer(lines, rules).resolve_scale(color="shared")
-    st.altair_chart(final_chart.interactive(), use_container_width=True)
+    render_spec(chart_spec(charts.lowest_yielding_duration_time_series_chart, sample_rate=sample_rate,
+                           start_date=start_date))
 
 
+@instrumented("render.highest_yielding_duration_time_series_chart")
 def highest_yielding_duration_time_series_chart(sample_rate="ME", start_date="1965-01-01"):
-    #TODO: add in fed funds rate
-    #TODO: add highest interest rate
-    highest_yield_data = highest_yield_dataframe(sample_rate=sample_rate)
-    df_alt = highest_yield_data.reset_index()
-
-    df_alt = df_alt[df_alt["observation_date"] >= start_date]
-
-    df_recessions = pd.DataFrame({
-        "Date": pd.to_datetime(RECESSIONS)
-    })
-    df_recessions["Event"] = "Recession Starts"
-
-    df_recession_ends = pd.DataFrame({
-        "Date": pd.to_datetime(RECESSION_ENDS)
-    })
-    df_recession_ends["Event"] = "Recession Ends"
-
-    line_chart = (
-        alt.Chart(df_alt)
-        .mark_line()
-        .encode(
-            x=alt.X("observation_date:T", title="Date"),
-            y=alt.Y("highest_rate_duration:Q", title="Maturity Duration"),
-            tooltip=["observation_date:T", "highest_rate_duration:Q"]
-        )
-        .properties(
-            width=700,
-            height=600,
-            title="Highest Yielding Maturity"
-        )
-        .interactive()
-    )
+    render_spec(chart_spec(charts.highest_yielding_duration_time_series_chart, sample_rate=sample_rate,
+                           start_date=start_date))
 
-    recession_start_lines = (
-        alt.Chart(df_recessions)
-        .mark_rule(color="red", strokeWidth=2)
-        .encode(
-            x="Date:T",
-            color=alt.Color(
-                "Event:N",
-                legend=alt.Legend(title="Events", orient='bottom'),  
-                scale=alt.Scale(domain=["Recession Starts", "Recession Ends"], range=["red", "blue"])
-            ),
-            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
-        )
-    )
 
-    recession_end_lines = (
-        alt.Chart(df_recession_ends)
-        .mark_rule(color="blue", strokeWidth=2)
-        .encode(
-            x="Date:T",
-            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
-        )
-    )
+@instrumented("render.yield_spread_chart")
+def yield_spread_chart(d1="10-year", d2="2-year"):
+    render_spec(chart_spec(charts.yield_spread_chart, d1=d1, d2=d2))
 
-    # layer main chart and lines
-    layered_chart = alt.layer(
-        line_chart,
-        recession_start_lines,
-        recession_end_lines
-    ).interactive()
 
-    st.altair_chart(layered_chart, use_container_width=True)
+def long_end_spread_chart():
+    # the 20-year was not published 1987-1993, the gap is shaded
+    yield_spread_chart(d1="30-year", d2="20-year")
 
 
-def yield_spread_chart(d1="10-year", d2="2-year"):
-    df_yield_spread = create_yield_differential_dataframe(d1, d2)
-    df_yield_spread = df_yield_spread.reset_index()
-
-    df_recessions = pd.DataFrame({
-        "Date": pd.to_datetime(RECESSIONS[:-2])
-    })
-    df_recessions["Event"] = "Recession Starts"
-
-    line_chart = (
-        alt.Chart(df_yield_spread)
-        .mark_line()
-        .encode(
-            x=alt.X("observation_date:T", title="Date"),
-            y=alt.Y("Spread:Q", title="Spread"),
-        )
-        .properties(
-            width=700,
-            height=600,
-            title=f"Yield Differential: {d1} - {d2}"
-        )
-        .interactive()
-    )
+@instrumented("render.forward_rate_chart")
+def forward_rate_chart():
+    render_spec(chart_spec(charts.forward_rate_chart))
 
-    horizontal_line = alt.Chart(pd.DataFrame({'y': [0]})).mark_rule(color='gray').encode(
-        y='y:Q'
-    )
 
-    recesssion_start_lines = (
-        alt.Chart(df_recessions)
-        .mark_rule(color="red", strokeWidth=2)
-        .encode(
-            x="Date:T",
-            color=alt.Color(
-                "Event:N",
-                legend=alt.Legend(title="Events", orient='bottom'),  
-                scale=alt.Scale(domain=["Recession Starts"], range=["red"])
-            ),
-            tooltip=[alt.Tooltip("Date:T", title="Recession")]
-        )
-    )
+@instrumented("render.spread_volatility_chart")
+def spread_volatility_chart():
+    render_spec(chart_spec(charts.spread_volatility_chart))
 
-    layered_chart = alt.layer(
-        line_chart,
-        recesssion_start_lines,
-        horizontal_line
-    ).resolve_scale(y="shared").interactive()
 
-    st.altair_chart(layered_chart, use_container_width=True)
+@instrumented("render.inversion_episodes")
+def inversion_episodes():
+    st.subheader("Curve Inversion Episodes")
+    st.dataframe(
+        episode_index().table.sort_values("start", ascending=False),
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "start": st.column_config.DateColumn("Start"),
+            "end": st.column_config.DateColumn("End"),
+            "ongoing": "Ongoing",
+            "depth": st.column_config.NumberColumn("Max Depth", format="%.2f"),
+            "trough_date": st.column_config.DateColumn("Deepest On"),
+            "duration_days": "Days",
+            "next_recession": st.column_config.DateColumn("Next Recession"),
+            "lead_days": st.column_config.NumberColumn("Days to Recession", format="%d"),
+        },
+    )
+    st.caption("Depth is the lowest spread for inversions and the longest lowest yielding maturity (years) "
+               "for long end lowest episodes.")
+
+
+# section label -> render function, in page order
+CHART_SECTIONS = {
+    "10yr-2yr Spread": yield_spread_chart,
+    "30yr-20yr Spread": long_end_spread_chart,
+    "Highest vs. Lowest Yield Spread": yield_range_time_series_chart,
+    "Lowest Yielding Maturity": lowest_yielding_duration_time_series_chart,
+    "Highest Yielding Maturity": highest_yielding_duration_time_series_chart,
+    "Implied Forward Rates": forward_rate_chart,
+    "Spread Volatility": spread_volatility_chart,
+    "Inversion Episodes": inversion_episodes,
+}
+
+
+def progressive_chart_sections():
+    # placeholders go out with the first delta, each is swapped for its chart once that is ready
+    placeholders = []
+    for i in range(len(CHART_SECTIONS)):
+        if i:
+            st.divider()
+        placeholder = st.empty()
+        placeholder.caption("Loading chart...")
+        placeholders.append(placeholder)
+
+    for placeholder, render in zip(placeholders, CHART_SECTIONS.values()):
+        with placeholder.container():
+            render()
+
+
+def tabbed_chart_sections():
+    labels = list(CHART_SECTIONS)
+    selected = st.segmented_control("Chart", labels, default=labels[0], key="chart_section",
+                                    label_visibility="collapsed")
+    # deselecting the active tab leaves nothing selected, fall back to the first chart
+    CHART_SECTIONS[selected or labels[0]]()
 
 
 def readme_section():
@@ -378,32 +162,26 @@ def main():
     st.markdown(footer, unsafe_allow_html=True)
 
     st.write("[SEE ALSO: Yield Curve Date Comparison](/yield_curve_compare)")
+    st.write("[SEE ALSO: Yield Curve History](/yield_curve_history)")
 
     readme_section()
 
     st.divider()
 
     # maturity_yield_time_series_chart()
-    # TODO: need to show periods of unavailability in order to show the 30yr-20yr spread
-    # yield_spread_chart(d1="30-year", d2="20-year")
-
-    yield_spread_chart() # 10yr-2yr by default
-
-    st.divider()
-
-    yield_range_time_series_chart()
 
-    st.divider()
-
-    lowest_yielding_duration_time_series_chart()
-
-    st.divider()
+    if CHART_LAYOUT == "tabs":
+        tabbed_chart_sections()
+    else:
+        progressive_chart_sections()
 
-    highest_yielding_duration_time_series_chart()
+    instrumentation.render_debug_sidebar()
+    instrumentation.flush()
 
 
 if 'init' not in st.session_state:
-    update_csv_files()
+    # refreshes run on a background thread, never during a page render
+    get_refresher()
     st.session_state.init = True
 
 
@@ -0,0 +1,177 @@
+"""
+Per-series availability interval index and data checks, built once per data version at load time
+
+A series is available from each of its valid values until the next one, unless they are more than
+MAX_GAP_DAYS apart: such gaps are discontinuations (the 20-year from 1987 to 1993), shorter ones are
+holidays. Series that start late (the 1-month in 2001) are simply unavailable before their first value.
+Each series' intervals are sorted and disjoint, so whether a series exists on a date is one binary search.
+"""
+import numpy as np
+import pandas as pd
+
+# longer breaks between valid values are discontinuations, shorter ones weekends and holidays
+MAX_GAP_DAYS = 7
+
+# yields (percent) outside this range, or daily moves larger than MAX_DAILY_CHANGE, are reported as outliers
+YIELD_RANGE = (-5.0, 30.0)
+MAX_DAILY_CHANGE = 1.5
+# the effective fed funds rate moved several points in a day before the 1990s
+JUMP_EXEMPT_SERIES = ("FF",)
+# checked moves larger than MAX_DAILY_CHANGE that are in the published data, (series id, YYYY-MM-DD)
+KNOWN_MOVES = frozenset([("DGS3MO", "1982-02-01")])
+ISSUE_EXAMPLES = 3
+
+
+def _days(values):
+    try:
+        # strings, dates and datetime64 convert directly, much faster than through pandas
+        return np.atleast_1d(np.asarray(values, dtype="datetime64[D]"))
+    except (TypeError, ValueError):
+        return np.asarray(pd.DatetimeIndex(np.atleast_1d(values)).values.astype("datetime64[D]"))
+
+
+class AvailabilityIndex:
+    """
+    starts/ends: {series id: sorted datetime64[D] first/last valid day of each availability interval}
+    holiday_gaps: {series id: count of blank csv rows (FRED's '.') inside the intervals}
+    """
+    def __init__(self, series, starts, ends, holiday_gaps):
+        self.series = list(series)
+        self.starts = starts
+        self.ends = ends
+        self.holiday_gaps = holiday_gaps
+
+    @classmethod
+    def from_panel(cls, dates, values, observed, series, max_gap_days=MAX_GAP_DAYS):
+        days = _days(dates)
+        starts, ends, holiday_gaps = {}, {}, {}
+        for col, series_id in enumerate(series):
+            valid = ~np.isnan(values[:, col])
+            valid_days = days[valid]
+            breaks = np.flatnonzero(np.diff(valid_days) > np.timedelta64(max_gap_days, "D"))
+            starts[series_id] = valid_days[np.concatenate([[0], breaks + 1])] if len(valid_days) else valid_days
+            ends[series_id] = valid_days[np.concatenate([breaks, [len(valid_days) - 1]])] if len(valid_days) else valid_days
+
+            # blank rows between the first and last valid value of an interval
+            blank = np.flatnonzero(observed[:, col] & ~valid)
+            holiday_gaps[series_id] = int(np.count_nonzero(cls._contains(starts[series_id], ends[series_id],
+                                                                         days[blank])))
+        return cls(series, starts, ends, holiday_gaps)
+
+    @staticmethod
+    def _contains(starts, ends, query_days):
+        i = np.searchsorted(starts, query_days, side="right") - 1
+        return (i >= 0) & (query_days <= ends[np.maximum(i, 0)]) if len(starts) else np.zeros(len(query_days), bool)
+
+    def available(self, series_id, query_dates):
+        """
+        bool array, whether the series is available on each date
+        """
+        return self._contains(self.starts[series_id], self.ends[series_id], _days(query_dates))
+
+    def available_series(self, query_date):
+        """
+        Series ids available on a date, in panel order
+        """
+        day = _days(query_date)
+        return [series_id for series_id in self.series if self._contains(self.starts[series_id],
+                                                                           self.ends[series_id], day)[0]]
+
+    def intervals(self, series_id=None):
+        """
+        DataFrame of availability intervals: series, start, end, days
+        """
+        frames = []
+        for sid in ([series_id] if series_id is not None else self.series):
+            frames.append(pd.DataFrame({"series": sid, "start": self.starts[sid].astype("datetime64[ns]"),
+                                        "end": self.ends[sid].astype("datetime64[ns]")}))
+        frame = pd.concat(frames, ignore_index=True)
+        frame["days"] = (frame["end"] - frame["start"]).dt.days + 1
+        return frame
+
+    def gaps(self, series_ids, start=None, end=None):
+        """
+        Periods (start, end) when any of the series is unavailable, between the first and last day all of them
+        are available unless start/end are given
+
+        Returns:
+            DataFrame with start and end columns (first and last unavailable day), sorted and disjoint
+        """
+        spans = [(self.starts[sid], self.ends[sid]) for sid in series_ids]
+        if any(len(starts) == 0 for starts, _ in spans):
+            return pd.DataFrame({"start": pd.DatetimeIndex([]), "end": pd.DatetimeIndex([])})
+
+        one_day = np.timedelta64(1, "D")
+        lo = _days(start)[0] if start is not None else max(starts[0] for starts, _ in spans)
+        hi = _days(end)[0] if end is not None else min(ends[-1] for _, ends in spans)
+
+        # every series' complement within [lo, hi], then merged
+        gap_starts = [np.concatenate([[lo], ends + one_day]) for starts, ends in spans]
+        gap_ends = [np.concatenate([starts - one_day, [hi]]) for starts, ends in spans]
+        gap_starts, gap_ends = np.concatenate(gap_starts), np.concatenate(gap_ends)
+        gap_starts, gap_ends = np.maximum(gap_starts, lo), np.minimum(gap_ends, hi)
+        keep = gap_starts <= gap_ends
+        order = np.argsort(gap_starts[keep], kind="stable")
+        gap_starts, gap_ends = gap_starts[keep][order], gap_ends[keep][order]
+
+        merged_starts, merged_ends = [], []
+        for gap_start, gap_end in zip(gap_starts, gap_ends):
+            if merged_ends and gap_start <= merged_ends[-1] + one_day:
+                merged_ends[-1] = max(merged_ends[-1], gap_end)
+            else:
+                merged_starts.append(gap_start)
+                merged_ends.append(gap_end)
+
+        return pd.DataFrame({"start": pd.DatetimeIndex(np.array(merged_starts, dtype="datetime64[D]")),
+                             "end": pd.DatetimeIndex(np.array(merged_ends, dtype="datetime64[D]"))})
+
+    def summary(self):
+        """
+        One row per series: first/last available day, intervals, discontinued days and holiday gaps
+        """
+        rows = []
+        for series_id in self.series:
+            starts, ends = self.starts[series_id], self.ends[series_id]
+            missing = int(((starts[1:] - ends[:-1]).astype(np.int64) - 1).sum()) if len(starts) > 1 else 0
+            rows.append({"series": series_id,
+                         "first": starts[0] if len(starts) else None,
+                         "last": ends[-1] if len(ends) else None,
+                         "intervals": len(starts),
+                         "discontinued_days": missing,
+                         "holiday_gaps": self.holiday_gaps[series_id]})
+        return pd.DataFrame(rows)
+
+
+def duplicate_days(file_days):
+    """
+    Days appearing more than once in one csv's (int32 day number) dates
+    """
+    ordered = np.sort(file_days)
+    return np.unique(ordered[1:][np.diff(ordered) == 0])
+
+
+def validate(dates, values, series):
+    """
+    Out of range values and implausible daily moves
+
+    Returns:
+        list of human readable issues, empty when the data looks sound
+    """
+    issues = []
+    days = _days(dates)
+    for col, series_id in enumerate(series):
+        column = values[:, col]
+        valid = np.flatnonzero(~np.isnan(column))
+
+        out_of_range = valid[(column[valid] < YIELD_RANGE[0]) | (column[valid] > YIELD_RANGE[1])]
+        if len(out_of_range):
+            examples = ", ".join(f"{days[row]}={column[row]}" for row in out_of_range[:ISSUE_EXAMPLES])
+            issues.append(f"{series_id}: {len(out_of_range)} values outside {YIELD_RANGE} ({examples})")
+
+        jumps = valid[1:][np.abs(np.diff(column[valid])) > MAX_DAILY_CHANGE]
+        jumps = [row for row in jumps if (series_id, str(days[row])) not in KNOWN_MOVES]
+        if len(jumps) and series_id not in JUMP_EXEMPT_SERIES:
+            examples = ", ".join(str(days[row]) for row in jumps[:ISSUE_EXAMPLES])
+            issues.append(f"{series_id}: {len(jumps)} moves over {MAX_DAILY_CHANGE} points from the previous "
+                          f"value ({examples})")
+    return issues
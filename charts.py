@@ -0,0 +1,646 @@
+"""
+Altair chart builders for the yield curve pages, kept free of streamlit so they can run headless
+"""
+import math
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from analytics import forward_rate_dataframe, spread_volatility_dataframe
+from curves import fitted_curve_dataframe, fitted_curves
+from downsample import downsample_frame
+from episodes import episode_index
+from instrumentation import instrumented
+from utils import (lowest_yield_dataframe, highest_yield_dataframe,
+                   fed_funds_rate_dataframe, create_yield_differential_dataframe,
+                   create_yield_dataframe, yield_curve_history, unavailable_periods,
+                   RECESSIONS, RECESSION_ENDS, SP_500_PEAKS, SP_500_TROUGHS)
+
+
+@instrumented("chart.yield_range_time_series_chart")
+def yield_range_time_series_chart():
+    #TODO: add in fed funds rate?
+    #TODO: add highest interest rate?
+    # spread volatility: see spread_volatility_chart
+    yield_spread = create_yield_dataframe()[["Min Max Spread"]].reset_index()
+    yield_spread = downsample_frame(yield_spread, "observation_date", "Min Max Spread")
+
+    df_recessions = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSIONS)
+    })
+    df_recessions["Event"] = "Recession Starts"
+
+    df_recession_ends = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSION_ENDS)
+    })
+    df_recession_ends["Event"] = "Recession Ends"
+
+    line_chart = (
+        alt.Chart(yield_spread)
+        .mark_line()
+        .encode(
+            x=alt.X("observation_date:T", title="Date"),
+            y=alt.Y("Min Max Spread:Q", title="High-Low Spread"),
+            tooltip=["observation_date:T", "Min Max Spread:Q"]
+        )
+        .properties(
+            width=700,
+            height=600,
+            title="Yield Differential: Highest Yield vs. Lowest Yield Spread"
+        )
+        .interactive()
+    )
+
+    # Create vertical lines --> recession starts and ends
+    recession_start_lines = (
+        alt.Chart(df_recessions)
+        .mark_rule(color="red", strokeWidth=2)
+        .encode(
+            x="Date:T",
+            color=alt.Color(
+                "Event:N",
+                legend=alt.Legend(title="Events", orient='bottom'),  
+                # scale ensures the legend color matches the lines
+                scale=alt.Scale(domain=["Recession Starts", "Recession Ends"], range=["red", "blue"])
+            ),
+            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
+        )
+    )
+
+    recession_end_lines = (
+        alt.Chart(df_recession_ends)
+        .mark_rule(color="blue", strokeWidth=2)
+        .encode(
+            x="Date:T",
+            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
+        )
+    )
+
+    # Layer verticals on top of the main chart
+    layered_chart = alt.layer(
+        line_chart,
+        recession_start_lines,
+        recession_end_lines
+    ).interactive()
+
+    return layered_chart
+
+
+@instrumented("chart.lowest_yielding_duration_time_series_chart")
+def lowest_yielding_duration_time_series_chart(sample_rate="W", start_date="1965-01-01"):
+    #TODO: add lowest interest rate line
+    #TODO: improve tooltips
+    lowest_yield_data = lowest_yield_dataframe(sample_rate=sample_rate)
+
+    # reset index for altair format
+    df_rate = lowest_yield_data.reset_index()
+
+    df_rate = df_rate[df_rate["observation_date"] >= start_date]
+
+    df_fed_funds = fed_funds_rate_dataframe(start_date=start_date).reset_index()
+
+    df_rate['Category'] = 'Lowest Yielding Maturity'
+    df_fed_funds['Category'] = 'Fed Funds Rate'
+
+    # Combine the DataFrames into a single DataFrame 
+    df_merged = pd.merge(df_rate, df_fed_funds, on="observation_date", how="inner")
+    df_merged = downsample_frame(df_merged, "observation_date", ["lowest_rate_duration", "FF"], start=start_date)
+
+    lines = (
+        alt.Chart(df_merged)
+        .transform_fold(
+            ["lowest_rate_duration", "FF"],  # orig column names
+            as_=["variable", "value"]
+        )
+        .mark_line()
+        .encode(
+            x=alt.X(
+            "observation_date:T",
+            axis=alt.Axis(title="Date")
+            ),
+            y=alt.Y(
+                "value:Q",
+                axis=alt.Axis(title="Maturity Duration/Yield %")
+            ),
+            color=alt.Color(
+                "variable:N",
+            )
+        )
+        .properties(
+            width=700,
+            height=600,
+            title="Lowest Yielding Maturity (FF, 1mo, 3mo, 6mo, 1yr, 2yr, 3yr, 5yr, 7yr, 10yr, 20yr, 30yr)",
+        )
+    )
+
+    df_recessions = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSIONS)
+    })
+    df_recessions["variable"] = "Recession Start"
+
+    df_sp_500_peaks = pd.DataFrame({
+        "Date": pd.to_datetime(SP_500_PEAKS)
+    })
+    df_sp_500_peaks["variable"] = "S&P 500 Peak"
+
+    df_sp_500_troughs = pd.DataFrame({
+        "Date": pd.to_datetime(SP_500_TROUGHS)
+    })
+    df_sp_500_troughs["variable"] = "S&P 500 Trough"
+
+    df_events = pd.concat([df_recessions, df_sp_500_peaks, df_sp_500_troughs], ignore_index=True)
+
+    # Create vertical lines, use a shared field 'variable'
+    rules = (
+        alt.Chart(df_events)
+        .mark_rule(strokeWidth=1)
+        .encode(
+            x="Date:T",
+            color=alt.Color(
+                "variable:N",
+                legend=alt.Legend(title="Legend"),
+            ),
+            tooltip=[
+                alt.Tooltip("Date:T", title="Event Date"),
+                alt.Tooltip("variable:N", title="Event"),
+            ],
+        )
+    )
+
+    # Unify color scale, make singel legend --> lines + events 
+    # list possible categories in 'variable':
+    # We can specify a single domain & range across both layered charts to unify them.
+    color_domain = [
+        "lowest_rate_duration",
+        "FF",
+        "Recession Start",
+        "S&P 500 Peak",
+        "S&P 500 Trough"
+    ]
+    color_range = [
+        "#1f77b4",  # blue
+        "#2ca02c",  # green
+        "red",
+        "greenyellow",
+        "gray"
+    ]
+
+    # Define a shared color scale
+    shared_color_scale = alt.Scale(
+        domain=color_domain,
+        range=color_range
+    )
+
+    # Apply scale to both layer encodings by setting scale=shared_color_scale
+    lines = lines.encode(
+        color=alt.Color(
+            "variable:N",
+            scale=shared_color_scale,
+            legend=alt.Legend(
+                title="Line Type",
+                orient="bottom",
+                labelExpr="""
+                {
+                    'lowest_rate_duration': 'Lowest Yielding Duration',
+                    'FF': 'Fed Funds Rate',
+                    'Recession Start': 'Recession Starts',
+                    'S&P 500 Peak': 'S&P 500 Peaks',
+                    'S&P 500 Trough': 'S&P 500 Troughs'
+                }[datum.value] || datum.value
+                """
+            )
+        )
+    )
+
+    rules = rules.encode(
+        color=alt.Color(
+            "variable:N",
+            scale=shared_color_scale,
+            legend=alt.Legend(
+                title="Line Type",
+                orient="bottom"
+            )
+        )
+    )
+
+    final_chart = alt.layer(lines, rules).resolve_scale(color="shared")
+    return final_chart.interactive()
+
+
+@instrumented("chart.highest_yielding_duration_time_series_chart")
+def highest_yielding_duration_time_series_chart(sample_rate="ME", start_date="1965-01-01"):
+    #TODO: add in fed funds rate
+    #TODO: add highest interest rate
+    highest_yield_data = highest_yield_dataframe(sample_rate=sample_rate)
+    df_alt = highest_yield_data.reset_index()
+
+    df_alt = downsample_frame(df_alt, "observation_date", "highest_rate_duration", start=start_date)
+
+    df_recessions = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSIONS)
+    })
+    df_recessions["Event"] = "Recession Starts"
+
+    df_recession_ends = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSION_ENDS)
+    })
+    df_recession_ends["Event"] = "Recession Ends"
+
+    line_chart = (
+        alt.Chart(df_alt)
+        .mark_line()
+        .encode(
+            x=alt.X("observation_date:T", title="Date"),
+            y=alt.Y("highest_rate_duration:Q", title="Maturity Duration"),
+            tooltip=["observation_date:T", "highest_rate_duration:Q"]
+        )
+        .properties(
+            width=700,
+            height=600,
+            title="Highest Yielding Maturity"
+        )
+        .interactive()
+    )
+
+    recession_start_lines = (
+        alt.Chart(df_recessions)
+        .mark_rule(color="red", strokeWidth=2)
+        .encode(
+            x="Date:T",
+            color=alt.Color(
+                "Event:N",
+                legend=alt.Legend(title="Events", orient='bottom'),  
+                scale=alt.Scale(domain=["Recession Starts", "Recession Ends"], range=["red", "blue"])
+            ),
+            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
+        )
+    )
+
+    recession_end_lines = (
+        alt.Chart(df_recession_ends)
+        .mark_rule(color="blue", strokeWidth=2)
+        .encode(
+            x="Date:T",
+            tooltip=[alt.Tooltip("Date:T", title="Event Date")]
+        )
+    )
+
+    # layer main chart and lines
+    layered_chart = alt.layer(
+        line_chart,
+        recession_start_lines,
+        recession_end_lines
+    ).interactive()
+
+    return layered_chart
+
+
+@instrumented("chart.yield_spread_chart")
+def yield_spread_chart(d1="10-year", d2="2-year"):
+    df_yield_spread = create_yield_differential_dataframe(d1, d2)
+    df_yield_spread = df_yield_spread.reset_index()
+    # min/max buckets keep every inversion crossing visible
+    df_yield_spread = downsample_frame(df_yield_spread, "observation_date", "Spread")
+
+    df_recessions = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSIONS[:-2])
+    })
+    df_recessions["Event"] = "Recession Starts"
+
+    line_chart = (
+        alt.Chart(df_yield_spread)
+        .mark_line()
+        .encode(
+            x=alt.X("observation_date:T", title="Date"),
+            y=alt.Y("Spread:Q", title="Spread"),
+        )
+        .properties(
+            width=700,
+            height=600,
+            title=f"Yield Differential: {d1} - {d2}"
+        )
+        .interactive()
+    )
+
+    horizontal_line = alt.Chart(pd.DataFrame({'y': [0]})).mark_rule(color='gray').encode(
+        y='y:Q'
+    )
+
+    recesssion_start_lines = (
+        alt.Chart(df_recessions)
+        .mark_rule(color="red", strokeWidth=2)
+        .encode(
+            x="Date:T",
+            color=alt.Color(
+                "Event:N",
+                legend=alt.Legend(title="Events", orient='bottom'),  
+                scale=alt.Scale(domain=["Recession Starts"], range=["red"])
+            ),
+            tooltip=[alt.Tooltip("Date:T", title="Recession")]
+        )
+    )
+
+    layers = [line_chart, recesssion_start_lines, horizontal_line]
+    # drawn first so the spread stays on top
+    regime = SPREAD_REGIMES.get((d1, d2))
+    if regime is not None:
+        layers.insert(0, _episode_bands(regime))
+    df_gaps = unavailable_periods(d1, d2)
+    if len(df_gaps):
+        layers.insert(0, _unavailable_bands(df_gaps))
+
+    layered_chart = alt.layer(*layers).resolve_scale(y="shared").interactive()
+
+    return layered_chart
+
+
+# spread chart maturities -> episode regime shaded behind the spread
+SPREAD_REGIMES = {("10-year", "2-year"): "10y-2y inversion", ("10-year", "3-month"): "10y-3m inversion"}
+
+
+def _episode_bands(regime):
+    """
+    Shaded bands over a regime's episodes (see episodes.py)
+    """
+    df_episodes = episode_index().regime(regime)[["start", "end", "depth", "lead_days"]]
+
+    return (
+        alt.Chart(df_episodes)
+        .mark_rect(color="red", opacity=0.12)
+        .encode(
+            x="start:T",
+            x2="end:T",
+            tooltip=[alt.Tooltip("start:T", title="Inverted"), alt.Tooltip("end:T", title="Until"),
+                     alt.Tooltip("depth:Q", title="Max Depth", format=".2f"),
+                     alt.Tooltip("lead_days:Q", title="Days to Recession")],
+        )
+    )
+
+
+def _unavailable_bands(df_gaps):
+    """
+    Gray bands over periods a maturity was not published (see availability.py)
+    """
+    return (
+        alt.Chart(df_gaps)
+        .mark_rect(color="gray", opacity=0.2)
+        .encode(
+            x="start:T",
+            x2="end:T",
+            tooltip=[alt.Tooltip("start:T", title="Not Published From"), alt.Tooltip("end:T", title="Until")],
+        )
+    )
+
+
+@instrumented("chart.yield_curve_comparison_chart")
+def yield_curve_comparison_chart(yield_curve1, date1, yield_curve2, date2):
+    """
+    Two yield curves ([(duration, yield), ...]) overlaid, labelled by their dates
+    """
+    yield_curve_df1 = pd.DataFrame(yield_curve1, columns=["duration", date1])
+    yield_curve_df2 = pd.DataFrame(yield_curve2, columns=["duration", date2])
+
+    # Round down to nearest 0.1
+    y_min = math.floor(min(yield_curve_df1[date1]) * 10) / 10
+    y_min = min(y_min, math.floor(min(yield_curve_df2[date2]) * 10) / 10)
+
+    y_max = math.ceil(max(yield_curve_df1[date1]) * 10) / 10
+    y_max = max(y_max, math.ceil(max(yield_curve_df2[date2]) * 10) / 10)
+
+    # inner=intersection, outer=union
+    combined_df = pd.merge(yield_curve_df1, yield_curve_df2, on="duration", how='inner')
+
+    long_df = combined_df.melt(id_vars="duration", value_vars=[date1, date2],
+                               var_name='Series', value_name='Yield')
+
+    line_chart = alt.Chart(long_df).mark_line(interpolate="monotone", size=5).encode(
+        x=alt.X("duration:O", title="Duration", sort=list(combined_df["duration"])),
+        y=alt.Y("Yield:Q", title="Yield", scale=alt.Scale(domain=[y_min, y_max]), axis=alt.Axis(orient="left")),
+        color=alt.Color("Series:N", title=None,
+                        scale=alt.Scale(
+                            domain=[date1, date2],
+                            range=["steelblue", "#a94442"]
+                        ),
+                        legend=alt.Legend(
+                            orient="top",
+                            titleOrient="left",
+                            symbolStrokeWidth=20,
+                            symbolSize=10000,
+                            labelFontSize=20,
+                            padding=0,                            
+                        )
+        )
+    ).properties(
+        width=700,
+        height=600,
+    ).interactive()
+
+    points1 = alt.Chart(yield_curve_df1).mark_point(filled=True, size=75).encode(
+        x=alt.X("duration:O", sort=list(yield_curve_df1["duration"])), # Same x encoding as the line
+        y=alt.Y(f"{date1}:Q", axis=alt.Axis(orient="right", title=None)) # Same y encoding as the line
+    )
+
+    points2 = alt.Chart(yield_curve_df2).mark_point(filled=True, size=75).encode(
+        x=alt.X("duration:O", sort=list(yield_curve_df1["duration"])),
+        y=alt.Y(f"{date2}:Q", axis=alt.Axis(orient="right", title=None)),
+        color=alt.value("#a94442")
+    )
+
+    layered_chart = alt.layer(
+        line_chart,
+        points1,
+        points2,
+    ).interactive()
+
+    return layered_chart
+
+
+@instrumented("chart.fitted_yield_curve_chart")
+def fitted_yield_curve_chart(date1, date2):
+    """
+    Nelson-Siegel-Svensson zero, forward and par curves of two dates at every maturity (see curves.py),
+    with the treasury yields they were fitted to
+    """
+    df_fitted = fitted_curve_dataframe([date1, date2])
+    df_fitted = df_fitted.rename(columns={"zero": "Zero", "forward": "Forward", "par": "Par"})
+    long_df = df_fitted.melt(id_vars=["date", "years"], value_vars=["Zero", "Forward", "Par"],
+                             var_name="Curve", value_name="Yield")
+
+    fits = fitted_curves()
+    points = []
+    for yc_date, row in zip([date1, date2], fits.rows([date1, date2])):
+        if row >= 0:
+            points.append(pd.DataFrame({"date": yc_date, "years": fits.years, "Yield": fits.inputs[row]}))
+    df_points = pd.concat(points, ignore_index=True).dropna() if points else pd.DataFrame(
+        columns=["date", "years", "Yield"])
+
+    color = alt.Color("date:N", title=None, scale=alt.Scale(domain=[date1, date2], range=["steelblue", "#a94442"]),
+                      legend=alt.Legend(orient="top"))
+
+    lines = alt.Chart(long_df).mark_line(size=3).encode(
+        x=alt.X("years:Q", title="Maturity (years)"),
+        y=alt.Y("Yield:Q", title="Yield", scale=alt.Scale(zero=False)),
+        color=color,
+        strokeDash=alt.StrokeDash("Curve:N", scale=alt.Scale(domain=["Zero", "Par", "Forward"],
+                                                              range=[[1, 0], [8, 4], [2, 3]]),
+                                  legend=alt.Legend(orient="top", title=None)),
+        tooltip=["date:N", "Curve:N", alt.Tooltip("years:Q", format=".2f"), alt.Tooltip("Yield:Q", format=".3f")],
+    ).properties(
+        width=700,
+        height=600,
+        title="Fitted Curves (Nelson-Siegel-Svensson)",
+    )
+
+    observed = alt.Chart(df_points).mark_point(filled=True, size=75).encode(
+        x="years:Q",
+        y="Yield:Q",
+        color=color,
+        tooltip=["date:N", alt.Tooltip("years:Q", format=".2f"), alt.Tooltip("Yield:Q", format=".2f")],
+    )
+
+    return alt.layer(lines, observed).interactive()
+
+
+@instrumented("chart.yield_curve_scrubber_chart")
+def yield_curve_scrubber_chart(start_date, end_date, step="W"):
+    """
+    Yield curve at every step between two dates, scrubbed with a slider that runs in the browser
+
+    Every curve ships with the spec once, moving the slider only re-filters the data client-side
+    """
+    curves = yield_curve_history(start_date, end_date, step=step)
+    if curves.empty:
+        # no step date in the range (e.g. a weekend at W) or no data on any of them
+        message = pd.DataFrame({"text": [f"No yield curves between {start_date} and {end_date}"]})
+        return alt.Chart(message).mark_text(fontSize=24).encode(text="text:N").properties(width=700, height=600)
+
+    durations = list(curves.columns)
+    n_steps = len(curves)
+
+    # long format: one row per (step, maturity), maturities as a category to keep the payload small
+    long_df = pd.DataFrame({
+        "step": np.repeat(np.arange(n_steps, dtype=np.int32), len(durations)),
+        "duration": pd.Categorical(np.tile(durations, n_steps), categories=durations),
+        "Yield": curves.to_numpy().ravel(),
+    }).dropna()
+    step_dates = pd.DataFrame({"step": np.arange(n_steps, dtype=np.int32),
+                               "Date": curves.index.strftime("%Y-%m-%d")})
+
+    # fixed y scale so the curve moves instead of the axis
+    y_min = math.floor(long_df["Yield"].min() * 10) / 10
+    y_max = math.ceil(long_df["Yield"].max() * 10) / 10
+
+    step_param = alt.param(
+        name="curve_step",
+        value=n_steps - 1,
+        bind=alt.binding_range(min=0, max=max(n_steps - 1, 0), step=1, name="Date "),
+    )
+
+    curve = alt.Chart(long_df).mark_line(interpolate="monotone", size=5, point=alt.OverlayMarkDef(size=75)).encode(
+        x=alt.X("duration:O", title="Duration", sort=durations),
+        y=alt.Y("Yield:Q", title="Yield", scale=alt.Scale(domain=[y_min, y_max])),
+        tooltip=["duration:O", "Yield:Q"],
+    ).transform_filter(
+        alt.datum.step == step_param
+    ).add_params(
+        step_param
+    ).properties(
+        width=700,
+        height=600,
+    )
+
+    date_label = alt.Chart(step_dates).mark_text(align="right", baseline="top", x="width", y=0, fontSize=24).encode(
+        text="Date:N",
+    ).transform_filter(
+        alt.datum.step == step_param
+    )
+
+    return alt.layer(curve, date_label)
+
+
+def _recession_start_rules(domain, color_range):
+    """
+    Recession start rules sharing a color legend (Event) with the chart's own series
+    """
+    df_recessions = pd.DataFrame({
+        "Date": pd.to_datetime(RECESSIONS)
+    })
+    df_recessions["Event"] = "Recession Starts"
+
+    return (
+        alt.Chart(df_recessions)
+        .mark_rule(strokeWidth=1)
+        .encode(
+            x="Date:T",
+            color=alt.Color("Event:N", scale=alt.Scale(domain=domain, range=color_range),
+                            legend=alt.Legend(title=None, orient="bottom")),
+            tooltip=[alt.Tooltip("Date:T", title="Recession")],
+        )
+    )
+
+
+@instrumented("chart.forward_rate_chart")
+def forward_rate_chart(tenors=("1y1y", "5y5y", "2y10y"), sample_rate="W", start_date="1965-01-01"):
+    """
+    Implied forward rates over time, e.g. 5y5y: the 5 year rate 5 years from now (see analytics.py)
+    """
+    tenors = list(tenors)
+    df_forwards = forward_rate_dataframe(sample_rate=sample_rate)[tenors].reset_index()
+    df_forwards = downsample_frame(df_forwards, "observation_date", tenors, start=start_date)
+    df_forwards = df_forwards.melt(id_vars="observation_date", var_name="Event", value_name="Forward Rate")
+
+    domain = tenors + ["Recession Starts"]
+    color_range = ["#1f77b4", "#2ca02c", "#9467bd", "#8c564b", "#e377c2"][:len(tenors)] + ["red"]
+
+    lines = (
+        alt.Chart(df_forwards)
+        .mark_line()
+        .encode(
+            x=alt.X("observation_date:T", title="Date"),
+            y=alt.Y("Forward Rate:Q", title="Forward Rate %"),
+            color=alt.Color("Event:N", scale=alt.Scale(domain=domain, range=color_range),
+                            legend=alt.Legend(title=None, orient="bottom")),
+            tooltip=["observation_date:T", "Event:N", alt.Tooltip("Forward Rate:Q", format=".2f")],
+        )
+        .properties(
+            width=700,
+            height=600,
+            title="Implied Forward Rates",
+        )
+    )
+
+    return alt.layer(lines, _recession_start_rules(domain, color_range)).interactive()
+
+
+@instrumented("chart.spread_volatility_chart")
+def spread_volatility_chart(spreads=("10y-2y", "high-low"), sample_rate="W", start_date="1965-01-01"):
+    """
+    Annualized rolling volatility of daily spread changes in basis points (see analytics.py)
+    """
+    spreads = list(spreads)
+    df_volatility = spread_volatility_dataframe(sample_rate=sample_rate)[spreads].reset_index()
+    df_volatility = downsample_frame(df_volatility, "observation_date", spreads, start=start_date)
+    df_volatility = df_volatility.melt(id_vars="observation_date", var_name="Event", value_name="Volatility")
+
+    domain = spreads + ["Recession Starts"]
+    color_range = ["#1f77b4", "#ff7f0e", "#2ca02c"][:len(spreads)] + ["red"]
+
+    lines = (
+        alt.Chart(df_volatility)
+        .mark_line()
+        .encode(
+            x=alt.X("observation_date:T", title="Date"),
+            y=alt.Y("Volatility:Q", title="Annualized Volatility (bp)"),
+            color=alt.Color("Event:N", scale=alt.Scale(domain=domain, range=color_range),
+                            legend=alt.Legend(title=None, orient="bottom")),
+            tooltip=["observation_date:T", "Event:N", alt.Tooltip("Volatility:Q", format=".1f")],
+        )
+        .properties(
+            width=700,
+            height=600,
+            title="Spread Volatility (3 month rolling window)",
+        )
+    )
+
+    return alt.layer(lines, _recession_start_rules(domain, color_range)).interactive()
@@ -0,0 +1,97 @@
+"""
+Compact in-memory form of a yield panel: float32 values, int32 day numbers and bitset masks
+
+FRED yields have two decimals, so float32 rounded back to two decimals gives the csv values
+exactly while taking half the memory of float64. The observed mask takes 1 bit a cell instead of 1 byte.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# resident bytes a process may spend on one panel and its pyramids, unlimited when unset
+_budget_mb = os.environ.get("CMH_MEMORY_BUDGET_MB")
+MEMORY_BUDGET_BYTES = int(float(_budget_mb) * 1e6) if _budget_mb else None
+
+DECIMALS = 2
+
+
+def to_day_numbers(dates):
+    """
+    int32 days since 1970-01-01 for a DatetimeIndex/datetime64 array
+    """
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int32)
+
+
+def from_day_numbers(days):
+    return pd.DatetimeIndex(np.asarray(days).astype("datetime64[D]").astype("datetime64[ns]"),
+                            name="observation_date")
+
+
+def pack_mask(mask):
+    """
+    Bool (dates x series) matrix to a (ceil(dates / 8) x series) uint8 bitset
+    """
+    return np.packbits(mask, axis=0)
+
+
+def unpack_mask(bits, n_rows):
+    return np.unpackbits(bits, axis=0, count=n_rows).view(bool)
+
+
+class CompactPanel:
+    """
+    days:          int32 day numbers, the shared date index
+    values:        float32 matrix (dates x series), NaN for blank or absent rows
+    observed_bits: bitset of the observed mask (see pack_mask)
+    """
+    def __init__(self, days, values, observed_bits, series, decimals=DECIMALS):
+        self.days = days
+        self.values = values
+        self.observed_bits = observed_bits
+        self.series = list(series)
+        self.decimals = decimals
+
+    @classmethod
+    def from_dense(cls, dates, values, observed, series, decimals=DECIMALS):
+        """
+        Raises:
+            ValueError: when values have more precision than float32 at `decimals` decimals keeps
+        """
+        compact_values = values.astype(np.float32)
+        if not np.array_equal(_decode(compact_values, decimals), values, equal_nan=True):
+            raise ValueError(f"values do not round trip through float32 at {decimals} decimals")
+
+        compact_values.flags.writeable = False
+        return cls(to_day_numbers(dates), compact_values, pack_mask(observed), series, decimals=decimals)
+
+    def dense_values(self):
+        return _decode(self.values, self.decimals)
+
+    def observed(self):
+        return unpack_mask(self.observed_bits, len(self.days))
+
+    def take(self, rows, cols):
+        """
+        float64 values at (rows, cols), like dense_values()[rows, cols] without decoding the whole matrix
+        """
+        return _decode(self.values[rows, cols], self.decimals)
+
+    def observed_column(self, col):
+        return unpack_mask(self.observed_bits[:, col], len(self.days))
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes + self.values.nbytes + self.observed_bits.nbytes
+
+
+def _decode(values, decimals):
+    return np.round(values.astype(np.float64), decimals)
+
+
+def level_nbytes(level):
+    """
+    Bytes held by one pyramid level (see derived.resample_level), arrays shared between stats counted once
+    """
+    arrays = {id(array): array for array in level.values()}
+    return sum(array.nbytes for array in arrays.values())
@@ -0,0 +1,402 @@
+"""
+Model yield curves fitted to the treasury panel: Nelson-Siegel-Svensson and natural cubic splines
+
+NSS betas are linear given (tau1, tau2), so every date is fitted at once: batched least squares over
+a tau grid, then a shrinking local grid around each date's best taus. Fits are cached per data version
+(and persisted next to the panel store); after a refresh only new or revised dates are refitted, starting
+from the previous date's taus.
+
+The CMT inputs are par yields; fitted curves are read as continuously compounded zero curves for
+forwards and par yields, the usual approximation at chart resolution.
+"""
+import functools
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import derived
+from instrumentation import annotate, instrumented
+import utils
+
+# treasury maturities the curves are fitted to, fed funds is a policy rate not a point on the curve
+FIT_SERIES = [series_id for series_id in utils.TREASURY_SERIES if series_id != "FF"]
+MIN_POINTS = 5
+
+TAU1_GRID = np.geomspace(0.25, 6, 10)
+TAU2_GRID = np.geomspace(1, 30, 10)
+REFINE_FACTORS = (1.6, 1.25, 1.1)
+TAU_BOUNDS = (0.1, 50)
+RIDGE = 1e-6
+
+# maturities (years) the fitted curves are drawn and served at by default
+FITTED_MATURITIES = np.round(np.arange(0.25, 30.01, 0.25), 2)
+
+_fits = {}
+_fits_lock = threading.Lock()
+
+
+def nss_loadings(years, taus):
+    """
+    (dates x maturities x 4) loadings of beta0..beta3 for per-date (tau1, tau2)
+    """
+    years = np.asarray(years, dtype=np.float64)
+    taus = np.atleast_2d(taus)
+
+    x1 = years[None, :] / taus[:, 0:1]
+    x2 = years[None, :] / taus[:, 1:2]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope1 = np.where(x1 > 0, -np.expm1(-x1) / x1, 1.0)
+        slope2 = np.where(x2 > 0, -np.expm1(-x2) / x2, 1.0)
+
+    return np.stack([np.ones_like(x1), slope1, slope1 - np.exp(-x1), slope2 - np.exp(-x2)], axis=-1)
+
+
+def nss_yields(params, years):
+    """
+    Fitted yields (dates x maturities) from (dates x 6) beta0..beta3, tau1, tau2 parameters
+    """
+    params = np.atleast_2d(params)
+    return (nss_loadings(years, params[:, 4:6]) @ params[:, :4, None])[..., 0]
+
+
+def nss_forwards(params, years):
+    """
+    Instantaneous forward rates (dates x maturities), closed form of d(t * y(t)) / dt
+    """
+    params = np.atleast_2d(params)
+    years = np.asarray(years, dtype=np.float64)
+    x1 = years[None, :] / params[:, 4:5]
+    x2 = years[None, :] / params[:, 5:6]
+    return (params[:, 0:1] + params[:, 1:2] * np.exp(-x1) + params[:, 2:3] * x1 * np.exp(-x1)
+            + params[:, 3:4] * x2 * np.exp(-x2))
+
+
+def par_yields(params, years):
+    """
+    Semiannual coupon par yields (dates x maturities) implied by the fitted zero curves
+    """
+    params = np.atleast_2d(params)
+    par = np.full((len(params), len(years)), np.nan)
+
+    for i, maturity in enumerate(np.asarray(years, dtype=np.float64)):
+        if maturity <= 0:
+            par[:, i] = nss_yields(params, [0.0])[:, 0]
+            continue
+        # coupon dates counted back from maturity in half years
+        pay_times = maturity - 0.5 * np.arange(int(np.ceil(maturity / 0.5)))
+        discount = np.exp(-nss_yields(params, pay_times) / 100 * pay_times)
+        if maturity <= 0.5:
+            # single payment, money market convention
+            par[:, i] = (1 / discount[:, 0] - 1) / maturity * 100
+        else:
+            par[:, i] = (1 - discount[:, 0]) / (0.5 * discount.sum(axis=1)) * 100
+
+    return par
+
+
+def _solve_betas(loadings, values, weights):
+    """
+    Batched weighted least squares: betas (dates x 4) and sum of squared errors per date
+
+    loadings: (maturities x 4) shared by every date, or (dates x maturities x 4)
+    """
+    # values are 0 where weights are 0, so weights * values is the weighted right hand side
+    if loadings.ndim == 2:
+        outer = (loadings[:, :, None] * loadings[:, None, :]).reshape(len(loadings), 16)
+        normal = (weights @ outer).reshape(-1, 4, 4)
+        rhs = (weights * values) @ loadings
+    else:
+        weighted = loadings * weights[:, :, None]
+        normal = weighted.transpose(0, 2, 1) @ loadings
+        rhs = (weighted * values[:, :, None]).sum(axis=1)
+
+    betas = np.linalg.solve(normal + RIDGE * np.eye(4), rhs[..., None])[..., 0]
+    if loadings.ndim == 2:
+        residuals = values - betas @ loadings.T
+    else:
+        residuals = values - (loadings @ betas[:, :, None])[..., 0]
+    sse = (weights * residuals ** 2).sum(axis=1)
+    return betas, sse
+
+
+def fit_nss(years, values, init_taus=None):
+    """
+    Fit every row of a (dates x maturities) yield matrix, NaN for unobserved maturities
+
+    init_taus: (dates x 2) starting taus, e.g. the previous date's, tried alongside the coarse grid (NaN: none)
+    Returns:
+        (params (dates x 6), rmse per date), NaN rows where fewer than MIN_POINTS maturities are observed
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_dates = len(values)
+    weights = (~np.isnan(values)).astype(np.float64)
+    filled = np.nan_to_num(values)
+
+    best_sse = np.full(n_dates, np.inf)
+    best_betas = np.zeros((n_dates, 4))
+    best_taus = np.full((n_dates, 2), np.nan)
+
+    if init_taus is not None:
+        warm = ~np.isnan(init_taus).any(axis=1)
+        best_taus[warm] = init_taus[warm]
+        best_betas[warm], best_sse[warm] = _solve_betas(nss_loadings(years, best_taus[warm]),
+                                                        filled[warm], weights[warm])
+
+    # the coarse grid still runs for warm started rows: the NSS objective has local minima, refining from the
+    # previous date's taus alone left about 2% of dates up to 7bp worse, and refits are small (20 dates: 25ms)
+    for tau1 in TAU1_GRID:
+        for tau2 in TAU2_GRID[TAU2_GRID > tau1]:
+            betas, sse = _solve_betas(nss_loadings(years, [[tau1, tau2]])[0], filled, weights)
+            better = sse < best_sse
+            best_sse[better], best_betas[better], best_taus[better] = sse[better], betas[better], (tau1, tau2)
+
+    # local refinement: every date moves to the best of a 5x5 multiplicative grid around its taus
+    for factor in REFINE_FACTORS:
+        steps = np.geomspace(1 / factor, factor, 5)
+        center = best_taus.copy()
+        for step1 in steps:
+            for step2 in steps:
+                taus = np.clip(center * (step1, step2), *TAU_BOUNDS)
+                taus[:, 1] = np.maximum(taus[:, 1], taus[:, 0] * 1.01)
+                betas, sse = _solve_betas(nss_loadings(years, taus), filled, weights)
+                better = sse < best_sse
+                best_sse[better], best_betas[better], best_taus[better] = sse[better], betas[better], taus[better]
+
+    n_points = weights.sum(axis=1)
+    params = np.concatenate([best_betas, best_taus], axis=1)
+    params[n_points < MIN_POINTS] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rmse = np.where(n_points >= MIN_POINTS, np.sqrt(best_sse / n_points), np.nan)
+    return params, rmse
+
+
+@functools.lru_cache(maxsize=256)
+def spline_matrix(knots, targets):
+    """
+    (targets x knots) matrix mapping yields at the knots to the natural cubic spline at the targets
+
+    The spline is linear in the knot values, so one matrix serves every date with the same observed
+    maturities. Targets outside the knots take the nearest end value.
+    """
+    x = np.asarray(knots, dtype=np.float64)
+    t = np.clip(np.asarray(targets, dtype=np.float64), x[0], x[-1])
+    k = len(x)
+
+    # second derivatives M = S @ y, zero at both ends (natural spline)
+    second = np.zeros((k, k))
+    if k > 2:
+        h = np.diff(x)
+        system = np.zeros((k - 2, k - 2))
+        rhs = np.zeros((k - 2, k))
+        for i in range(k - 2):
+            system[i, i] = (h[i] + h[i + 1]) / 3
+            if i > 0:
+                system[i, i - 1] = h[i] / 6
+            if i < k - 3:
+                system[i, i + 1] = h[i + 1] / 6
+            rhs[i, i] += 1 / h[i]
+            rhs[i, i + 1] -= 1 / h[i] + 1 / h[i + 1]
+            rhs[i, i + 2] += 1 / h[i + 1]
+        second[1:-1] = np.linalg.solve(system, rhs)
+
+    interval = np.clip(np.searchsorted(x, t, side="right") - 1, 0, k - 2)
+    x0, x1 = x[interval], x[interval + 1]
+    width = x1 - x0
+    a, b = (x1 - t) / width, (t - x0) / width
+
+    matrix = np.zeros((len(t), k))
+    rows = np.arange(len(t))
+    matrix[rows, interval] += a
+    matrix[rows, interval + 1] += b
+    matrix += ((a ** 3 - a)[:, None] * second[interval] + (b ** 3 - b)[:, None] * second[interval + 1]) \
+        * (width ** 2 / 6)[:, None]
+    matrix.flags.writeable = False
+    return matrix
+
+
+def spline_yields(years, values, targets):
+    """
+    Natural cubic spline through each row's observed maturities, evaluated at the target maturities
+
+    Rows are grouped by which maturities they observe, each group is one matrix product.
+    """
+    years = np.asarray(years, dtype=np.float64)
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    observed = ~np.isnan(values)
+
+    result = np.full((len(values), len(targets)), np.nan)
+    patterns, pattern_rows = np.unique(observed, axis=0, return_inverse=True)
+    for p, pattern in enumerate(patterns):
+        if pattern.sum() < 2:
+            continue
+        rows = pattern_rows.ravel() == p
+        matrix = spline_matrix(tuple(years[pattern]), tuple(np.asarray(targets, dtype=np.float64)))
+        result[rows] = values[rows][:, pattern] @ matrix.T
+    return result
+
+
+class CurveFits:
+    """
+    NSS fit of every panel date with at least MIN_POINTS treasury maturities
+
+    dates:  DatetimeIndex of fitted dates
+    years:  maturities fitted to, in years (FIT_SERIES order)
+    inputs: (dates x maturities) yields the fit saw, used to reuse fits across data versions
+    params: (dates x 6) beta0..beta3 (percent) and tau1, tau2 (years)
+    rmse:   fit error per date, percentage points
+    """
+    def __init__(self, dates, years, inputs, params, rmse):
+        self.dates = dates
+        self.years = years
+        self.inputs = inputs
+        self.params = params
+        self.rmse = rmse
+
+    def rows(self, query_dates):
+        """
+        Row of the latest fit on or before each query date, -1 before the first
+        """
+        query = pd.DatetimeIndex(np.atleast_1d(query_dates)).values
+        return self.dates.searchsorted(query, side="right") - 1
+
+    def params_at(self, query_dates):
+        rows = self.rows(query_dates)
+        return np.where((rows >= 0)[:, None], self.params[np.maximum(rows, 0)], np.nan)
+
+    def yields(self, query_dates, years):
+        return nss_yields(self.params_at(query_dates), years)
+
+    def forwards(self, query_dates, years):
+        return nss_forwards(self.params_at(query_dates), years)
+
+    def par_yields(self, query_dates, years):
+        return par_yields(self.params_at(query_dates), years)
+
+    def arrays(self):
+        return {"dates": self.dates.values, "years": self.years, "inputs": self.inputs, "params": self.params,
+                "rmse": self.rmse}
+
+
+def _fit_inputs(panel):
+    cols = [panel.column(series_id) for series_id in FIT_SERIES]
+    values = panel.values[:, cols]
+    rows = (~np.isnan(values)).sum(axis=1) >= MIN_POINTS
+    years = np.array([derived.maturity_years(panel.maturities[col]) for col in cols])
+    return panel.dates[rows], years, values[rows]
+
+
+def _reuse_previous(dates, inputs, previous):
+    """
+    Params of rows whose date and inputs are unchanged since the previous fit, plus warm start taus
+    (the taus of the closest earlier reused row) for the rest
+    """
+    params = np.full((len(dates), 6), np.nan)
+    rmse = np.full(len(dates), np.nan)
+
+    prev_dates = previous["dates"]
+    pos = np.minimum(np.searchsorted(prev_dates, dates.values), len(prev_dates) - 1)
+    same = (prev_dates[pos] == dates.values) & (previous["inputs"].shape[1:] == inputs.shape[1:])
+    if same.any():
+        same &= ((previous["inputs"][pos] == inputs) | (np.isnan(previous["inputs"][pos]) & np.isnan(inputs))).all(1)
+    params[same] = previous["params"][pos[same]]
+    rmse[same] = previous["rmse"][pos[same]]
+
+    # forward fill taus of reused rows onto the rows that need fitting
+    last_reused = np.maximum.accumulate(np.where(same, np.arange(len(dates)), -1))
+    init_taus = np.where((last_reused >= 0)[:, None], params[np.maximum(last_reused, 0), 4:6], np.nan)
+    return same, params, rmse, init_taus
+
+
+@instrumented()
+def fitted_curves(data_directory_path=utils.CONSTANT_MATURITIES_DATA_DIR):
+    """
+    CurveFits for the current data, fitted once per data version
+
+    Persisted in the panel store, a new data version only refits dates that are new or whose yields changed
+    """
+    panel = utils.load_yield_panel(data_directory_path)
+    fits = _fits.get(panel.version)
+    annotate(cache_hit=fits is not None)
+    if fits is not None:
+        return fits
+
+    with _fits_lock:
+        fits = _fits.get(panel.version)
+        if fits is not None:
+            return fits
+
+        dates, years, inputs = _fit_inputs(panel)
+        cache_file = os.path.join(panel.store_dir, "curve-fits.npz") if panel.store_dir else None
+        # any version: rows the new data did not touch are reused
+        previous = derived.load_derived(cache_file, None) if cache_file else None
+
+        if previous is not None and len(previous["dates"]):
+            reused, params, rmse, init_taus = _reuse_previous(dates, inputs, previous)
+        else:
+            reused, params, rmse, init_taus = np.zeros(len(dates), dtype=bool), None, None, None
+
+        if not reused.all():
+            todo = ~reused
+            fitted_params, fitted_rmse = fit_nss(years, inputs[todo],
+                                                 init_taus=None if init_taus is None else init_taus[todo])
+            if params is None:
+                params, rmse = fitted_params, fitted_rmse
+            else:
+                params[todo], rmse[todo] = fitted_params, fitted_rmse
+        annotate(rows=int((~reused).sum()))
+
+        fits = CurveFits(dates, years, inputs, params, rmse)
+        if cache_file is not None and not reused.all():
+            try:
+                derived.save_derived(cache_file, panel.version, fits.arrays())
+            except OSError as e:
+                print(f"could not write curve fits: {e}")
+
+        _fits.clear()
+        _fits[panel.version] = fits
+        return fits
+
+
+@instrumented()
+def fitted_curve_dataframe(yc_dates, years=FITTED_MATURITIES):
+    """
+    NSS zero, instantaneous forward and par curves on each date, from the latest fit on or before it
+
+    Returns:
+        long DataFrame: date (requested, YYYY-MM-DD), fit_date, years, zero, forward, par, rmse
+    """
+    fits = fitted_curves()
+    years = np.asarray(years, dtype=np.float64)
+    rows = fits.rows(yc_dates)
+    frames = []
+    for yc_date, row in zip(yc_dates, rows):
+        if row < 0:
+            continue
+        params = fits.params[row:row + 1]
+        frames.append(pd.DataFrame({
+            "date": str(yc_date),
+            "fit_date": fits.dates[row].strftime("%Y-%m-%d"),
+            "years": years,
+            "zero": nss_yields(params, years)[0],
+            "forward": nss_forwards(params, years)[0],
+            "par": par_yields(params, years)[0],
+            "rmse": fits.rmse[row],
+        }))
+    columns = ["date", "fit_date", "years", "zero", "forward", "par", "rmse"]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def fitted_yield_curve(yc_date, years, model="nss"):
+    """
+    Yields at any maturities (years) on a date, from the NSS fit or a spline through that day's curve
+    """
+    if model == "nss":
+        return fitted_curves().yields(yc_date, years)[0]
+
+    panel = utils.load_yield_panel()
+    values, _ = panel.asof(yc_date)
+    cols = [panel.column(series_id) for series_id in FIT_SERIES]
+    knots = [derived.maturity_years(panel.maturities[col]) for col in cols]
+    return spline_yields(knots, values[:, cols], years)[0]
@@ -0,0 +1,128 @@
+import os
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+DERIVED_SERIES = ("highest_yield", "lowest_yield", "min_max_spread", "lowest_rate_duration", "highest_rate_duration")
+
+# resolutions and statistics kept pre-aggregated for every series
+PYRAMID_LEVELS = ("D", "W", "ME", "QE", "YE")
+PYRAMID_STATS = ("mean", "min", "max", "last")
+
+
+def maturity_years(maturity):
+    """
+    Float years for a maturity label('1-year' -> 1.0, '6-month' -> 0.5, '0-month' -> 0.0)
+    """
+    count, unit = maturity.split("-")
+    if unit == "month":
+        return round(int(count) / 12, 3)
+    return float(count)
+
+
+def level_key(sample_rate):
+    """
+    Canonical name of a resample rule, so aliases share a level ('W' and 'W-SUN')
+    """
+    return pd.tseries.frequencies.to_offset(sample_rate).freqstr
+
+
+PYRAMID_LEVEL_KEYS = frozenset(level_key(sample_rate) for sample_rate in PYRAMID_LEVELS)
+
+
+def resample_level(dates, matrix, sample_rate):
+    """
+    One pyramid level: bin dates plus a (bins x series) matrix per PYRAMID_STATS entry
+    """
+    resampler = pd.DataFrame(np.asarray(matrix), index=dates).resample(sample_rate)
+
+    level = {}
+    for stat in PYRAMID_STATS:
+        if stat != "mean" and level_key(sample_rate) == "D":
+            # at most one observation per day, every statistic is the daily value
+            level[stat] = level["mean"]
+            continue
+        frame = getattr(resampler, stat)()
+        level[stat] = frame.to_numpy(dtype=np.float64)
+        level[stat].flags.writeable = False
+        level["dates"] = frame.index.values
+
+    return level
+
+
+def build_pyramid(dates, matrix, levels=PYRAMID_LEVELS):
+    """
+    Pre-aggregate a (dates x series) matrix at every level, built once per data version
+
+    Returns:
+        {level_key: resample_level(...)}
+    """
+    return {level_key(sample_rate): resample_level(dates, matrix, sample_rate) for sample_rate in levels}
+
+
+def compute_derived(dates, matrix, maturities):
+    """
+    Per-row extremes of a resampled (dates x maturities) matrix in one vectorized pass
+
+    Returns:
+        dict of numpy arrays: dates and every DERIVED_SERIES entry
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+
+    missing = np.isnan(matrix)
+    any_valid = ~missing.all(axis=1)
+    years = np.array([maturity_years(maturity) for maturity in maturities], dtype=np.float64)
+
+    # argmin/argmax pick the first (shortest) maturity on ties, like DataFrame.idxmin/idxmax
+    lowest_col = np.where(missing, np.inf, matrix).argmin(axis=1)
+    highest_col = np.where(missing, -np.inf, matrix).argmax(axis=1)
+    rows = np.arange(len(matrix))
+
+    lowest_yield = np.where(any_valid, matrix[rows, lowest_col], np.nan)
+    highest_yield = np.where(any_valid, matrix[rows, highest_col], np.nan)
+
+    return {
+        "dates": np.asarray(dates),
+        "highest_yield": highest_yield,
+        "lowest_yield": lowest_yield,
+        "min_max_spread": highest_yield - lowest_yield,
+        "lowest_rate_duration": np.where(any_valid, years[lowest_col], np.nan),
+        "highest_rate_duration": np.where(any_valid, years[highest_col], np.nan),
+    }
+
+
+def derived_cache_file(store_dir, sample_rate):
+    return os.path.join(store_dir, f"derived-{sample_rate}.npz")
+
+
+def save_derived(cache_file, version, derived):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # unique per process and thread, shared serving workers may write the same cache file at once
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    try:
+        np.savez(tmp_file, version=np.array(version), **derived)
+        os.replace(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def load_derived(cache_file, version):
+    """
+    Load persisted derived arrays, None if missing or computed from a different data version
+
+    version: None accepts arrays from any data version
+    """
+    if not os.path.exists(cache_file):
+        return None
+
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if version is not None and str(cached["version"]) != version:
+                return None
+            return {name: cached[name] for name in cached.files if name != "version"}
+    except (OSError, ValueError, KeyError) as e:
+        warnings.warn(f"ignoring unreadable derived cache {cache_file}: {e}")
+        return None
@@ -0,0 +1,221 @@
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+
+FRED_API_URL = "https://api.stlouisfed.org/fred"
+
+# FRED allows 120 requests a minute per api key
+FRED_REQUESTS_PER_SECOND = 2.0
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class FredRequestError(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Spaces out calls across threads to at most `rate` per second
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def delay(self, seconds):
+        """
+        Push back every thread's next request, used when the server says to slow down
+        """
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
+
+class FredHTTPClient:
+    """
+    Minimal FRED observations client with the same get_series interface as fredapi.Fred
+
+    Keeps one keep-alive connection per thread, retries connection errors, 429s and 5xxs
+    with exponential backoff (honoring Retry-After), and shares a rate limit across threads
+    """
+    def __init__(self, api_key, root_url=FRED_API_URL, max_retries=5, backoff_seconds=0.5,
+                 requests_per_second=FRED_REQUESTS_PER_SECOND, timeout=30):
+        self.api_key = api_key
+        self.root_url = root_url
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+        url = urlsplit(root_url)
+        self._scheme = url.scheme
+        self._host = url.netloc
+        self._base_path = url.path.rstrip("/")
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+            conn = conn_class(self._host, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def _get_json(self, path, params):
+        url = f"{self._base_path}{path}?{urlencode(params)}"
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            retry_after = None
+            try:
+                conn = self._connection()
+                conn.request("GET", url, headers={"Connection": "keep-alive"})
+                response = conn.getresponse()
+                body = response.read()
+
+                if response.status == 200:
+                    return json.loads(body)
+                if response.status not in RETRY_STATUS_CODES:
+                    raise FredRequestError(f"FRED request failed ({response.status}): {body[:200]!r}")
+
+                error = FredRequestError(f"FRED request failed ({response.status})")
+                if response.getheader("Retry-After", "").isdigit():
+                    retry_after = int(response.getheader("Retry-After"))
+            except (http.client.HTTPException, OSError) as e:
+                self._reset_connection()
+                error = e
+
+            if attempt == self.max_retries:
+                raise FredRequestError(f"giving up after {attempt + 1} attempts: {error}")
+
+            sleep_time = self.backoff_seconds * 2 ** attempt * (1 + random.random() / 2)
+            if retry_after is not None:
+                sleep_time = max(sleep_time, retry_after)
+                self.rate_limiter.delay(sleep_time)
+            time.sleep(sleep_time)
+
+    def get_series(self, series_id, observation_start=None, observation_end=None):
+        params = {"series_id": series_id, "api_key": self.api_key, "file_type": "json"}
+        if observation_start is not None:
+            params["observation_start"] = pd.Timestamp(observation_start).strftime("%Y-%m-%d")
+        if observation_end is not None:
+            params["observation_end"] = pd.Timestamp(observation_end).strftime("%Y-%m-%d")
+
+        observations = self._get_json("/series/observations", params)["observations"]
+
+        # FRED uses "." for missing values
+        values = np.array([np.nan if obs["value"] == "." else float(obs["value"]) for obs in observations],
+                          dtype=np.float64)
+        dates = pd.DatetimeIndex([obs["date"] for obs in observations])
+        return pd.Series(values, index=dates, name=series_id)
+
+
+def write_series_csv(csv_filename, data, observation_start=None):
+    """
+    Write a series to csv through a temp file + rename, so readers never see a partial file
+
+    With observation_start, rows of the existing file before that date are kept and data is appended.
+    A file whose content would not change is left untouched, so its mtime keeps every cache valid.
+
+    Returns:
+        True if the file was written
+    """
+    data_csv = data.to_csv(header=False, date_format="%Y-%m-%d")
+
+    existing_lines = None
+    if os.path.exists(csv_filename):
+        with open(csv_filename) as f:
+            existing_lines = f.readlines()
+
+    kept_lines = [f"observation_date,{data.name}\n"]
+    if observation_start is not None:
+        start_str = observation_start.strftime("%Y-%m-%d")
+        kept_lines = list(existing_lines)
+
+        # csv is date ordered, drop any trailing rows the new data replaces (e.g. blank holidays)
+        keep = len(kept_lines)
+        while keep > 1 and kept_lines[keep - 1][:10] >= start_str:
+            keep -= 1
+        kept_lines = kept_lines[:keep]
+        if not kept_lines[-1].endswith("\n"):
+            kept_lines[-1] += "\n"
+
+    content = "".join(kept_lines) + data_csv
+    if existing_lines is not None and "".join(existing_lines) == content:
+        return False
+
+    # unique per thread, two refreshes of the same series never share a temp file
+    tmp_filename = f"{csv_filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_filename, "w") as f:
+            f.write(content)
+        os.replace(tmp_filename, csv_filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return True
+
+
+def _refresh_series(fred, series_id, csv_filename, observation_start):
+    data = fred.get_series(series_id, observation_start=observation_start)
+    if observation_start is not None:
+        if len(data) == 0:
+            return 0
+        data = data[data.index >= pd.Timestamp(observation_start)]
+        if data.empty:
+            return 0
+
+    data.name = series_id
+    if not write_series_csv(csv_filename, data, observation_start=observation_start):
+        return 0
+    return len(data)
+
+
+def refresh_series_csvs(fred, observation_starts, data_directory_path, max_workers=4):
+    """
+    Fetch and write series concurrently, at most max_workers requests in flight
+
+    observation_starts: {series_id: date or None}, None downloads the full history
+    Returns:
+        ({series_id: new row count}, {series_id: exception}) -- a failed series leaves its csv untouched
+    """
+    written = {}
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            series_id: executor.submit(_refresh_series, fred, series_id,
+                                       os.path.join(data_directory_path, series_id + ".csv"), observation_start)
+            for series_id, observation_start in observation_starts.items()
+        }
+        for series_id, future in futures.items():
+            try:
+                written[series_id] = future.result()
+            except Exception as e:
+                errors[series_id] = e
+
+    return written, errors
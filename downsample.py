@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# altair chart width used across app.py, charts stretch to the container but rarely past ~2x this
+CHART_WIDTH_PX = 700
+POINTS_PER_PIXEL = 2
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def minmax_indices(x, y, n_buckets):
+    """
+    Row indices of the min and max y in each of n_buckets equal-width x buckets, plus both endpoints
+
+    Keeps every peak, trough and sign change (spread inversions) that a bucket contains
+    """
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= 2 * n_buckets:
+        return np.arange(len(x))
+
+    span = x[-1] - x[0]
+    if span:
+        buckets = np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    else:
+        buckets = np.zeros(len(x), dtype=np.int64)
+
+    # NaNs sort last within a bucket, so they are only picked if the whole bucket is NaN
+    rows = np.arange(len(x))
+    by_min = np.lexsort((rows, np.where(np.isnan(y), np.inf, y), buckets))
+    by_max = np.lexsort((rows, np.where(np.isnan(y), np.inf, -y), buckets))
+
+    starts = np.flatnonzero(np.r_[True, buckets[by_min][1:] != buckets[by_min][:-1]])
+    keep = np.concatenate([by_min[starts], by_max[starts], [0, len(x) - 1]])
+    return np.unique(keep)
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-triangle-three-buckets: n_out row indices that best preserve the visual shape of y
+    """
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = np.nanmean(y[next_lo:next_hi]) if not np.isnan(y[next_lo:next_hi]).all() else y[prev]
+
+        area = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + (int(np.nanargmax(area)) if not np.isnan(area).all() else 0)
+        keep[i + 1] = prev
+
+    return keep
+
+
+def downsample_frame(df, x_col, y_cols, width_px=CHART_WIDTH_PX, start=None, end=None, method="minmax"):
+    """
+    Reduce a long time series frame to about POINTS_PER_PIXEL points per pixel of chart width
+
+    df:     frame sorted by x_col
+    y_cols: column(s) whose shape must survive, rows kept for any of them are kept for all
+    start/end: visible x range, rows outside it are dropped first
+    method: "minmax" (keeps extremes/crossings) or "lttb" (keeps overall shape)
+    """
+    if isinstance(y_cols, str):
+        y_cols = [y_cols]
+
+    if start is not None:
+        df = df[df[x_col] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df[x_col] <= pd.Timestamp(end)]
+
+    n_points = int(width_px * POINTS_PER_PIXEL)
+    if len(df) <= n_points:
+        return df
+
+    x = df[x_col].to_numpy()
+    keep = []
+    for y_col in y_cols:
+        y = df[y_col].to_numpy()
+        if method == "lttb":
+            keep.append(lttb_indices(x, y, n_points // len(y_cols)))
+        else:
+            # each bucket keeps 2 points
+            keep.append(minmax_indices(x, y, n_points // (2 * len(y_cols))))
+
+    return df.iloc[np.unique(np.concatenate(keep))]
@@ -0,0 +1,223 @@
+"""
+Curve regime episodes (inversions, long end yielding the least) detected once per data version
+
+Episodes are runs of days in a regime: runs shorter than MIN_EPISODE_DAYS are dropped and breaks shorter
+than MERGE_GAP_DAYS are bridged, so a curve hovering around zero is one episode rather than dozens.
+After a refresh only days from the first changed one (less a merge gap) are rescanned.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import curves
+import derived
+from instrumentation import annotate, instrumented
+import utils
+
+# regime -> (signal, threshold): spreads below the threshold (percentage points), or the lowest
+# yielding maturity at or above the threshold (years)
+REGIMES = {
+    "10y-2y inversion": ("10y-2y", 0.0),
+    "10y-3m inversion": ("10y-3m", 0.0),
+    "long end lowest": ("lowest_rate_duration", 10.0),
+}
+MIN_EPISODE_DAYS = 5
+MERGE_GAP_DAYS = 20
+
+EPISODE_COLUMNS = ["regime", "start", "end", "ongoing", "depth", "trough_date", "duration_days",
+                   "next_recession", "lead_days"]
+
+_episodes = {}
+_episodes_lock = threading.Lock()
+
+
+def regime_signals(daily):
+    """
+    {regime: (signal values, in regime mask)} over the rows of analytics.daily_analytics()
+    """
+    spreads = dict(zip(daily["spread_names"], daily["spreads"].T))
+    maturities = [utils.parse_duration_from_filename(series_id) for series_id in curves.FIT_SERIES]
+    spreads["lowest_rate_duration"] = derived.compute_derived(daily["dates"], daily["inputs"],
+                                                              maturities)["lowest_rate_duration"]
+
+    signals = {}
+    with np.errstate(invalid="ignore"):
+        for regime, (signal, threshold) in REGIMES.items():
+            values = spreads[signal]
+            in_regime = values >= threshold if signal == "lowest_rate_duration" else values < threshold
+            signals[regime] = (values, in_regime)
+    return signals
+
+
+def find_runs(mask, min_length=MIN_EPISODE_DAYS, merge_gap=MERGE_GAP_DAYS):
+    """
+    (starts, ends) row indices, inclusive, of the True runs of a bool array
+    """
+    edges = np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+
+    if len(starts) > 1:
+        # a run joins the previous one when the break between them is short
+        joins = starts[1:] - ends[:-1] - 1 < merge_gap
+        starts = starts[np.concatenate([[True], ~joins])]
+        ends = ends[np.concatenate([~joins, [True]])]
+
+    keep = ends - starts + 1 >= min_length
+    return starts[keep], ends[keep]
+
+
+def update_runs(mask, previous_runs, changed_from):
+    """
+    find_runs over the whole mask, keeping previous runs that end well before the first changed row
+
+    previous_runs: (starts, ends) from an earlier, shorter or revised, version of mask
+    """
+    starts, ends = previous_runs
+    # a run ending within a merge gap of the change could be extended or joined
+    settled = ends < changed_from - MERGE_GAP_DAYS
+    starts, ends = starts[settled], ends[settled]
+
+    resume = ends[-1] + 1 if len(ends) else 0
+    new_starts, new_ends = find_runs(mask[resume:])
+    return np.concatenate([starts, new_starts + resume]), np.concatenate([ends, new_ends + resume])
+
+
+def episode_table(dates, signals, runs):
+    """
+    One row per episode: start/end dates, depth (most extreme signal value) and its date, calendar duration,
+    the next recession starting on or after the episode start and the lead time to it
+    """
+    dates = pd.DatetimeIndex(dates)
+    recessions = np.sort(pd.to_datetime(utils.RECESSIONS).values)
+
+    frames = []
+    for regime, (starts, ends) in runs.items():
+        values, _ = signals[regime]
+        lowest = REGIMES[regime][0] != "lowest_rate_duration"
+
+        if len(starts):
+            segments = np.split(values, np.ravel(np.column_stack([starts, ends + 1])))[1::2]
+            extreme = [int(np.nanargmin(s) if lowest else np.nanargmax(s)) for s in segments]
+        else:
+            extreme = []
+        trough_rows = starts + np.array(extreme, dtype=np.int64)
+
+        next_rows = np.searchsorted(recessions, dates.values[starts])
+        next_recession = np.where(next_rows < len(recessions),
+                                  recessions[np.minimum(next_rows, len(recessions) - 1)], np.datetime64("NaT"))
+
+        frames.append(pd.DataFrame({
+            "regime": regime,
+            "start": dates[starts],
+            "end": dates[ends],
+            "ongoing": ends == len(dates) - 1,
+            "depth": values[trough_rows],
+            "trough_date": dates[trough_rows],
+            "duration_days": (dates[ends] - dates[starts]).days + 1,
+            "next_recession": pd.DatetimeIndex(next_recession),
+            "lead_days": (pd.DatetimeIndex(next_recession) - dates[starts]).days,
+        }, columns=EPISODE_COLUMNS))
+
+    table = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=EPISODE_COLUMNS)
+    return table.sort_values(["start", "regime"], ignore_index=True)
+
+
+class EpisodeIndex:
+    """
+    Episode table plus an interval index over it for overlap queries
+
+    table: see episode_table
+    runs:  {regime: (start rows, end rows)} into the analytics rows
+    dates, masks: analytics dates and (dates x REGIMES) in regime flags the runs were found in,
+                  kept to find the rows a refresh changed
+    """
+    def __init__(self, table, runs, dates, masks):
+        self.table = table
+        self.runs = runs
+        self.dates = dates
+        self.masks = masks
+        self.intervals = pd.IntervalIndex.from_arrays(table["start"], table["end"], closed="both")
+
+    def overlapping(self, start, end, regime=None):
+        """
+        Episodes overlapping [start, end]
+        """
+        hits = self.intervals.overlaps(pd.Interval(pd.Timestamp(start), pd.Timestamp(end), closed="both"))
+        if regime is not None:
+            hits &= (self.table["regime"] == regime).to_numpy()
+        return self.table[hits]
+
+    def active_on(self, day, regime=None):
+        return self.overlapping(day, day, regime=regime)
+
+    def regime(self, regime):
+        return self.table[self.table["regime"] == regime]
+
+    def arrays(self):
+        arrays = {"dates": self.dates, "masks": self.masks}
+        for i, (starts, ends) in enumerate(self.runs.values()):
+            arrays[f"starts_{i}"] = starts
+            arrays[f"ends_{i}"] = ends
+        arrays["regimes"] = np.array(list(self.runs))
+        return arrays
+
+
+def _changed_from(dates, masks, previous):
+    """
+    First row whose date or regime flags differ from the previous scan (0 if nothing can be reused)
+    """
+    if previous is None or list(previous["regimes"]) != list(REGIMES):
+        return 0
+
+    common = min(len(dates), len(previous["dates"]))
+    same = (dates[:common] == previous["dates"][:common]) & (masks[:common] == previous["masks"][:common]).all(axis=1)
+    return common if same.all() else int(np.argmin(same))
+
+
+@instrumented()
+def episode_index(data_directory_path=utils.CONSTANT_MATURITIES_DATA_DIR):
+    """
+    EpisodeIndex for the current data, built once per data version and updated incrementally on refresh
+    """
+    daily = analytics.daily_analytics(data_directory_path)
+    panel = utils.load_yield_panel(data_directory_path)
+    index = _episodes.get(panel.version)
+    annotate(cache_hit=index is not None)
+    if index is not None:
+        return index
+
+    with _episodes_lock:
+        index = _episodes.get(panel.version)
+        if index is not None:
+            return index
+
+        signals = regime_signals(daily)
+        dates = daily["dates"]
+        masks = np.column_stack([in_regime for _, in_regime in signals.values()])
+
+        cache_file = os.path.join(panel.store_dir, "episodes.npz") if panel.store_dir else None
+        previous = derived.load_derived(cache_file, None) if cache_file else None
+        changed_from = _changed_from(dates, masks, previous)
+        annotate(rows=len(dates) - changed_from)
+
+        runs = {}
+        for i, (regime, (_, in_regime)) in enumerate(signals.items()):
+            if changed_from:
+                runs[regime] = update_runs(in_regime, (previous[f"starts_{i}"], previous[f"ends_{i}"]), changed_from)
+            else:
+                runs[regime] = find_runs(in_regime)
+
+        index = EpisodeIndex(episode_table(dates, signals, runs), runs, dates, masks)
+        if cache_file is not None and changed_from < len(dates):
+            try:
+                derived.save_derived(cache_file, panel.version, index.arrays())
+            except OSError as e:
+                print(f"could not write episode index: {e}")
+
+        _episodes.clear()
+        _episodes[panel.version] = index
+        return index
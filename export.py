@@ -0,0 +1,185 @@
+"""
+Headless batch export of the charts and derived datasets, for reports that should not drive a browser
+
+    python export.py report/                                     # every chart as vega json, datasets as csv
+    python export.py report/ --chart-format json --chart-format png --dataset-format parquet
+    python export.py report/ --curve-date 2007-06-01 --curve-date 2024-01-02 --workers 8
+
+Data is loaded once in this process before the pool starts; workers are forked where the platform
+allows it and share the loaded panel and caches instead of loading their own.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+import importlib.util
+import multiprocessing
+import os
+import time
+
+import altair as alt
+
+import analytics
+import charts
+import episodes
+import utils
+
+CHART_FORMATS = ("json", "svg", "png")
+DATASET_FORMATS = ("csv", "parquet")
+# altair renders these through vl-convert-python
+IMAGE_FORMATS = ("svg", "png")
+
+
+def yield_curve_comparison_chart(date1, date2):
+    yield_curve1, res_date1 = utils.get_dated_yield_curve(date.fromisoformat(date1))
+    yield_curve2, res_date2 = utils.get_dated_yield_curve(date.fromisoformat(date2))
+    return charts.yield_curve_comparison_chart(yield_curve1, res_date1, yield_curve2, res_date2)
+
+
+def report_charts(curve_dates, latest_data_date):
+    """
+    file name -> (builder, params) for every chart in the report
+    """
+    report = {
+        "yield_spread_10y_2y": (charts.yield_spread_chart, {"d1": "10-year", "d2": "2-year"}),
+        "yield_spread_10y_3m": (charts.yield_spread_chart, {"d1": "10-year", "d2": "3-month"}),
+        "yield_range": (charts.yield_range_time_series_chart, {}),
+        "lowest_yielding_maturity": (charts.lowest_yielding_duration_time_series_chart, {}),
+        "highest_yielding_maturity": (charts.highest_yielding_duration_time_series_chart, {}),
+        "forward_rates": (charts.forward_rate_chart, {}),
+        "spread_volatility": (charts.spread_volatility_chart, {}),
+        "yield_curve_history": (charts.yield_curve_scrubber_chart,
+                                {"start_date": str(date(latest_data_date.year - 10, 1, 1)),
+                                 "end_date": str(latest_data_date)}),
+    }
+    for date1, date2 in zip(curve_dates, curve_dates[1:]):
+        report[f"yield_curve_{date1}_vs_{date2}"] = (yield_curve_comparison_chart, {"date1": date1, "date2": date2})
+    return report
+
+
+def report_datasets(curve_dates):
+    """
+    file name -> DataFrame builder for every derived dataset in the report
+    """
+    datasets = {
+        "spreads": lambda: utils.yield_spreads([("10-year", "2-year"), ("10-year", "3-month"),
+                                                ("30-year", "5-year")], sample_rate="D"),
+        "lowest_yield": lambda: utils.lowest_yield_dataframe(sample_rate="D"),
+        "highest_yield": lambda: utils.highest_yield_dataframe(sample_rate="D"),
+        "forward_rates": lambda: analytics.forward_rate_dataframe(sample_rate=None),
+        "spread_volatility": lambda: analytics.spread_volatility_dataframe(sample_rate=None),
+        "episodes": lambda: episodes.episode_index().table,
+    }
+    if curve_dates:
+        datasets["yield_curves"] = lambda: utils.get_dated_yield_curves(curve_dates)
+    return datasets
+
+
+def render_chart(name, build, params, formats, output_dir):
+    """
+    Build one chart and write it in each format, returning (name, written paths, errors, milliseconds)
+    """
+    start = time.perf_counter()
+    chart = build(**params)
+
+    written, errors = [], []
+    # the report charts carry whole histories, well past altair's inline row limit
+    with alt.data_transformers.enable("default", max_rows=None):
+        for fmt in formats:
+            path = os.path.join(output_dir, f"{name}.{fmt}")
+            try:
+                chart.save(path, format=fmt)
+                written.append(path)
+            except (ImportError, ValueError) as e:
+                # svg and png need the vl-convert-python package
+                errors.append(f"{name}.{fmt}: {e}")
+    return name, written, errors, (time.perf_counter() - start) * 1000
+
+
+def export_dataset(name, build, formats, output_dir):
+    dataframe = build()
+    written, errors = [], []
+    for fmt in formats:
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        try:
+            if fmt == "csv":
+                dataframe.to_csv(path)
+            else:
+                # parquet needs pyarrow or fastparquet
+                dataframe.to_parquet(path)
+            written.append(path)
+        except ImportError as e:
+            errors.append(f"{name}.{fmt}: {e}")
+    return written, errors
+
+
+def _pool_context():
+    # forked workers inherit the loaded panel and caches
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def export_report(output_dir, chart_formats=("json",), dataset_formats=("csv",), curve_dates=(), workers=None):
+    """
+    Write every report chart and dataset to output_dir
+
+    Returns:
+        (written paths, error messages)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    curve_dates = [str(date.fromisoformat(d)) for d in curve_dates]
+
+    # load once here, before the pool starts
+    panel = utils.load_yield_panel()
+    panel.pyramid(fillna=True)
+    panel.pyramid(fillna=False)
+    episodes.episode_index()
+    latest_data_date = utils.get_latest_data_date()
+
+    written, errors = [], []
+    for name, build in report_datasets(curve_dates).items():
+        paths, failures = export_dataset(name, build, dataset_formats, output_dir)
+        written += paths
+        errors += failures
+
+    report = report_charts(curve_dates, latest_data_date)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        futures = [pool.submit(render_chart, name, build, params, chart_formats, output_dir)
+                   for name, (build, params) in report.items()]
+        for future in as_completed(futures):
+            try:
+                name, paths, failures, elapsed_ms = future.result()
+            except Exception as e:
+                errors.append(f"chart failed: {e}")
+                continue
+            print(f"{name}: {elapsed_ms:.0f} ms")
+            written += paths
+            errors += failures
+
+    return written, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the charts and derived datasets without streamlit")
+    parser.add_argument("output_dir")
+    parser.add_argument("--chart-format", action="append", choices=CHART_FORMATS,
+                        help="repeatable, default json")
+    parser.add_argument("--dataset-format", action="append", choices=DATASET_FORMATS,
+                        help="repeatable, default csv")
+    parser.add_argument("--curve-date", action="append", default=[],
+                        help="YYYY-MM-DD, repeatable: exports the curves on these dates and compares consecutive ones")
+    parser.add_argument("--workers", type=int, default=None, help="chart processes, default one per cpu")
+    args = parser.parse_args()
+
+    image_formats = [fmt for fmt in args.chart_format or [] if fmt in IMAGE_FORMATS]
+    if image_formats and importlib.util.find_spec("vl_convert") is None:
+        parser.error(f"{'/'.join(image_formats)} charts need the vl-convert-python package "
+                     "(pip install vl-convert-python), json needs nothing extra")
+
+    start = time.perf_counter()
+    written, errors = export_report(args.output_dir, chart_formats=args.chart_format or ["json"],
+                                    dataset_formats=args.dataset_format or ["csv"], curve_dates=args.curve_date,
+                                    workers=args.workers)
+    for error in errors:
+        print(f"failed: {error}")
+    print(f"wrote {len(written)} files to {args.output_dir} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,81 @@
+"""
+Chunked csv ingestion straight into a preallocated (dates x series) matrix
+
+Peak memory stays close to the final panel: pass 1 only keeps each csv's dates as int32 days,
+pass 2 streams each csv's values in chunks and scatters them into their matrix rows.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import availability
+
+CHUNK_ROWS = 50_000
+
+
+def iter_csv_chunks(csv_file, chunksize=CHUNK_ROWS, column=0):
+    """
+    Yield one numpy array per chunk of a FRED style csv ('observation_date,<series>') column
+
+    column 0 (dates) comes back as int32 days since the epoch, column 1 (values) as float64
+    """
+    reader = pd.read_csv(
+        csv_file,
+        usecols=[column],
+        dtype={0: str} if column == 0 else None,
+        na_values=[""],
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        if column == 0:
+            # numpy parses ISO "YYYY-MM-DD" strings directly, faster than pandas date inference
+            yield chunk.iloc[:, 0].to_numpy().astype("datetime64[D]").astype(np.int32)
+        else:
+            yield chunk.iloc[:, 0].to_numpy(dtype=np.float64)
+
+
+def scan_dates(csv_files, chunksize=CHUNK_ROWS):
+    """
+    Every csv's observation days (int32, 4 bytes a row) plus their sorted union
+    """
+    file_days = [np.concatenate(list(iter_csv_chunks(csv_file, chunksize=chunksize)) or [np.array([], np.int32)])
+                 for csv_file in csv_files]
+    union = np.unique(np.concatenate(file_days)) if file_days else np.array([], dtype=np.int32)
+    return file_days, union
+
+
+def ingest_csvs(csv_files, dtype=np.float64, chunksize=CHUNK_ROWS, allocate=np.empty):
+    """
+    Load csvs into one matrix without holding a full copy of any csv
+
+    allocate: (shape, dtype) -> array, e.g. to ingest straight into a memory mapped file
+    Returns:
+        (dates, values, observed, series ids)
+    """
+    file_days, union = scan_dates(csv_files, chunksize=chunksize)
+    dates = pd.DatetimeIndex(union.astype("datetime64[D]").astype("datetime64[ns]"), name="observation_date")
+    shape = (len(dates), len(csv_files))
+
+    values = allocate(shape, dtype)
+    values[...] = np.nan
+    observed = np.zeros(shape, dtype=bool)
+
+    series = []
+    for col, csv_file in enumerate(csv_files):
+        series.append(os.path.basename(csv_file).split(".")[0])
+        duplicates = availability.duplicate_days(file_days[col])
+        if len(duplicates):
+            print(f"{os.path.basename(csv_file)}: {len(duplicates)} duplicate dates, keeping the last value "
+                  f"(first {duplicates[0].astype('datetime64[D]')})")
+        rows = union.searchsorted(file_days[col])
+        observed[rows, col] = True
+
+        # second pass only reads the values column, rows line up with the days read in the first
+        offset = 0
+        for chunk_values in iter_csv_chunks(csv_file, chunksize=chunksize, column=1):
+            values[rows[offset:offset + len(chunk_values)], col] = chunk_values
+            offset += len(chunk_values)
+        file_days[col] = None
+
+    return dates, values, observed, series
@@ -0,0 +1,221 @@
+"""
+Lightweight timing/metrics for data loaders and chart builders
+
+Disabled unless CMH_INSTRUMENTATION=1 (or enable() is called), in which case every
+@instrumented call records wall time, rows, bytes read and cache hit/miss.
+CMH_METRICS_LOG:  append one json line per call to this file
+CMH_METRICS_PROM: flush() writes Prometheus text format metrics to this file
+"""
+from collections import deque
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+ENABLED = os.environ.get("CMH_INSTRUMENTATION", "") not in ("", "0", "false")
+METRICS_LOG_FILE = os.environ.get("CMH_METRICS_LOG")
+METRICS_PROM_FILE = os.environ.get("CMH_METRICS_PROM")
+
+RECENT_CALLS_LIMIT = 500
+
+_lock = threading.Lock()
+_recent_calls = deque(maxlen=RECENT_CALLS_LIMIT)
+_totals = {}
+
+# the innermost running span of this thread/session, so nested code can annotate it
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def is_enabled():
+    return ENABLED
+
+
+def _count_rows(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray, list, dict)):
+        return len(result)
+    return None
+
+
+def annotate(rows=None, bytes_read=None, cache_hit=None):
+    """
+    Attach details to the innermost running span, no-op when disabled or outside a span
+    """
+    record = _current_span.get()
+    if record is None:
+        return
+    if rows is not None:
+        record["rows"] = rows
+    if bytes_read is not None:
+        record["bytes_read"] = record.get("bytes_read", 0) + bytes_read
+    if cache_hit is not None:
+        record["cache_hit"] = cache_hit
+
+
+@contextlib.contextmanager
+def span(name):
+    """
+    Time a block as a named call, yields the record being built (None when disabled)
+    """
+    if not ENABLED:
+        yield None
+        return
+
+    record = {"name": name, "start": time.time()}
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["wall_ms"] = (time.perf_counter() - start) * 1000
+        _current_span.reset(token)
+        _store(record)
+
+
+def instrumented(name=None):
+    """
+    Decorator recording each call of a function, costs one flag check when disabled
+    """
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+
+            with span(span_name) as record:
+                result = fn(*args, **kwargs)
+                if "rows" not in record:
+                    rows = _count_rows(result)
+                    if rows is not None:
+                        record["rows"] = rows
+            return result
+
+        return wrapper
+    return decorator
+
+
+def _store(record):
+    with _lock:
+        _recent_calls.append(record)
+
+        totals = _totals.setdefault(record["name"], {"calls": 0, "wall_ms": 0.0, "max_ms": 0.0, "rows": 0,
+                                                     "bytes_read": 0, "cache_hits": 0, "cache_misses": 0,
+                                                     "errors": 0})
+        totals["calls"] += 1
+        totals["wall_ms"] += record["wall_ms"]
+        totals["max_ms"] = max(totals["max_ms"], record["wall_ms"])
+        totals["rows"] += record.get("rows", 0)
+        totals["bytes_read"] += record.get("bytes_read", 0)
+        if record.get("cache_hit") is True:
+            totals["cache_hits"] += 1
+        elif record.get("cache_hit") is False:
+            totals["cache_misses"] += 1
+        if "error" in record:
+            totals["errors"] += 1
+
+    if METRICS_LOG_FILE:
+        with open(METRICS_LOG_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def recent_calls():
+    with _lock:
+        return list(_recent_calls)
+
+
+def summary_frame():
+    """
+    One row per instrumented name with call counts, timings, rows, bytes and cache hit/miss totals
+
+    hit_rate is NaN for names that never report cache hits or misses
+    """
+    with _lock:
+        rows = [{"name": name, **totals} for name, totals in _totals.items()]
+
+    summary = pd.DataFrame(rows, columns=["name", "calls", "wall_ms", "max_ms", "rows", "bytes_read",
+                                          "cache_hits", "cache_misses", "errors"])
+    summary["mean_ms"] = summary["wall_ms"] / summary["calls"]
+    summary["hit_rate"] = summary["cache_hits"] / (summary["cache_hits"] + summary["cache_misses"])
+    return summary.sort_values("wall_ms", ascending=False).reset_index(drop=True)
+
+
+def reset():
+    with _lock:
+        _recent_calls.clear()
+        _totals.clear()
+
+
+def prometheus_text():
+    """
+    Totals in Prometheus text exposition format
+    """
+    lines = []
+    metrics = [
+        ("cmh_calls_total", "counter", "calls", "Instrumented calls"),
+        ("cmh_wall_seconds_total", "counter", "wall_ms", "Wall time spent in instrumented calls"),
+        ("cmh_rows_total", "counter", "rows", "Rows processed"),
+        ("cmh_bytes_read_total", "counter", "bytes_read", "Bytes read from storage"),
+        ("cmh_cache_hits_total", "counter", "cache_hits", "Cache hits"),
+        ("cmh_cache_misses_total", "counter", "cache_misses", "Cache misses"),
+        ("cmh_errors_total", "counter", "errors", "Calls that raised"),
+    ]
+    with _lock:
+        totals = {name: dict(values) for name, values in _totals.items()}
+
+    for metric, metric_type, key, help_text in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, values in sorted(totals.items()):
+            value = values[key] / 1000 if key == "wall_ms" else values[key]
+            lines.append(f'{metric}{{name="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def flush():
+    """
+    Write the Prometheus text file if one is configured, a failed write is printed and never raised
+    """
+    if not ENABLED or not METRICS_PROM_FILE:
+        return
+
+    # unique per process and thread, sessions flush concurrently at the end of their renders
+    tmp_file = f"{METRICS_PROM_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_file, METRICS_PROM_FILE)
+    except OSError as e:
+        print(f"failed to write metrics: {e}")
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def render_debug_sidebar():
+    """
+    Streamlit sidebar expander with the timing table, only shown while instrumentation is enabled
+    """
+    if not ENABLED:
+        return
+
+    import streamlit as st
+
+    with st.sidebar.expander("Debug: timings", expanded=False):
+        st.dataframe(summary_frame().round(2), hide_index=True)
+        st.caption("Recent calls")
+        st.dataframe(pd.DataFrame(recent_calls()[-50:][::-1]), hide_index=True)
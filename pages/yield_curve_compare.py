@@ -3,11 +3,14 @@ from dateutil.relativedelta import relativedelta
 from pprint import pprint
 
 import streamlit as st
-import altair as alt
-import pandas as pd
-import math
 
-from utils import TREASURY_SERIES, get_dated_yield_curve, update_csv_files, get_latest_data_date
+import charts
+import instrumentation
+from instrumentation import instrumented
+from refresher import get_refresher, refresh_unavailable_reason
+from spec_cache import chart_spec, vega_lite_spec
+from utils import (TREASURY_SERIES, available_maturities, get_dated_yield_curve, get_latest_data_date,
+                   parse_duration_from_filename)
 
 
 st.set_page_config(page_title="CMH Charts",
@@ -16,7 +19,17 @@ st.set_page_config(page_title="CMH Charts",
                    initial_sidebar_state="collapsed")
 
 
-# TODO: dates that are missing duration data( 1-month, 2000)
+def unpublished_maturities_caption(*curve_dates):
+    # e.g. no 1-month before 2001, no 20-year 1987-1993
+    maturities = [parse_duration_from_filename(series_id) for series_id in TREASURY_SERIES]
+    for curve_date in curve_dates:
+        available = available_maturities(curve_date)
+        missing = [maturity for maturity in maturities if maturity not in available]
+        if missing:
+            st.caption(f"Not published on {curve_date}: {', '.join(missing)}")
+
+
+@instrumented("render.yield_curve_chart")
 def yield_curve_chart():
     yield_curve1, date1 = get_dated_yield_curve(st.session_state.date1)
     if date1 == str(st.session_state.date2):
@@ -36,74 +49,49 @@ def yield_curve_chart():
     print(f'\ndate 2: {date2}')
     pprint(yield_curve2)
 
-    yield_curve_df1 = pd.DataFrame(yield_curve1, columns=["duration", date1])
-    yield_curve_df2 = pd.DataFrame(yield_curve2, columns=["duration", date2])
-
-    # Round down to nearest 0.1
-    y_min = math.floor(min(yield_curve_df1[date1]) * 10) / 10
-    y_min = min(y_min, math.floor(min(yield_curve_df2[date2]) * 10) / 10)
-
-    y_max = math.ceil(max(yield_curve_df1[date1]) * 10) / 10
-    y_max = max(y_max, math.ceil(max(yield_curve_df2[date2]) * 10) / 10)
-
-    # inner=intersection, outer=union
-    combined_df = pd.merge(yield_curve_df1, yield_curve_df2, on="duration", how='inner')
-
-    long_df = combined_df.melt(id_vars="duration", value_vars=[date1, date2],
-                               var_name='Series', value_name='Yield')
-
-    line_chart = alt.Chart(long_df).mark_line(interpolate="monotone", size=5).encode(
-        x=alt.X("duration:O", title="Duration", sort=list(combined_df["duration"])),
-        y=alt.Y("Yield:Q", title="Yield", scale=alt.Scale(domain=[y_min, y_max]), axis=alt.Axis(orient="left")),
-        color=alt.Color("Series:N", title=None,
-                        scale=alt.Scale(
-                            domain=[date1, date2],
-                            range=["steelblue", "#a94442"]
-                        ),
-                        legend=alt.Legend(
-                            orient="top",
-                            titleOrient="left",
-                            symbolStrokeWidth=20,
-                            symbolSize=10000,
-                            labelFontSize=20,
-                            padding=0,                            
-                        )
-        )
-    ).properties(
-        width=700,
-        height=600,
-    ).interactive()
-
-    points1 = alt.Chart(yield_curve_df1).mark_point(filled=True, size=75).encode(
-        x=alt.X("duration:O", sort=list(yield_curve_df1["duration"])), # Same x encoding as the line
-        y=alt.Y(f"{date1}:Q", axis=alt.Axis(orient="right", title=None)) # Same y encoding as the line
-    )
-
-    points2 = alt.Chart(yield_curve_df2).mark_point(filled=True, size=75).encode(
-        x=alt.X("duration:O", sort=list(yield_curve_df1["duration"])),
-        y=alt.Y(f"{date2}:Q", axis=alt.Axis(orient="right", title=None)),
-        color=alt.value("#a94442")
-    )
-
-    layered_chart = alt.layer(
-        line_chart,
-        points1,
-        points2,
-    ).interactive()
+    spec = chart_spec(charts.yield_curve_comparison_chart, yield_curve1=yield_curve1, date1=date1,
+                      yield_curve2=yield_curve2, date2=date2)
  
-    st.altair_chart(layered_chart, use_container_width=True)
+    st.vega_lite_chart(spec=vega_lite_spec(spec), use_container_width=True)
+    unpublished_maturities_caption(date1, date2)
+
+    fitted_curves_chart(date1, date2)
+
+
+@instrumented("render.fitted_curves_chart")
+def fitted_curves_chart(date1, date2):
+    st.subheader("Fitted Curves")
+    spec = chart_spec(charts.fitted_yield_curve_chart, date1=date1, date2=date2)
+    st.vega_lite_chart(spec=vega_lite_spec(spec), use_container_width=True)
+    st.caption("The zero curve is fitted to the treasury yields, par and instantaneous forward curves are "
+               "implied by it")
 
 
 def update_data_button():
+    # pick up data swapped in by the background refresher since the last rerun
+    st.session_state.latest_data_date = get_latest_data_date()
+    refresh_status = get_refresher().status()
+
     latest_data_date = st.session_state.latest_data_date.strftime("%Y-%m-%d")
     st.write(f"Latest data from {latest_data_date}")
 
-    if st.session_state.display_data_update_btn:
+    if refresh_status.in_progress:
+        st.caption("Downloading latest data in the background...")
+    elif refresh_status.last_refresh is not None:
+        st.caption(f"Last checked for new data {refresh_status.last_refresh.strftime('%Y-%m-%d %H:%M %Z')}")
+    if refresh_status.last_error:
+        st.caption(f"Last refresh failed: {refresh_status.last_error}")
+
+    # in shared serving and snapshot modes no refresher runs in this process, a click would do nothing
+    unavailable_reason = refresh_unavailable_reason()
+    if unavailable_reason is not None:
+        st.caption(unavailable_reason)
+    elif st.session_state.display_data_update_btn:
 
         download_data_btn = st.button("Download latest data")
         if download_data_btn:
             print('downloading')
-            update_csv_files(days_until_stale=1)
+            get_refresher().request_refresh()
             st.session_state.display_data_update_btn = False
 
 
@@ -140,9 +128,13 @@ def main():
     
     yield_curve_chart()
 
+    instrumentation.render_debug_sidebar()
+    instrumentation.flush()
+
 
 if 'init_yc' not in st.session_state:
-    update_csv_files()
+    # refreshes run on a background thread, never during a page render
+    get_refresher()
     st.session_state.init_yc = True
 
     st.session_state.latest_data_date = get_latest_data_date()
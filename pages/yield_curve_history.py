@@ -0,0 +1,73 @@
+from datetime import date
+
+import streamlit as st
+
+import charts
+import instrumentation
+from instrumentation import instrumented
+from refresher import get_refresher
+from spec_cache import chart_spec, vega_lite_spec
+from utils import curve_step_dates, get_latest_data_date
+
+
+st.set_page_config(page_title="CMH Charts",
+                   page_icon="📊",
+                   layout="wide",
+                   initial_sidebar_state="collapsed")
+
+STEPS = {"Daily": "D", "Weekly": "W", "Monthly": "ME"}
+
+
+@instrumented("render.yield_curve_scrubber_chart")
+def yield_curve_scrubber_chart():
+    start_date, end_date = st.session_state.history_range
+    step = STEPS[st.session_state.history_step]
+    if curve_step_dates(start_date, end_date, step).empty:
+        st.info(f"No {st.session_state.history_step.lower()} step dates between {start_date} and {end_date}, "
+                "pick a longer range or a shorter step")
+        return
+
+    spec = chart_spec(charts.yield_curve_scrubber_chart, start_date=str(start_date), end_date=str(end_date),
+                      step=step)
+
+    st.vega_lite_chart(spec=vega_lite_spec(spec), use_container_width=True)
+
+
+def range_selection():
+    latest_data_date = get_latest_data_date()
+
+    range_col, step_col = st.columns([2, 1])
+    with range_col:
+        selected = st.date_input("Date range", (date(latest_data_date.year - 10, 1, 1), latest_data_date),
+                                 min_value=date(1962, 1, 2), max_value=latest_data_date)
+    with step_col:
+        st.session_state.history_step = st.radio("Step", list(STEPS), index=1, horizontal=True)
+
+    # the range picker returns a single date until the end of the range is picked
+    if len(selected) == 2 and selected[0] < selected[1]:
+        st.session_state.history_range = selected
+
+
+def main():
+    st.header("Yield Curve History")
+    st.write("Drag the slider below the chart to move the curve through time, it runs in the browser "
+             "without reloading the page.")
+
+    range_selection()
+    yield_curve_scrubber_chart()
+
+    instrumentation.render_debug_sidebar()
+    instrumentation.flush()
+
+
+if 'init_history' not in st.session_state:
+    # refreshes run on a background thread, never during a page render
+    get_refresher()
+    st.session_state.init_history = True
+
+    latest_data_date = get_latest_data_date()
+    st.session_state.history_range = (date(latest_data_date.year - 10, 1, 1), latest_data_date)
+
+
+if __name__ == "__main__":
+    main()
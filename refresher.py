@@ -0,0 +1,250 @@
+from datetime import datetime, time, timedelta
+import os
+import threading
+import traceback
+from zoneinfo import ZoneInfo
+
+import analytics
+import curves
+import episodes
+import shared_panel
+import utils
+
+# FRED posts the previous day's constant maturity yields in the afternoon, Eastern time
+FRED_PUBLISH_TIMEZONE = ZoneInfo("America/New_York")
+FRED_PUBLISH_TIME = time(16, 30)
+
+# derived series persisted before publishing, every sample rate the app and api.py request
+WARM_SAMPLE_RATES = ("D", "W", "ME", "QE", "YE")
+
+
+class RefreshStatus:
+    """
+    Snapshot of the background refresher for display in the UI
+    """
+    def __init__(self, in_progress=False, last_refresh=None, last_success=None, last_error=None,
+                 next_refresh=None, latest_data_date=None):
+        self.in_progress = in_progress
+        self.last_refresh = last_refresh
+        self.last_success = last_success
+        self.last_error = last_error
+        self.next_refresh = next_refresh
+        self.latest_data_date = latest_data_date
+
+    def copy(self):
+        return RefreshStatus(**vars(self))
+
+
+def next_publish_time(now=None, publish_time=FRED_PUBLISH_TIME, tz=FRED_PUBLISH_TIMEZONE):
+    """
+    Next weekday publish time strictly after now (Tuesday-Saturday carry Monday-Friday data)
+    """
+    now = now.astimezone(tz) if now is not None else datetime.now(tz)
+    candidate = datetime.combine(now.date(), publish_time, tzinfo=tz)
+    while candidate <= now or candidate.weekday() in (0, 6):
+        candidate = datetime.combine(candidate.date() + timedelta(days=1), publish_time, tzinfo=tz)
+    return candidate
+
+
+def previous_publish_time(now=None, publish_time=FRED_PUBLISH_TIME, tz=FRED_PUBLISH_TIMEZONE):
+    """
+    Latest weekday publish time at or before now
+    """
+    now = now.astimezone(tz) if now is not None else datetime.now(tz)
+    candidate = datetime.combine(now.date(), publish_time, tzinfo=tz)
+    while candidate > now or candidate.weekday() in (0, 6):
+        candidate = datetime.combine(candidate.date() - timedelta(days=1), publish_time, tzinfo=tz)
+    return candidate
+
+
+def data_is_current(latest_data_date, now=None):
+    """
+    Whether the data already has the day carried by the latest publish, so a download would find nothing new
+    """
+    return latest_data_date >= previous_publish_time(now).date() - timedelta(days=1)
+
+
+def warm_caches(data_directory_path=utils.CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Load the panel and build its pyramids, derived series, analytics, episodes and curve fits
+
+    Everything is persisted in the panel store, so server workers sharing the published panel only read it.
+    Returns:
+        the panel
+    """
+    panel = utils.load_yield_panel(data_directory_path)
+    panel.pyramid(fillna=True)
+    panel.pyramid(fillna=False)
+    for sample_rate in WARM_SAMPLE_RATES:
+        panel.derived_series(sample_rate)
+    analytics.daily_analytics(data_directory_path)
+    episodes.episode_index(data_directory_path)
+    curves.fitted_curves(data_directory_path)
+    return panel
+
+
+def _acquire_lock_file(lock_file):
+    """
+    Cross process single-flight lock, so only one server process downloads at a time
+    """
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            age = datetime.now().timestamp() - os.stat(lock_file).st_mtime
+        except FileNotFoundError:
+            return False
+        if age < utils.REFRESH_LOCK_STALE_SECONDS:
+            return False
+        os.remove(lock_file)
+        return _acquire_lock_file(lock_file)
+
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    return True
+
+
+class BackgroundRefresher:
+    """
+    Process level data refresher running on a daemon thread
+
+    Refreshes on start, unless the data already has the latest published day, and then at every FRED
+    publish time. Concurrent refresh requests collapse into the one already running, page renders never
+    wait on a download and keep the previous panel until the new one is swapped in whole.
+    With a publish_dir every refreshed panel is published there for server workers (see shared_panel.py).
+    """
+    def __init__(self, data_directory_path=utils.CONSTANT_MATURITIES_DATA_DIR, publish_dir=None):
+        self.data_directory_path = data_directory_path
+        self.publish_dir = publish_dir
+        self.lock_file = os.path.join(data_directory_path, utils.REFRESH_LOCK_FILENAME)
+
+        self._refresh_lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._status = RefreshStatus()
+
+    def status(self):
+        with self._status_lock:
+            return self._status.copy()
+
+    def _update_status(self, **kwargs):
+        with self._status_lock:
+            for key, value in kwargs.items():
+                setattr(self._status, key, value)
+
+    def start(self):
+        with self._status_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="yield-data-refresher", daemon=True)
+        self._thread.start()
+
+    def request_refresh(self):
+        """
+        Ask the background thread to refresh now, returns immediately
+        """
+        self._wake.set()
+
+    def _latest_data_date(self):
+        if not os.path.exists(os.path.join(self.data_directory_path, utils.TREASURY_SERIES[-1] + ".csv")):
+            return None
+        return utils.load_yield_panel(self.data_directory_path).last_observation_date(utils.TREASURY_SERIES[-1])
+
+    def _run(self):
+        # a restart between publishes only warms the caches
+        latest_data_date = self._latest_data_date()
+        download = latest_data_date is None or not data_is_current(latest_data_date)
+        while True:
+            self.refresh(download=download)
+            download = True
+
+            next_refresh = next_publish_time()
+            self._update_status(next_refresh=next_refresh)
+
+            timeout = (next_refresh - datetime.now(FRED_PUBLISH_TIMEZONE)).total_seconds()
+            self._wake.wait(timeout=max(timeout, 0))
+            self._wake.clear()
+
+    def refresh(self, download=True):
+        """
+        Run one incremental refresh, skipped if one is already running in this or another process
+
+        download: False only rebuilds the caches of the data on disk
+
+        Returns:
+            True if this call refreshed the data
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            if not _acquire_lock_file(self.lock_file):
+                return False
+            try:
+                self._update_status(in_progress=True)
+
+                error = None
+                if download:
+                    self._update_status(last_refresh=datetime.now(FRED_PUBLISH_TIMEZONE))
+                    # while the lock file exists other sessions keep the previous panel (see load_yield_panel)
+                    result = utils.download_fred_data(data_directory_path=self.data_directory_path)
+                    if result is None:
+                        error = "FRED_API_KEY is not set"
+                    else:
+                        _, errors = result
+                        error = "; ".join(f"{series_id}: {e}" for series_id, e in errors.items()) or None
+
+                # also covers data that was never downloaded here, e.g. without an api key
+                snapshot = utils.record_data_snapshot(self.data_directory_path)
+
+                # swap in the panel of every new csv at once, then build everything derived from it here so it
+                # is ready before the next page render
+                utils.reload_yield_panel(self.data_directory_path)
+                panel = warm_caches(self.data_directory_path)
+                if self.publish_dir is not None:
+                    shared_panel.publish(panel, self.publish_dir, snapshot=snapshot)
+                latest_data_date = panel.last_observation_date(utils.TREASURY_SERIES[-1])
+
+                self._update_status(last_error=error, latest_data_date=latest_data_date)
+                if download and error is None:
+                    self._update_status(last_success=datetime.now(FRED_PUBLISH_TIMEZONE))
+            except Exception:
+                self._update_status(last_error=traceback.format_exc(limit=3))
+            finally:
+                self._update_status(in_progress=False)
+                if os.path.exists(self.lock_file):
+                    os.remove(self.lock_file)
+            return True
+        finally:
+            self._refresh_lock.release()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def refresh_unavailable_reason():
+    """
+    Why this process never refreshes the data itself, None when it does
+    """
+    if utils.DATA_SNAPSHOT is not None:
+        return f"Pinned to data snapshot {utils.DATA_SNAPSHOT}"
+    if shared_panel.SHARED_PANEL_DIR is not None:
+        return "Data is refreshed by the loader process"
+    return None
+
+
+def get_refresher():
+    """
+    The process-wide refresher, started on first use
+
+    Server workers in shared serving mode never start it, the loader process refreshes and publishes.
+    Neither does a process pinned to a data snapshot (CMH_DATA_SNAPSHOT), whose data never changes.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = BackgroundRefresher()
+            if refresh_unavailable_reason() is None:
+                _refresher.start()
+    return _refresher
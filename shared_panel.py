@@ -0,0 +1,229 @@
+"""
+Shared-memory serving mode: one loader process publishes the yield panel, server workers map it read-only
+
+The loader writes each data version to its own segment file (header, then the panel arrays, asof rows and
+both pyramids at aligned offsets) and then atomically repoints CURRENT at it. Workers started with
+CMH_SHARED_PANEL_DIR set map the current segment instead of loading data themselves, so the arrays live
+once in the page cache whatever the number of workers, and a new version is seen by every worker on
+its next load_yield_panel call. Put the directory on tmpfs (/dev/shm) to keep it off disk.
+
+    python shared_panel.py serve --shared-dir /dev/shm/cmh        # loader: refresh and publish
+    CMH_SHARED_PANEL_DIR=/dev/shm/cmh streamlit run app.py         # each server worker
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import derived
+
+SHARED_PANEL_DIR = os.environ.get("CMH_SHARED_PANEL_DIR")
+
+MAGIC = b"CMHPANEL"
+FORMAT_VERSION = 1
+POINTER_FILENAME = "CURRENT"
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")  # magic, format version, header length
+
+
+def pointer_key(shared_dir):
+    """
+    Cheap fingerprint of the published version, changes whenever CURRENT is repointed
+    """
+    stat = os.stat(os.path.join(shared_dir, POINTER_FILENAME))
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def panel_arrays(panel):
+    """
+    Every array a worker needs from a panel: name -> array, the pyramid levels under pyramid/<fillna>/<level>/
+    """
+    arrays = {
+        "dates": panel.dates.values,
+        "values": panel.values,
+        "observed": panel.observed,
+        "asof_rows": panel.asof_rows,
+    }
+    for fillna in (True, False):
+        for sample_rate in derived.PYRAMID_LEVELS:
+            level = panel.pyramid_level(sample_rate, fillna=fillna)
+            for name, array in level.items():
+                arrays[f"pyramid/{int(fillna)}/{derived.level_key(sample_rate)}/{name}"] = array
+    return arrays
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_segment(path, arrays, header):
+    """
+    Write arrays to one file after a json header; arrays shared between names are stored once
+    """
+    layout = {}
+    stored = {}
+    offset = 0
+    for name, array in arrays.items():
+        if id(array) not in stored:
+            stored[id(array)] = (offset, array)
+            offset = _aligned(offset + array.nbytes)
+        layout[name] = {"offset": stored[id(array)][0], "dtype": array.dtype.str, "shape": list(array.shape)}
+
+    header_bytes = json.dumps({**header, "arrays": layout}).encode()
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for offset, array in stored.values():
+            f.seek(data_start + offset)
+            f.write(np.ascontiguousarray(array).view(np.uint8).data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def publish(panel, shared_dir, snapshot=None):
+    """
+    Publish a panel as the current version, a no-op when that version is already current
+
+    snapshot: data snapshot token of the csvs the panel was read from (see snapshots.py), reported by workers
+
+    Returns:
+        segment file path
+    """
+    os.makedirs(shared_dir, exist_ok=True)
+    segment_name = f"panel-{panel.version}.bin"
+    segment_file = os.path.join(shared_dir, segment_name)
+    pointer_file = os.path.join(shared_dir, POINTER_FILENAME)
+
+    if os.path.exists(pointer_file):
+        with open(pointer_file) as f:
+            previous = f.read().strip()
+        if previous == segment_name and os.path.exists(segment_file):
+            return segment_file
+    else:
+        previous = None
+
+    header = {
+        "version": panel.version,
+        "series": panel.series,
+        "source_key": [list(entry) for entry in panel.source_key] if panel.source_key is not None else None,
+        "store_dir": panel.store_dir,
+        "snapshot": snapshot,
+        "published_at": time.time(),
+    }
+    write_segment(segment_file, panel_arrays(panel), header)
+
+    tmp_file = f"{pointer_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write(segment_name)
+    os.replace(tmp_file, pointer_file)
+
+    # workers still mapping a removed segment keep reading it until they move on; the one just replaced
+    # is kept so a worker that read the old pointer a moment ago can still open it
+    for name in os.listdir(shared_dir):
+        if name.startswith("panel-") and name.endswith(".bin") and name not in (segment_name, previous):
+            try:
+                os.remove(os.path.join(shared_dir, name))
+            except OSError as e:
+                print(f"could not remove old segment {name}: {e}")
+    return segment_file
+
+
+def read_segment(path):
+    """
+    Map a segment read-only
+
+    Returns:
+        (header dict, {name: read-only array viewing the mapping})
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, format_version, header_length = _PREAMBLE.unpack_from(mapping)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a format {FORMAT_VERSION} panel segment")
+    header = json.loads(mapping[_PREAMBLE.size:_PREAMBLE.size + header_length])
+    data_start = _aligned(_PREAMBLE.size + header_length)
+
+    arrays = {}
+    views = {}
+    for name, entry in header.pop("arrays").items():
+        # names stored once share one view, as they shared one array when published
+        key = (entry["offset"], entry["dtype"], tuple(entry["shape"]))
+        if key not in views:
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            views[key] = np.frombuffer(mapping, dtype=np.dtype(entry["dtype"]), count=count,
+                                       offset=data_start + entry["offset"]).reshape(entry["shape"])
+        arrays[name] = views[key]
+    return header, arrays
+
+
+def attach(shared_dir):
+    """
+    Map the current segment of a shared directory
+
+    Returns:
+        (pointer key, header, arrays), see pointer_key and read_segment
+    """
+    pointer_file = os.path.join(shared_dir, POINTER_FILENAME)
+    for attempt in range(3):
+        key = pointer_key(shared_dir)
+        with open(pointer_file) as f:
+            segment_name = f.read().strip()
+        try:
+            header, arrays = read_segment(os.path.join(shared_dir, segment_name))
+            return key, header, arrays
+        except FileNotFoundError:
+            # republished twice since the pointer was read, read it again
+            if attempt == 2:
+                raise
+
+
+def pyramids(arrays):
+    """
+    {fillna: {level_key: level}} from the pyramid/ arrays of a segment
+    """
+    result = {True: {}, False: {}}
+    for name, array in arrays.items():
+        if name.startswith("pyramid/"):
+            _, fillna, key, stat = name.split("/")
+            result[fillna == "1"].setdefault(key, {})[stat] = array
+    return result
+
+
+if __name__ == "__main__":
+    import shared_panel
+    # the loader reads the data itself, whatever its environment says
+    shared_panel.SHARED_PANEL_DIR = None
+
+    import utils
+    from refresher import BackgroundRefresher, warm_caches
+
+    parser = argparse.ArgumentParser(description="Publish the yield panel for server workers to share")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish_parser = subparsers.add_parser("publish", help="publish the current data once")
+    publish_parser.add_argument("--shared-dir", required=True)
+    publish_parser.add_argument("--data-dir", default=utils.CONSTANT_MATURITIES_DATA_DIR)
+
+    serve_parser = subparsers.add_parser("serve", help="refresh on the FRED schedule and publish every refresh")
+    serve_parser.add_argument("--shared-dir", required=True)
+    serve_parser.add_argument("--data-dir", default=utils.CONSTANT_MATURITIES_DATA_DIR)
+
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        snapshot = utils.record_data_snapshot(args.data_dir)
+        print(f"published {shared_panel.publish(warm_caches(args.data_dir), args.shared_dir, snapshot=snapshot)}")
+    elif args.command == "serve":
+        BackgroundRefresher(args.data_dir, publish_dir=args.shared_dir).start()
+        while True:
+            time.sleep(3600)
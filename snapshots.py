@@ -0,0 +1,244 @@
+"""
+Content-addressed snapshots of a data directory's csvs, recorded after every download
+
+    snapshots/objects/<sha256>.gz       one version of one series csv, in full or as a delta on its previous version
+    snapshots/manifests/<token>.json    series id -> object, parent snapshot, changed series, creation time
+    snapshots/HEAD                      token of the snapshot matching the csvs, plus their stat fingerprint
+
+FRED revisions are almost always appends, so a delta keeps the number of leading lines shared with the
+previous version and stores only the lines after them. A snapshot token names the whole data set: equal
+tokens mean byte-identical csvs. Recording unchanged csvs writes nothing.
+
+    python snapshots.py record                     # snapshot the current csvs
+    python snapshots.py list                       # history, oldest first
+    python snapshots.py checkout <token>           # materialize an older snapshot's csvs
+    CMH_DATA_SNAPSHOT=<token> streamlit run app.py # render against it
+"""
+import argparse
+from datetime import datetime, timezone
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+SNAPSHOTS_DIRNAME = "snapshots"
+HEAD_FILENAME = "HEAD"
+# a full copy every this many deltas, so rebuilding a version never replays a long chain
+MAX_DELTA_CHAIN = 16
+TOKEN_LENGTH = 16
+
+
+def snapshot_dir(data_directory_path):
+    return os.path.join(data_directory_path, SNAPSHOTS_DIRNAME)
+
+
+def _csv_files(data_directory_path):
+    return sorted(file for file in os.listdir(data_directory_path) if file.endswith(".csv"))
+
+
+def source_key(data_directory_path):
+    """
+    Stat fingerprint of the csvs, to tell whether HEAD still describes them without reading them
+    """
+    key = []
+    for file in _csv_files(data_directory_path):
+        stat = os.stat(os.path.join(data_directory_path, file))
+        key.append([file, stat.st_mtime_ns, stat.st_size])
+    return key
+
+
+def _atomic_write(path, data):
+    # unique per process and thread, refreshes and recordings may write the same file at once
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _object_file(store_dir, object_id):
+    return os.path.join(store_dir, "objects", object_id + ".gz")
+
+
+def read_object(store_dir, object_id):
+    """
+    Csv bytes of a stored series version, replaying its delta chain
+    """
+    with gzip.open(_object_file(store_dir, object_id)) as f:
+        header = f.readline().decode().split()
+        body = f.read()
+    if header[0] == "full":
+        return body
+
+    _, parent_id, keep_lines, _ = header
+    parent_lines = read_object(store_dir, parent_id).splitlines(keepends=True)
+    return b"".join(parent_lines[:int(keep_lines)]) + body
+
+
+def _chain_depth(store_dir, object_id):
+    with gzip.open(_object_file(store_dir, object_id)) as f:
+        header = f.readline().decode().split()
+    return 0 if header[0] == "full" else int(header[3])
+
+
+def write_object(store_dir, content, parent_id=None):
+    """
+    Store one series version (csv bytes), as a delta on parent_id when given and the chain is not too long
+
+    Returns:
+        object id, the sha256 of content
+    """
+    object_id = hashlib.sha256(content).hexdigest()
+    object_file = _object_file(store_dir, object_id)
+    if os.path.exists(object_file):
+        return object_id
+
+    header = b"full\n"
+    body = content
+    if parent_id is not None:
+        depth = _chain_depth(store_dir, parent_id) + 1
+        if depth <= MAX_DELTA_CHAIN:
+            parent_lines = read_object(store_dir, parent_id).splitlines(keepends=True)
+            lines = content.splitlines(keepends=True)
+            keep = 0
+            for old, new in zip(parent_lines, lines):
+                if old != new:
+                    break
+                keep += 1
+            header = f"delta {parent_id} {keep} {depth}\n".encode()
+            body = b"".join(lines[keep:])
+
+    os.makedirs(os.path.dirname(object_file), exist_ok=True)
+    _atomic_write(object_file, gzip.compress(header + body, mtime=0))
+    return object_id
+
+
+def _read_head(store_dir):
+    try:
+        with open(os.path.join(store_dir, HEAD_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(data_directory_path, token):
+    with open(os.path.join(snapshot_dir(data_directory_path), "manifests", token + ".json")) as f:
+        return json.load(f)
+
+
+def current_token(data_directory_path):
+    """
+    Token of the snapshot matching the csvs as they are now, None if they changed since the last record
+    """
+    head = _read_head(snapshot_dir(data_directory_path))
+    if head is None or head["source_key"] != source_key(data_directory_path):
+        return None
+    return head["token"]
+
+
+def record(data_directory_path):
+    """
+    Snapshot the csvs of a data directory, writing nothing when they match the current snapshot
+
+    Returns:
+        (token, series ids changed since the previous snapshot)
+    """
+    store_dir = snapshot_dir(data_directory_path)
+    head = _read_head(store_dir)
+    key = source_key(data_directory_path)
+    if head is not None and head["source_key"] == key:
+        return head["token"], []
+
+    previous = read_manifest(data_directory_path, head["token"])["series"] if head is not None else {}
+
+    series = {}
+    for file in _csv_files(data_directory_path):
+        series_id = file.split(".")[0]
+        with open(os.path.join(data_directory_path, file), "rb") as f:
+            content = f.read()
+        series[series_id] = write_object(store_dir, content, parent_id=previous.get(series_id))
+
+    token = hashlib.sha256(json.dumps(series, sort_keys=True).encode()).hexdigest()[:TOKEN_LENGTH]
+    changed = sorted(series_id for series_id in series.keys() | previous.keys()
+                     if series.get(series_id) != previous.get(series_id))
+
+    manifest_file = os.path.join(store_dir, "manifests", token + ".json")
+    if not os.path.exists(manifest_file):
+        manifest = {
+            "token": token,
+            "parent": head["token"] if head is not None else None,
+            "created": datetime.now(timezone.utc).isoformat(timespec="microseconds"),
+            "changed": changed,
+            "series": series,
+        }
+        os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+        _atomic_write(manifest_file, json.dumps(manifest, indent=1).encode())
+
+    # a touched but identical csv only refreshes the fingerprint
+    _atomic_write(os.path.join(store_dir, HEAD_FILENAME), json.dumps({"token": token, "source_key": key}).encode())
+    return token, changed
+
+
+def history(data_directory_path):
+    """
+    DataFrame of every snapshot: token, created, parent, changed series, oldest first
+    """
+    manifests_dir = os.path.join(snapshot_dir(data_directory_path), "manifests")
+    rows = []
+    for file in os.listdir(manifests_dir) if os.path.isdir(manifests_dir) else []:
+        manifest = read_manifest(data_directory_path, file[:-len(".json")])
+        rows.append({key: manifest[key] for key in ("token", "created", "parent", "changed")})
+    return pd.DataFrame(rows, columns=["token", "created", "parent", "changed"]).sort_values("created",
+                                                                                             ignore_index=True)
+
+
+def checkout(data_directory_path, token, target_directory_path=None):
+    """
+    Write a snapshot's csvs to a directory (by default snapshots/checkouts/<token>), reused if already there
+
+    Returns:
+        the directory, loadable like any data directory
+    """
+    manifest = read_manifest(data_directory_path, token)
+    store_dir = snapshot_dir(data_directory_path)
+    if target_directory_path is None:
+        target_directory_path = os.path.join(store_dir, "checkouts", token)
+
+    complete_file = os.path.join(target_directory_path, ".complete")
+    if os.path.exists(complete_file):
+        return target_directory_path
+
+    os.makedirs(target_directory_path, exist_ok=True)
+    for series_id, object_id in manifest["series"].items():
+        _atomic_write(os.path.join(target_directory_path, series_id + ".csv"), read_object(store_dir, object_id))
+    _atomic_write(complete_file, token.encode())
+    return target_directory_path
+
+
+if __name__ == "__main__":
+    import utils
+
+    parser = argparse.ArgumentParser(description="Content-addressed snapshots of the downloaded csvs")
+    parser.add_argument("--data-dir", default=utils.CONSTANT_MATURITIES_DATA_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("record", help="snapshot the current csvs")
+    subparsers.add_parser("list", help="every snapshot, oldest first")
+    checkout_parser = subparsers.add_parser("checkout", help="write a snapshot's csvs to a directory")
+    checkout_parser.add_argument("token")
+    checkout_parser.add_argument("output_dir", nargs="?", default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        token, changed = record(args.data_dir)
+        print(f"{token} ({', '.join(changed) or 'unchanged'})")
+    elif args.command == "list":
+        print(history(args.data_dir).to_string(index=False))
+    elif args.command == "checkout":
+        print(checkout(args.data_dir, args.token, args.output_dir))
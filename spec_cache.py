@@ -0,0 +1,97 @@
+"""
+Process-wide cache of serialized Vega-Lite specs, so reruns skip Altair construction and validation
+
+Specs are keyed by (data version, chart name, parameters): a data refresh changes the panel version,
+which retires every spec built from the old data.
+"""
+from collections import namedtuple, OrderedDict
+import hashlib
+import json
+import threading
+
+import altair as alt
+import pandas as pd
+
+from instrumentation import annotate, span
+import utils
+
+SPEC_CACHE_SIZE = 64
+
+# spec_json references its data by name, datasets maps those names to the (shared, read-only) frames
+ChartSpec = namedtuple("ChartSpec", ["spec_json", "datasets"])
+
+_specs = OrderedDict()
+_lock = threading.Lock()
+# Altair's data transformer and theme registries are process-global, sessions serialize one at a time
+_serialize_lock = threading.Lock()
+
+
+def spec_key(chart_name, version, params):
+    return version, chart_name, json.dumps(params, sort_keys=True, default=str)
+
+
+def _dataset_name(data):
+    digest = hashlib.md5(pd.util.hash_pandas_object(data).values.tobytes())
+    digest.update(json.dumps([str(column) for column in data.columns]).encode())
+    return digest.hexdigest()
+
+
+def serialize_chart(chart):
+    """
+    ChartSpec of an Altair chart, serialized the way st.altair_chart does
+
+    Frames stay frames (streamlit sends them as arrow, keeping timestamps typed) instead of
+    being inlined as json records, and the default theme's width/height config is left out.
+    """
+    datasets = {}
+
+    def by_name(data):
+        name = _dataset_name(data)
+        datasets[name] = data
+        return {"name": name}
+
+    with _serialize_lock:
+        alt.data_transformers.register("spec_cache", by_name)
+        with alt.theme.enable("none"), alt.data_transformers.enable("spec_cache"):
+            spec_json = chart.to_json(indent=None)
+    return ChartSpec(spec_json, datasets)
+
+
+def chart_spec(build, **params):
+    """
+    ChartSpec of build(**params) for the current data, built on a miss only
+
+    build: chart builder from charts.py, its name identifies the chart
+    """
+    chart_name = build.__name__
+    version = utils.load_yield_panel().version
+    key = spec_key(chart_name, version, params)
+
+    with span(f"spec_cache.{chart_name}"):
+        with _lock:
+            spec = _specs.get(key)
+            if spec is not None:
+                _specs.move_to_end(key)
+        annotate(cache_hit=spec is not None)
+        if spec is not None:
+            return spec
+
+        # concurrent misses may build the same spec twice, the result is identical
+        spec = serialize_chart(build(**params))
+        with _lock:
+            _specs[key] = spec
+            while len(_specs) > SPEC_CACHE_SIZE:
+                _specs.popitem(last=False)
+        return spec
+
+
+def vega_lite_spec(spec):
+    """
+    Fresh spec dict for st.vega_lite_chart, which consumes the datasets entry
+    """
+    return {**json.loads(spec.spec_json), "datasets": dict(spec.datasets)}
+
+
+def clear():
+    with _lock:
+        _specs.clear()
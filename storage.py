@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+PANEL_STORE_DIRNAME = "panel"
+MANIFEST_FILENAME = "manifest.json"
+PANEL_ARRAYS = ("dates", "values", "observed")
+# superseded arrays are removed once older than this, a reader that just read their manifest may still open them
+ARRAY_GRACE_SECONDS = 60
+READ_ATTEMPTS = 3
+
+
+def panel_store_dir(data_directory_path):
+    """
+    Binary panel store lives next to the csvs it was built from
+    """
+    return os.path.join(data_directory_path, PANEL_STORE_DIRNAME)
+
+
+def _tmp_path(path):
+    # unique per process and thread, so concurrent writers of one store never share a temp file
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _atomic_save(path, array):
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "wb") as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _array_files(manifest):
+    # stores written before arrays were versioned use fixed names
+    return manifest.get("files") or {name: name + ".npy" for name in PANEL_ARRAYS}
+
+
+def write_panel_store(store_dir, dates, values, observed, series, source_key=None):
+    """
+    Save panel arrays as .npy files plus a json manifest
+
+    Arrays are written under names tagged with the source key and never replaced in place, the manifest
+    naming them is written last. A reader sees either the previous store or the new one, never a mix.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    key = [list(entry) for entry in source_key] if source_key is not None else None
+    tag = hashlib.sha1(json.dumps(key).encode() if key is not None else os.urandom(16)).hexdigest()[:12]
+    files = {name: f"{name}-{tag}.npy" for name in PANEL_ARRAYS}
+
+    _atomic_save(os.path.join(store_dir, files["dates"]), np.asarray(dates, dtype="datetime64[ns]"))
+    _atomic_save(os.path.join(store_dir, files["values"]), np.asarray(values, dtype=np.float64))
+    _atomic_save(os.path.join(store_dir, files["observed"]), np.asarray(observed, dtype=bool))
+
+    manifest = {
+        "series": list(series),
+        "shape": [len(dates), len(series)],
+        "source_key": key,
+        "files": files,
+    }
+    manifest_file = os.path.join(store_dir, MANIFEST_FILENAME)
+    tmp_file = _tmp_path(manifest_file)
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, manifest_file)
+
+    _remove_superseded_arrays(store_dir)
+
+
+def _remove_superseded_arrays(store_dir):
+    """
+    Remove arrays no manifest names anymore, once ARRAY_GRACE_SECONDS old (concurrent writers may still be
+    about to publish theirs)
+    """
+    current = _read_manifest(store_dir)
+    keep = set(_array_files(current).values()) if current is not None else set()
+    for file in os.listdir(store_dir):
+        if not file.endswith(".npy") or file.split("-")[0].split(".")[0] not in PANEL_ARRAYS or file in keep:
+            continue
+        path = os.path.join(store_dir, file)
+        try:
+            if time.time() - os.stat(path).st_mtime > ARRAY_GRACE_SECONDS:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_panel_store(store_dir, source_key=None, mmap=True):
+    """
+    Load panel arrays from a store, memory mapped by default
+
+    Returns None if the store is missing or was built from different source files than source_key
+    """
+    mmap_mode = "r" if mmap else None
+    for attempt in range(READ_ATTEMPTS):
+        manifest = _read_manifest(store_dir)
+        if manifest is None:
+            return None
+
+        if source_key is not None and manifest["source_key"] != [list(entry) for entry in source_key]:
+            return None
+
+        try:
+            arrays = {name: np.load(os.path.join(store_dir, file), mmap_mode=mmap_mode, allow_pickle=False)
+                      for name, file in _array_files(manifest).items()}
+        except FileNotFoundError:
+            # rewritten twice since the manifest was read, read it again
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+            continue
+        arrays["series"] = manifest["series"]
+        return arrays
+
+
+def export_csv(store_dir, output_directory_path):
+    """
+    Write one FRED style csv per series ('observation_date,<series>') from a binary store
+    """
+    arrays = read_panel_store(store_dir, mmap=True)
+    if arrays is None:
+        print(f"no panel store in {store_dir}")
+        return
+
+    os.makedirs(output_directory_path, exist_ok=True)
+    dates = pd.DatetimeIndex(arrays["dates"], name="observation_date")
+
+    for col, series_id in enumerate(arrays["series"]):
+        rows = np.asarray(arrays["observed"][:, col])
+        data = pd.Series(np.asarray(arrays["values"][rows, col]), index=dates[rows], name=series_id)
+
+        csv_filename = os.path.join(output_directory_path, series_id + ".csv")
+        data.to_csv(csv_filename, index_label="observation_date", date_format="%Y-%m-%d")
+
+
+if __name__ == "__main__":
+    import utils
+
+    parser = argparse.ArgumentParser(description="Manage the binary yield panel store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="build the binary store from the csvs")
+    migrate_parser.add_argument("--data-dir", default=utils.CONSTANT_MATURITIES_DATA_DIR)
+
+    export_parser = subparsers.add_parser("export-csv", help="write csvs from the binary store")
+    export_parser.add_argument("output_dir")
+    export_parser.add_argument("--data-dir", default=utils.CONSTANT_MATURITIES_DATA_DIR)
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        utils.migrate_to_panel_store(args.data_dir)
+        print(f"wrote {panel_store_dir(args.data_dir)}")
+    elif args.command == "export-csv":
+        export_csv(panel_store_dir(args.data_dir), args.output_dir)
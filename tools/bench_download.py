@@ -0,0 +1,104 @@
+"""
+Wall time of a full FRED refresh against a local stub server, sequential vs concurrent
+
+Run from the repo root:
+    python -m tools.bench_download --latency 0.2 --workers 1 4 8
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import downloader
+import utils
+
+
+def _load_observations(data_directory_path):
+    observations = {}
+    for series_id in utils.TREASURY_SERIES:
+        dataframe = pd.read_csv(os.path.join(data_directory_path, series_id + ".csv"), dtype=str,
+                                keep_default_na=False)
+        observations[series_id] = [{"date": row_date, "value": value or "."}
+                                   for row_date, value in zip(dataframe.iloc[:, 0], dataframe.iloc[:, 1])]
+    return observations
+
+
+def make_stub_handler(observations, latency, error_rate):
+    """
+    Handler answering /fred/series/observations like FRED's json api, with fixed latency
+    and a fraction of requests failing with 429/503
+    """
+    class StubFredHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            if random.random() < error_rate:
+                status = random.choice([429, 503])
+                self.send_response(status)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            rows = observations.get(params.get("series_id"), [])
+            start = params.get("observation_start")
+            if start:
+                rows = [row for row in rows if row["date"] >= start]
+
+            body = json.dumps({"observations": rows}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubFredHandler
+
+
+def run_benchmark(latency, workers_list, error_rate):
+    observations = _load_observations(utils.CONSTANT_MATURITIES_DATA_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_stub_handler(observations, latency, error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    root_url = f"http://127.0.0.1:{server.server_address[1]}/fred"
+
+    results = []
+    try:
+        for max_workers in workers_list:
+            fred = downloader.FredHTTPClient(api_key="stub", root_url=root_url, backoff_seconds=0.05,
+                                             requests_per_second=None)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                start = time.perf_counter()
+                _, errors = utils.download_fred_data(fred=fred, data_directory_path=tmp_dir,
+                                                     full_refresh=True, max_workers=max_workers)
+                elapsed = time.perf_counter() - start
+
+            results.append({"max_workers": max_workers, "seconds": round(elapsed, 3), "errors": len(errors)})
+            print(f"workers={max_workers:<3} full refresh {elapsed:7.3f}s  failed series: {len(errors)}")
+    finally:
+        server.shutdown()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="stub server latency per request (s)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 429/503")
+    args = parser.parse_args()
+
+    run_benchmark(args.latency, args.workers, args.error_rate)
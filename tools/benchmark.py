@@ -0,0 +1,194 @@
+"""
+Headless benchmarks for the data pipeline and chart spec generation (no streamlit, no network)
+
+Run from the repo root:
+    python -m tools.benchmark                                  # bundled treasury data
+    python -m tools.benchmark --series 120 --years 100         # synthetic dataset
+    python -m tools.benchmark --output bench_output.json       # save results for later comparison
+    CMH_MEMORY_BUDGET_MB=4 python -m tools.benchmark           # same, under a panel memory budget
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import spec_cache
+import utils
+
+
+def timed(fn, repeat=5):
+    """
+    Run fn repeat times, returning (result of last run, timing summary in milliseconds)
+    """
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, {"min_ms": round(min(samples), 3), "median_ms": round(statistics.median(samples), 3),
+                    "repeat": repeat}
+
+
+def write_synthetic_dataset(data_directory_path, n_series, n_years, seed=0):
+    """
+    FRED style csvs for n_series maturities ('DGS1'...'DGS<n>') of business-daily random walk yields
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end="2025-01-01", periods=n_years * 261)
+
+    for i in range(n_series):
+        series_id = f"DGS{i + 1}"
+        values = np.round(np.clip(5 + np.cumsum(rng.normal(0, 0.05, len(dates))), 0, None), 2)
+        values[rng.random(len(dates)) < 0.03] = np.nan  # holidays
+
+        data = pd.Series(values, index=dates, name=series_id)
+        data.to_csv(os.path.join(data_directory_path, series_id + ".csv"), index_label="observation_date",
+                    date_format="%Y-%m-%d")
+
+
+def _cold_load(data_directory_path, backend):
+    utils._yield_panels.clear()
+    utils.STORAGE_BACKEND = backend
+    return utils.load_yield_panel(data_directory_path)
+
+
+def bench_data_pipeline(data_directory_path, repeat):
+    results = {}
+    default_backend = utils.STORAGE_BACKEND
+
+    try:
+        _, results["cold_load_csv"] = timed(lambda: _cold_load(data_directory_path, "csv"), repeat)
+        utils.migrate_to_panel_store(data_directory_path)
+        _, results["cold_load_npy"] = timed(lambda: _cold_load(data_directory_path, "npy"), repeat)
+    finally:
+        utils.STORAGE_BACKEND = default_backend
+
+    panel = utils.load_yield_panel(data_directory_path)
+    _, results["warm_load"] = timed(lambda: utils.load_yield_panel(data_directory_path), repeat)
+
+    rng = np.random.default_rng(0)
+    query_dates = pd.DatetimeIndex(rng.choice(panel.dates.values, 1000))
+    _, single = timed(lambda: [panel.asof(d) for d in query_dates[:100]], repeat)
+    results["curve_lookup_per_date"] = {key: round(value / 100, 4) if key != "repeat" else value
+                                        for key, value in single.items()}
+    _, results["curve_lookup_batch_1000"] = timed(lambda: panel.asof(query_dates), repeat)
+
+    def build_derived():
+        panel._pyramids.clear()
+        panel._derived.clear()
+        panel._series_bounds.clear()
+        return [panel.derived_series(rate) for rate in ("W", "ME")]
+
+    # keep the persisted derived cache out of the measurement
+    store_dir, panel.store_dir = panel.store_dir, None
+    _, results["derived_series"] = timed(build_derived, repeat)
+    panel.store_dir = store_dir
+
+    results["memory_bytes"] = panel.memory_usage()
+    results["dataset"] = {"series": len(panel.series), "rows": len(panel.dates),
+                          "first_date": str(panel.dates[0].date()), "last_date": str(panel.dates[-1].date())}
+    return results
+
+
+def bench_charts(repeat):
+    """
+    Build time and serialized Vega-Lite size of every chart, against the bundled data
+    """
+    import charts
+
+    chart_builders = {
+        "yield_spread_chart": charts.yield_spread_chart,
+        "yield_range_time_series_chart": charts.yield_range_time_series_chart,
+        "lowest_yielding_duration_time_series_chart": charts.lowest_yielding_duration_time_series_chart,
+        "highest_yielding_duration_time_series_chart": charts.highest_yielding_duration_time_series_chart,
+        "forward_rate_chart": charts.forward_rate_chart,
+        "spread_volatility_chart": charts.spread_volatility_chart,
+        "yield_curve_comparison_chart": lambda: charts.yield_curve_comparison_chart(
+            *utils.get_dated_yield_curve(pd.Timestamp("2024-01-12")),
+            *utils.get_dated_yield_curve(pd.Timestamp("2000-06-15"))),
+    }
+
+    results = {}
+    for name, build in chart_builders.items():
+        chart, build_timing = timed(build, repeat)
+        spec_json, serialize_timing = timed(chart.to_json, repeat)
+        results[name] = {"build": build_timing, "serialize": serialize_timing, "spec_bytes": len(spec_json)}
+
+    _, results["all_charts"] = timed(lambda: [chart.to_json() for chart in
+                                              (build() for build in chart_builders.values())], repeat)
+
+    # a rerun of app.py once its specs are cached (see spec_cache.py)
+    app_charts = [charts.yield_spread_chart, charts.yield_range_time_series_chart,
+                  charts.lowest_yielding_duration_time_series_chart, charts.highest_yielding_duration_time_series_chart]
+    spec_cache.clear()
+    _, results["app_charts_spec_cache_miss"] = timed(lambda: [spec_cache.serialize_chart(build())
+                                                              for build in app_charts], repeat)
+    _, results["app_charts_spec_cache_hit"] = timed(lambda: [spec_cache.vega_lite_spec(spec_cache.chart_spec(build))
+                                                             for build in app_charts], repeat)
+    return results
+
+
+def bench_curves(repeat):
+    """
+    NSS fitting of every date (cold and refitting the latest 20 dates) and spline evaluation, bundled data
+    """
+    import curves
+
+    dates, years, inputs = curves._fit_inputs(utils.load_yield_panel())
+    targets = np.linspace(0.25, 30, 120)
+
+    results = {}
+    (params, _), results["nss_fit_all_dates"] = timed(lambda: curves.fit_nss(years, inputs), 1)
+    init_taus = np.repeat(params[-21:-20, 4:6], 20, axis=0)
+    _, results["nss_refit_20_dates"] = timed(lambda: curves.fit_nss(years, inputs[-20:], init_taus), repeat)
+    _, results["nss_yields_all_dates_120_maturities"] = timed(lambda: curves.nss_yields(params, targets), repeat)
+    _, results["spline_all_dates_120_maturities"] = timed(lambda: curves.spline_yields(years, inputs, targets), repeat)
+    results["fitted_dates"] = len(dates)
+    return results
+
+
+def run(series=None, years=None, repeat=5):
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+    if series:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_synthetic_dataset(tmp_dir, series, years or 60)
+            report["data_pipeline"] = bench_data_pipeline(tmp_dir, repeat)
+            utils._yield_panels.pop(tmp_dir, None)
+    else:
+        report["data_pipeline"] = bench_data_pipeline(utils.CONSTANT_MATURITIES_DATA_DIR, repeat)
+        report["charts"] = bench_charts(repeat)
+        report["curves"] = bench_curves(repeat)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the yield data pipeline and chart specs")
+    parser.add_argument("--series", type=int, help="benchmark a synthetic dataset with this many series")
+    parser.add_argument("--years", type=int, default=60, help="years of business-daily data per synthetic series")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the json report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(series=args.series, years=args.years, repeat=args.repeat)
+
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report_json)
+    else:
+        print(report_json)
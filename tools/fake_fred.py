@@ -0,0 +1,85 @@
+"""
+Offline stand-in for fredapi.Fred, plus a self check of the incremental refresh
+
+Run from the repo root:
+    python -m tools.fake_fred
+"""
+import filecmp
+import os
+import tempfile
+
+import pandas as pd
+
+import utils
+
+
+class FakeFred:
+    """
+    Serves series from in-memory pandas Series and records every get_series call
+    """
+    def __init__(self, series_dict):
+        self.series_dict = series_dict
+        self.calls = []
+
+    @classmethod
+    def from_csv_directory(cls, data_directory_path):
+        series_dict = {}
+        for file in os.listdir(data_directory_path):
+            if not file.endswith(".csv"):
+                continue
+            dataframe = pd.read_csv(os.path.join(data_directory_path, file),
+                                    parse_dates=["observation_date"],
+                                    index_col="observation_date",
+                                    na_values=[""])
+            series = dataframe.iloc[:, 0]
+            series.index.name = None
+            series_dict[file.split(".")[0]] = series
+        return cls(series_dict)
+
+    def get_series(self, series_id, observation_start=None, observation_end=None, **kwargs):
+        self.calls.append((series_id, observation_start))
+
+        data = self.series_dict[series_id]
+        if observation_start is not None:
+            data = data[data.index >= pd.Timestamp(observation_start)]
+        if observation_end is not None:
+            data = data[data.index <= pd.Timestamp(observation_end)]
+        return data.copy()
+
+
+def check_incremental_refresh(tail_rows=30):
+    """
+    Drop the last rows of every csv, refresh from a FakeFred holding the full history
+    and check the rebuilt csvs are byte-for-byte identical to the originals
+    """
+    fake_fred = FakeFred.from_csv_directory(utils.CONSTANT_MATURITIES_DATA_DIR)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for series_id in utils.TREASURY_SERIES:
+            with open(os.path.join(utils.CONSTANT_MATURITIES_DATA_DIR, series_id + ".csv")) as f:
+                lines = f.readlines()
+            with open(os.path.join(tmp_dir, series_id + ".csv"), "w") as f:
+                f.writelines(lines[:-tail_rows])
+
+        utils.download_fred_data(fred=fake_fred, data_directory_path=tmp_dir)
+
+        for series_id, observation_start in fake_fred.calls:
+            assert observation_start is not None, f"{series_id} was fully re-downloaded"
+
+        for series_id in utils.TREASURY_SERIES:
+            original = os.path.join(utils.CONSTANT_MATURITIES_DATA_DIR, series_id + ".csv")
+            refreshed = os.path.join(tmp_dir, series_id + ".csv")
+            assert filecmp.cmp(original, refreshed, shallow=False), f"{series_id} differs after refresh"
+
+        # a second refresh finds nothing new and leaves files untouched
+        mtimes = {file: os.stat(os.path.join(tmp_dir, file)).st_mtime_ns
+                  for file in os.listdir(tmp_dir) if file.endswith(".csv")}
+        utils.download_fred_data(fred=fake_fred, data_directory_path=tmp_dir)
+        for file, mtime in mtimes.items():
+            assert os.stat(os.path.join(tmp_dir, file)).st_mtime_ns == mtime, f"{file} rewritten with no new data"
+
+    print(f"incremental refresh ok ({len(fake_fred.calls)} requests)")
+
+
+if __name__ == "__main__":
+    check_incremental_refresh()
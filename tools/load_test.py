@@ -0,0 +1,146 @@
+"""
+Load test of the HTTP API (api.py) over keep-alive connections on localhost
+
+Run from the repo root:
+    python -m tools.load_test                                    # starts api.py on a free port
+    python -m tools.load_test --connections 64 --duration 10
+    python -m tools.load_test --url http://127.0.0.1:8600        # against a running server
+    python -m tools.load_test --conditional                      # send If-None-Match, measures 304s
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+REQUEST_MIX = [
+    "/curve?date=2024-01-02",
+    "/curve?date=2007-06-01",
+    "/curves?date=2000-01-03&date=2008-09-15&date=2020-03-16",
+    "/spread?long=10-year&short=2-year&sample_rate=W",
+    "/spread?long=10-year&short=3-month&sample_rate=ME&start=2000-01-01",
+    "/range?sample_rate=ME",
+    "/extremes?sample_rate=W&start=2015-01-01",
+    "/version",
+]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, os.path.join(repo_root, "api.py"), "--port", str(port)],
+                               cwd=repo_root, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urlopen(f"http://127.0.0.1:{port}/version", timeout=1).read()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("api server exited")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("api server did not start")
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers, body
+
+
+async def _connection(host, port, paths, deadline, gzip, conditional, results, offset):
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+            if gzip:
+                request += "Accept-Encoding: gzip\r\n"
+            if conditional and path in etags:
+                request += f"If-None-Match: {etags[path]}\r\n"
+            start = time.perf_counter()
+            writer.write((request + "\r\n").encode("latin-1"))
+            status, headers, body = await _read_response(reader)
+            results["latencies"].append(time.perf_counter() - start)
+            results["statuses"][status] = results["statuses"].get(status, 0) + 1
+            results["bytes"] += len(body)
+            if "etag" in headers:
+                etags[path] = headers["etag"]
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, connections, duration, gzip, conditional):
+    results = {"latencies": [], "statuses": {}, "bytes": 0}
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*[_connection(host, port, REQUEST_MIX, deadline, gzip, conditional, results, n)
+                           for n in range(connections)])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(results["latencies"])
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        "statuses": results["statuses"],
+        "mb_received": round(results["bytes"] / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="running server, default starts api.py on a free port")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument("--no-gzip", action="store_true")
+    parser.add_argument("--conditional", action="store_true")
+    args = parser.parse_args()
+
+    process = None
+    if args.url is None:
+        port = _free_port()
+        process = start_server(port)
+        host = "127.0.0.1"
+    else:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+
+    try:
+        # one pass first, so the numbers are for a warm response cache
+        asyncio.run(run_load(host, port, 1, 0.5, not args.no_gzip, False))
+        report = asyncio.run(run_load(host, port, args.connections, args.duration, not args.no_gzip,
+                                      args.conditional))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    for name, value in report.items():
+        print(f"{name:>20}: {value}")
+
+
+if __name__ == "__main__":
+    main()
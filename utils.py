@@ -1,13 +1,35 @@
+from collections import namedtuple, OrderedDict
 from datetime import date, timedelta
+import hashlib
 import os
+import re
+import threading
+import time
 
-from fredapi import Fred
+import numpy as np
 import pandas as pd
 
+import availability
+import compact
+import derived
+import downloader
+import ingest
+from instrumentation import annotate, instrumented
+import shared_panel
+import snapshots
+import storage
+
 MAIN_DIR = os.path.dirname(os.path.realpath(__file__))
 CONSTANT_MATURITIES_DATA_DIR = os.path.join(MAIN_DIR, "data", "treasury-constant-maturity")
+# render against an older recorded snapshot of the data (see snapshots.py) instead of the latest csvs
+DATA_SNAPSHOT = os.environ.get("CMH_DATA_SNAPSHOT") or None
+if DATA_SNAPSHOT is not None:
+    CONSTANT_MATURITIES_DATA_DIR = snapshots.checkout(CONSTANT_MATURITIES_DATA_DIR, DATA_SNAPSHOT)
 FED_FUNDS_CSV_FILE = os.path.join(CONSTANT_MATURITIES_DATA_DIR, "FF.csv")
 
+# "npy": keep a memory mapped binary copy of the csvs, "csv": always parse the csvs
+STORAGE_BACKEND = os.environ.get("CMH_STORAGE_BACKEND", "npy")
+
 TREASURY_SERIES = ["FF", "DGS1MO", "DGS3MO", "DGS6MO", "DGS1", "DGS2", "DGS3", "DGS5", "DGS7", "DGS10", "DGS20", "DGS30"]
 
 RECESSIONS = ["2020-03-30", "2007-12-01", "2001-03-01", "1990-07-01", "1981-07-01", "1980-01-01", "1973-11-01", "1969-12-01"]
@@ -16,19 +38,564 @@ RECESSION_ENDS = ["2020-04-30", "2009-06-01", "2001-11-01", "1991-03-01", "1982-
 SP_500_PEAKS = ["2022-01-01", "2020-02-01", "2007-10-01", "2000-03-01", "1987-08-01", "1980-11-01", "1973-01-01", "1968-11-01"]
 SP_500_TROUGHS = ["2022-10-01", "2020-03-01", "2009-03-01", "2002-10-01", "1987-12-01", "1982-08-01", "1974-10-01", "1970-05-01"]
 
+# yield_curve_history steps: business days, Fridays, month ends
+CURVE_STEPS = ("D", "W", "ME")
+
+# typed maturity identifier, e.g. Maturity("DGS10", "10-year", 10.0)
+Maturity = namedtuple("Maturity", ["series_id", "label", "years"])
+
+# a refresh holds this file in the data directory while it rewrites the csvs (see refresher.py)
+REFRESH_LOCK_FILENAME = ".refresh.lock"
+# a lock file older than this is assumed to belong to a crashed process
+REFRESH_LOCK_STALE_SECONDS = 15 * 60
+
+# process-wide panels keyed by data directory, shared read-only by every session
+_yield_panels = {}
+_yield_panels_lock = threading.Lock()
+
+
+class YieldPanel:
+    """
+    Columnar, read-only view of every series in a data directory
+
+    dates:    sorted DatetimeIndex, union of all series observation dates
+    values:   float64 matrix (dates x series), NaN for blank or absent rows
+    observed: bool matrix (dates x series), True where the series csv has a row
+    series:   series ids in column order ('FF', 'DGS1MO', ...)
+    maturities: curve maturity of each series ('0-month', '1-month', ...), None for series off the curve
+    labels:   frame column of each series, its maturity or else its series id
+
+    Under a memory budget (see set_memory_budget) values/observed may be held compactly (see compact.py)
+    and decoded on access, and pyramid levels are built on demand and evicted least recently used first.
+
+    asof_rows, version and pyramids may be passed in precomputed, e.g. from a shared segment (see shared_panel.py)
+    snapshot: data snapshot token the loader published the panel with (see snapshots.py), None for local panels
+    """
+    def __init__(self, dates, values, observed, series, source_key=None, store_dir=None, asof_rows=None,
+                 version=None, pyramids=None, snapshot=None):
+        values.flags.writeable = False
+        observed.flags.writeable = False
+
+        self.dates = dates
+        self._values = values
+        self._observed = observed
+        self.compact = None
+        self.memory_budget = None
+        self.series = list(series)
+        self.maturities = [parse_duration_from_filename(s) for s in self.series]
+        self.labels = [maturity or s for s, maturity in zip(self.series, self.maturities)]
+        # only series with a maturity take part in the curve extremes
+        self.curve_columns = [col for col, maturity in enumerate(self.maturities) if maturity is not None]
+        self.source_key = source_key
+        self.store_dir = store_dir
+        self.version = version if version is not None else _panel_version(dates, values, observed, self.series)
+        self.snapshot = snapshot
+        self._derived = {}
+        self._pyramids = dict(pyramids) if pyramids is not None else {}
+        self._pyramid_lock = threading.Lock()
+        self._series_bounds = {}
+        self._level_use = OrderedDict()
+        self._availability = None
+
+        if asof_rows is None:
+            # row of each series' most recent non-blank value at or before every date, -1 if none yet
+            asof_rows = np.where(~np.isnan(values), np.arange(len(dates), dtype=np.int32)[:, None], np.int32(-1))
+            np.maximum.accumulate(asof_rows, axis=0, out=asof_rows)
+            asof_rows.flags.writeable = False
+        self.asof_rows = asof_rows
+
+        # date of each series' last csv row, lookups past it always take the latest value
+        last_rows = len(dates) - 1 - np.argmax(observed[::-1], axis=0)
+        self.series_end_dates = dates.values[last_rows] if len(dates) else dates.values[:0]
+
+    @property
+    def values(self):
+        return self._values if self.compact is None else self.compact.dense_values()
+
+    @property
+    def observed(self):
+        return self._observed if self.compact is None else self.compact.observed()
+
+    def _take(self, rows, cols):
+        return self._values[rows, cols] if self.compact is None else self.compact.take(rows, cols)
+
+    def _observed_column(self, col):
+        return self._observed[:, col] if self.compact is None else self.compact.observed_column(col)
+
+    def column(self, series_id):
+        return self.series.index(series_id)
+
+    def last_observation_date(self, series_id):
+        """
+        Date of the last row in the series csv (may be a blank value)
+        """
+        rows = np.flatnonzero(self._observed_column(self.column(series_id)))
+        return self.dates[rows[-1]].date()
+
+    def asof(self, query_dates, max_staleness_days=7):
+        """
+        Most recent valid value on or before each query date, for every series at once
+
+        Binary search on the sorted date index, so each date is O(log n) regardless of history length.
+        A value older than max_staleness_days is dropped (NaN) unless the query is past the series' last row.
+
+        Returns:
+            (values, observation_dates): (query dates x series) float64 and datetime64 matrices
+        """
+        query = pd.DatetimeIndex(np.atleast_1d(query_dates)).values
+        n_series = len(self.series)
+
+        pos = self.dates.searchsorted(query, side="right") - 1
+        rows = self.asof_rows[np.maximum(pos, 0)]
+        rows = np.where((pos >= 0)[:, None], rows, -1)
+
+        found = rows >= 0
+        safe_rows = np.maximum(rows, 0)
+        observation_dates = self.dates.values[safe_rows]
+
+        stale = ((query[:, None] < self.series_end_dates[None, :])
+                 & (query[:, None] - observation_dates > np.timedelta64(max_staleness_days, "D")))
+        found &= ~stale
+
+        values = np.where(found, self._take(safe_rows, np.arange(n_series)), np.nan)
+        observation_dates = np.where(found, observation_dates, np.datetime64("NaT"))
+        return values, observation_dates
+
+    @instrumented("YieldPanel.derived_series")
+    def derived_series(self, sample_rate="W"):
+        """
+        Resampled yields plus highest/lowest yield, spread and extreme maturities (see derived.py)
+
+        Computed once per data version and sample rate, persisted in the panel store when there is one
+        """
+        cached = self._derived.get(sample_rate)
+        annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return cached
+
+        cache_file = derived.derived_cache_file(self.store_dir, sample_rate) if self.store_dir else None
+        if cache_file is not None:
+            cached = derived.load_derived(cache_file, self.version)
+
+        if cached is None:
+            dates, matrix = self.resampled(sample_rate, fillna=False)
+            cached = derived.compute_derived(dates, matrix[:, self.curve_columns],
+                                             [self.maturities[col] for col in self.curve_columns])
+            if cache_file is not None:
+                try:
+                    derived.save_derived(cache_file, self.version, cached)
+                except OSError as e:
+                    print(f"could not write derived cache: {e}")
+
+        for array in cached.values():
+            array.flags.writeable = False
+        self._derived[sample_rate] = cached
+        return cached
+
+    def availability(self):
+        """
+        Per series availability interval index (see availability.py), built once per data version
+        """
+        if self._availability is None:
+            self._availability = availability.AvailabilityIndex.from_panel(self.dates, self.values, self.observed,
+                                                                           self.series)
+        return self._availability
+
+    def filled_values(self):
+        """
+        values with each series forward filled over its own csv rows only (rows it lacks stay NaN)
+        """
+        filled = self._take(np.maximum(self.asof_rows, 0), np.arange(len(self.series)))
+        return np.where(self.observed & (self.asof_rows >= 0), filled, np.nan)
+
+    @instrumented("YieldPanel.pyramid")
+    def pyramid(self, fillna=True):
+        """
+        Daily/weekly/monthly/quarterly/yearly mean, min, max and last of every series (see derived.py)
+
+        Built once per data version, extra sample rates are added as they are first requested.
+        Under a memory budget every level is built on first request instead.
+        """
+        pyramid = self._pyramids.get(fillna)
+        annotate(cache_hit=pyramid is not None)
+        if pyramid is None:
+            with self._pyramid_lock:
+                pyramid = self._pyramids.get(fillna)
+                if pyramid is None:
+                    if self.memory_budget is None:
+                        matrix = self.filled_values() if fillna else self.values
+                        pyramid = derived.build_pyramid(self.dates, matrix)
+                    else:
+                        pyramid = {}
+                    self._pyramids[fillna] = pyramid
+        return pyramid
+
+    def pyramid_level(self, sample_rate="W", fillna=True):
+        key = derived.level_key(sample_rate)
+        pyramid = self.pyramid(fillna)
+
+        level = pyramid.get(key)
+        if level is None:
+            matrix = self.filled_values() if fillna else self.values
+            level = derived.resample_level(self.dates, matrix, sample_rate)
+            pyramid[key] = level
+
+        if self.memory_budget is not None:
+            with self._pyramid_lock:
+                self._level_use[(fillna, key)] = None
+                self._level_use.move_to_end((fillna, key))
+                self._enforce_memory_budget()
+        return level
+
+    def set_memory_budget(self, budget_bytes):
+        """
+        Cap the resident bytes of this panel and its pyramids, None for no limit
+
+        Over budget, values are first held compactly, then least recently used pyramid levels are dropped
+        (and rebuilt when next requested). Results are unchanged, only time is traded for memory.
+        """
+        with self._pyramid_lock:
+            self.memory_budget = budget_bytes
+            if budget_bytes is not None:
+                # levels built eagerly before the budget was set join the eviction order
+                for fillna, pyramid in self._pyramids.items():
+                    for key in pyramid:
+                        self._level_use.setdefault((fillna, key), None)
+                self._enforce_memory_budget()
+
+    def _enforce_memory_budget(self):
+        # caller holds _pyramid_lock
+        if self.compact is None and self.memory_usage()["total"] > self.memory_budget:
+            try:
+                self.compact = compact.CompactPanel.from_dense(self.dates, self._values, self._observed,
+                                                               self.series)
+                self._values = None
+                self._observed = None
+            except ValueError as e:
+                print(f"keeping float64 values: {e}")
+
+        # the level just requested is kept even if it alone is over budget
+        while len(self._level_use) > 1 and self.memory_usage()["total"] > self.memory_budget:
+            fillna, key = self._level_use.popitem(last=False)[0]
+            self._pyramids.get(fillna, {}).pop(key, None)
+
+    def memory_usage(self):
+        """
+        Resident bytes by component, memory mapped store arrays included as if fully paged in
+        """
+        if self.compact is None:
+            base = {"values": self._values.nbytes, "observed": self._observed.nbytes}
+        else:
+            base = {"values": self.compact.values.nbytes, "observed": self.compact.observed_bits.nbytes}
+
+        usage = {
+            "dates": self.dates.nbytes,
+            **base,
+            "asof_rows": self.asof_rows.nbytes,
+            "pyramids": sum(compact.level_nbytes(level) for pyramid in list(self._pyramids.values())
+                            for level in list(pyramid.values())),
+            "derived": sum(compact.level_nbytes(arrays) for arrays in list(self._derived.values())),
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+    def memory_report(self):
+        """
+        Bytes per series: what it takes now, as float64 + bool mask and as float32 + bitset (see compact.py)
+
+        The shared date index is split evenly across series.
+        """
+        n_rows, n_series = len(self.dates), max(len(self.series), 1)
+        pyramid_bytes = self.memory_usage()["pyramids"] // n_series
+
+        observed_rows = [int(np.count_nonzero(self._observed_column(col))) for col in range(len(self.series))]
+        dense_bytes = n_rows * (8 + 1) + self.dates.nbytes // n_series
+        compact_bytes = n_rows * 4 + -(-n_rows // 8) + n_rows * 4 // n_series
+
+        report = pd.DataFrame({
+            "observations": observed_rows,
+            "dense_bytes": dense_bytes,
+            "compact_bytes": compact_bytes,
+            "asof_bytes": self.asof_rows.itemsize * n_rows,
+            "pyramid_bytes": pyramid_bytes,
+        }, index=pd.Index(self.series, name="series"))
+        report["resident_bytes"] = ((compact_bytes if self.compact is not None else dense_bytes)
+                                    + report["asof_bytes"] + pyramid_bytes)
+        return report
+
+    def resampled(self, sample_rate="W", fillna=True, how="mean"):
+        """
+        Every series resampled side by side, same values as concatenating create_yield_df_dict's frames
+
+        how: one of derived.PYRAMID_STATS
+        Returns:
+            (dates, matrix) -- read-only pyramid arrays, nothing is resampled at request time
+        """
+        level = self.pyramid_level(sample_rate, fillna=fillna)
+        return level["dates"], level[how]
+
+    def spread_matrix(self, sample_rate="W", fillna=True):
+        """
+        All N x N maturity spreads in one broadcast, spreads[t, i, j] = yield i - yield j
+        """
+        dates, matrix = self.resampled(sample_rate, fillna=fillna)
+        return dates, matrix[:, :, None] - matrix[:, None, :]
+
+    def spread(self, maturity1, maturity2, sample_rate="W", fillna=True):
+        """
+        Single spread maturity1 - maturity2 from column views of the resampled matrix, NaN rows dropped
+        """
+        dates, matrix = self.resampled(sample_rate, fillna=fillna)
+        spread = matrix[:, self.column(maturity1.series_id)] - matrix[:, self.column(maturity2.series_id)]
+
+        valid = ~np.isnan(spread)
+        return pd.Series(spread[valid], index=pd.DatetimeIndex(dates[valid], name="observation_date"))
+
+    def series_frame(self, series_id, fillna=True, sample_rate="W"):
+        """
+        Single series dataframe, equivalent to reading its csv on its own
+        """
+        col = self.column(series_id)
+        rows = self._observed_column(col)
+
+        if sample_rate is None or derived.level_key(sample_rate) not in derived.PYRAMID_LEVEL_KEYS:
+            # fancy indexing copies, callers can't write into the shared matrix
+            dataframe = pd.DataFrame({series_id: self._take(rows, col)},
+                                     index=pd.DatetimeIndex(self.dates[rows], name="observation_date"))
+            if fillna:
+                dataframe = dataframe.ffill()
+            if sample_rate is not None:
+                # multi-period rules bin relative to the series' own first date
+                dataframe = dataframe.resample(sample_rate).mean()
+            return dataframe
+
+        dates, matrix = self.resampled(sample_rate, fillna=fillna)
+
+        # the series' own bins run from the one holding its first csv row to the one holding its last
+        bounds_key = (derived.level_key(sample_rate), series_id)
+        if bounds_key not in self._series_bounds:
+            observed_dates = self.dates[rows]
+            bounds = pd.Series(0, index=observed_dates[[0, -1]]).resample(sample_rate).size().index
+            self._series_bounds[bounds_key] = np.searchsorted(dates, bounds.values[[0, -1]])
+        start, end = self._series_bounds[bounds_key]
+
+        return pd.DataFrame({series_id: matrix[start:end + 1, col]},
+                            index=pd.DatetimeIndex(dates[start:end + 1], name="observation_date"))
+
+
+def to_maturity(identifier):
+    """
+    Resolve a maturity identifier to a Maturity
+
+    Accepts a Maturity, series id ('DGS10'), label ('10-year', '3-month'),
+    short form ('10y', '3m', '3mo') or number of years (10, 0.25)
+    """
+    if isinstance(identifier, Maturity):
+        return identifier
+
+    for series_id in TREASURY_SERIES:
+        label = parse_duration_from_filename(series_id)
+        years = derived.maturity_years(label)
+        count, unit = label.split("-")
+
+        if isinstance(identifier, (int, float)):
+            if not isinstance(identifier, bool) and abs(identifier - years) < 1e-9:
+                return Maturity(series_id, label, years)
+            continue
+
+        short_forms = {f"{count}y", f"{count}yr"} if unit == "year" else {f"{count}m", f"{count}mo"}
+        if str(identifier).strip() in {series_id, label} or str(identifier).strip().lower() in short_forms:
+            return Maturity(series_id, label, years)
+
+    raise ValueError(f"unknown maturity: {identifier!r}")
+
+
+def _panel_version(dates, values, observed, series):
+    """
+    Content hash of a panel, changes only when the data itself changes
+    """
+    digest = hashlib.sha1(",".join(series).encode())
+    for array in (dates.values.view(np.int64), values, observed):
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+
+def _series_csv_files(data_directory_path):
+    """
+    Csv files in a data directory, ordered by TREASURY_SERIES then filename
+    """
+    files = [file for file in os.listdir(data_directory_path) if file.endswith('.csv')]
+
+    def sort_key(file):
+        series_id = file.split(".")[0]
+        if series_id in TREASURY_SERIES:
+            return (TREASURY_SERIES.index(series_id), series_id)
+        return (len(TREASURY_SERIES), series_id)
+
+    return [os.path.join(data_directory_path, file) for file in sorted(files, key=sort_key)]
+
+
+def _files_source_key(files):
+    """
+    Cheap fingerprint of a set of files, changes whenever one is rewritten
+    """
+    key = []
+    for file in files:
+        stat = os.stat(file)
+        key.append((os.path.basename(file), stat.st_mtime_ns, stat.st_size))
+    return tuple(key)
+
+
+def _read_csv_panel(data_files, source_key=None):
+    dates, values, observed, series = ingest.ingest_csvs(data_files)
+    for issue in availability.validate(dates, values, series):
+        print(f"data check: {issue}")
+    return YieldPanel(dates, values, observed, series, source_key=source_key)
+
+
+@instrumented("read_panel")
+def _read_panel(data_directory_path, data_files, source_key):
+    """
+    Read a panel through the configured storage backend, csvs remain the source of truth
+    """
+    csv_bytes = sum(size for _, _, size in source_key)
+
+    if STORAGE_BACKEND != "npy":
+        annotate(bytes_read=csv_bytes)
+        return _read_csv_panel(data_files, source_key=source_key)
+
+    store_dir = storage.panel_store_dir(data_directory_path)
+    arrays = storage.read_panel_store(store_dir, source_key=source_key)
+    if arrays is not None:
+        annotate(cache_hit=True, rows=len(arrays["dates"]),
+                 bytes_read=sum(arrays[name].nbytes for name in storage.PANEL_ARRAYS))
+        return YieldPanel(pd.DatetimeIndex(arrays["dates"], name="observation_date"),
+                          arrays["values"], arrays["observed"], arrays["series"],
+                          source_key=source_key, store_dir=store_dir)
+
+    annotate(cache_hit=False, bytes_read=csv_bytes)
+    panel = _read_csv_panel(data_files, source_key=source_key)
+    annotate(rows=len(panel.dates))
+    try:
+        storage.write_panel_store(store_dir, panel.dates.values, panel.values, panel.observed,
+                                  panel.series, source_key=source_key)
+        panel.store_dir = store_dir
+    except OSError as e:
+        print(f"could not write panel store: {e}")
+    return panel
+
+
+@instrumented()
+def migrate_to_panel_store(data_directory_path=CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Parse the csvs in a data directory and (re)build its binary panel store
+    """
+    data_files = _series_csv_files(data_directory_path)
+    source_key = _files_source_key(data_files)
+    panel = _read_csv_panel(data_files, source_key=source_key)
+
+    storage.write_panel_store(storage.panel_store_dir(data_directory_path), panel.dates.values,
+                              panel.values, panel.observed, panel.series, source_key=source_key)
+    return panel
+
+
+@instrumented("attach_shared_panel")
+def _attach_shared_panel(shared_dir):
+    """
+    Panel over the current shared segment, no array is copied (see shared_panel.py)
+    """
+    key, header, arrays = shared_panel.attach(shared_dir)
+    annotate(rows=len(arrays["dates"]))
+    return YieldPanel(pd.DatetimeIndex(arrays["dates"], name="observation_date"), arrays["values"],
+                      arrays["observed"], header["series"], source_key=key, store_dir=header["store_dir"],
+                      asof_rows=arrays["asof_rows"], version=header["version"],
+                      pyramids=shared_panel.pyramids(arrays), snapshot=header.get("snapshot"))
+
+
+@instrumented()
+def load_yield_panel(data_directory_path=CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Get the shared yield panel for a data directory
+
+    Data is loaded once per process and only re-read when a csv's mtime/size changes.
+    In shared serving mode (CMH_SHARED_PANEL_DIR) the published segment is mapped instead, and
+    remapped when the loader publishes a new version.
+    """
+    shared_dir = shared_panel.SHARED_PANEL_DIR
+    if shared_dir is not None:
+        data_files = None
+        source_key = shared_panel.pointer_key(shared_dir)
+    else:
+        data_files = _series_csv_files(data_directory_path)
+        source_key = _files_source_key(data_files)
+
+    panel = _yield_panels.get(data_directory_path)
+    stale = panel is not None and panel.source_key != source_key
+    if stale and data_files is not None and refresh_in_progress(data_directory_path):
+        # mid refresh the csvs are replaced one at a time, keep serving the last complete panel until the
+        # refresher swaps in the new one (reload_yield_panel)
+        annotate(cache_hit=True)
+        return panel
+
+    annotate(cache_hit=panel is not None and panel.source_key == source_key)
+    if panel is not None and panel.source_key == source_key:
+        return panel
+
+    return _install_panel(data_directory_path, data_files, source_key)
+
+
+def _install_panel(data_directory_path, data_files, source_key):
+    """
+    Load the panel for source_key unless another session already did, and make it the shared one
+    """
+    shared_dir = shared_panel.SHARED_PANEL_DIR
+    with _yield_panels_lock:
+        # another session may have loaded it while we waited
+        panel = _yield_panels.get(data_directory_path)
+        if panel is None or panel.source_key != source_key:
+            if shared_dir is not None:
+                # mapped pages are shared with every worker, compacting would only make a private copy
+                panel = _attach_shared_panel(shared_dir)
+            else:
+                panel = _read_panel(data_directory_path, data_files, source_key)
+                panel.set_memory_budget(compact.MEMORY_BUDGET_BYTES)
+            _yield_panels[data_directory_path] = panel
+    return panel
+
+
+@instrumented()
+def reload_yield_panel(data_directory_path=CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Read the csvs into a new shared panel and swap it in, even while a refresh holds the old one
+
+    Called by the refresher once every csv is written, so sessions go from the old panel to the new one at once
+    """
+    data_files = _series_csv_files(data_directory_path)
+    return _install_panel(data_directory_path, data_files, _files_source_key(data_files))
+
+
+def refresh_in_progress(data_directory_path=CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Whether a refresh in this or another process is rewriting the csvs (a fresh refresh lock file exists)
+    """
+    try:
+        age = time.time() - os.stat(os.path.join(data_directory_path, REFRESH_LOCK_FILENAME)).st_mtime
+    except FileNotFoundError:
+        return False
+    return age < REFRESH_LOCK_STALE_SECONDS
+
 
+@instrumented()
 def get_latest_data_date():
     yield_data_file = os.path.join(CONSTANT_MATURITIES_DATA_DIR, TREASURY_SERIES[-1] + ".csv")
     if not os.path.exists(yield_data_file):
         return "None"
 
-    df = pd.read_csv(yield_data_file)
+    return load_yield_panel().last_observation_date(TREASURY_SERIES[-1])
 
-    last_date = pd.to_datetime(df['observation_date'].iloc[-1]).date()
-    return last_date
 
-
-def update_csv_files(days_until_stale=7):
+@instrumented()
+def update_csv_files(days_until_stale=7, fred=None):
     """
     Download fresh yield data if stored data is older than the given amount of days
 
@@ -38,82 +605,213 @@ def update_csv_files(days_until_stale=7):
 
     yield_data_file = os.path.join(CONSTANT_MATURITIES_DATA_DIR, TREASURY_SERIES[-1] + ".csv")
     if not os.path.exists(yield_data_file):
-        download_fred_data()
+        download_fred_data(fred=fred)
         return
 
-    df = pd.read_csv(yield_data_file)
-
-    last_date = pd.to_datetime(df['observation_date'].iloc[-1]).date()
+    last_date = load_yield_panel().last_observation_date(TREASURY_SERIES[-1])
 
     print(f"Yield data is {(current_date - last_date).days} days old")
     if (current_date - last_date).days >= days_until_stale:
         print('downloading data')
-        download_fred_data()
+        download_fred_data(fred=fred)
         print('done')
     else:
         print("data is fresh")
 
 
-def download_fred_data():
+def _fred_client():
+    if "FRED_API_KEY" not in os.environ:
+        print("FRED API KEY DOES NOT EXIST")
+        return None
+
+    return downloader.FredHTTPClient(api_key=os.environ["FRED_API_KEY"])
+
+
+def _last_valid_dates(data_directory_path):
+    """
+    Date of each series' latest non-blank observation, read from the shared panel
+    """
+    if not _series_csv_files(data_directory_path):
+        return {}
+
+    panel = load_yield_panel(data_directory_path)
+
+    last_valid_dates = {}
+    for col, series_id in enumerate(panel.series):
+        last_row = panel.asof_rows[-1, col]
+        if last_row >= 0:
+            last_valid_dates[series_id] = panel.dates[last_row].date()
+    return last_valid_dates
+
+
+@instrumented()
+def download_fred_data(fred=None, data_directory_path=CONSTANT_MATURITIES_DATA_DIR, full_refresh=False,
+                       max_workers=4):
     """
     Use FRED API to download treasury time series data and save to csvs
+
+    Series with existing csvs only fetch observations after their own last valid date and append them.
+    Series are fetched concurrently, a series that fails keeps its previous csv.
+    fred: any object with fredapi.Fred style get_series(series_id, observation_start=...), defaults to FredHTTPClient
     """
-    if "FRED_API_KEY" not in os.environ:
-        print("FRED API KEY DOES NOT EXIST")
-        return
-    
-    fred = Fred(api_key=os.environ["FRED_API_KEY"])
+    if fred is None:
+        fred = _fred_client()
+        if fred is None:
+            return
 
+    last_valid_dates = {} if full_refresh else _last_valid_dates(data_directory_path)
+
+    observation_starts = {}
     for duration in TREASURY_SERIES:
-        data = fred.get_series(duration)
+        csv_filename = os.path.join(data_directory_path, duration + ".csv")
+
+        observation_starts[duration] = None
+        if duration in last_valid_dates and os.path.exists(csv_filename):
+            observation_starts[duration] = last_valid_dates[duration] + timedelta(days=1)
+
+    written, errors = downloader.refresh_series_csvs(fred, observation_starts, data_directory_path,
+                                                     max_workers=max_workers)
+    for duration, error in errors.items():
+        print(f"failed to download {duration}: {error}")
 
-        data.name = duration
+    record_data_snapshot(data_directory_path)
+    return written, errors
 
-        csv_filename = os.path.join(CONSTANT_MATURITIES_DATA_DIR, duration + ".csv")
 
-        data.to_csv(csv_filename, index_label="observation_date") 
+def record_data_snapshot(data_directory_path=CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Snapshot the csvs after they were written (see snapshots.py), a stat of each csv when nothing changed
+
+    Returns:
+        snapshot token, None if it could not be recorded
+    """
+    try:
+        token, _ = snapshots.record(data_directory_path)
+    except OSError as e:
+        print(f"failed to record data snapshot: {e}")
+        return None
+    return token
 
 
+@instrumented()
+def data_version(data_directory_path=CONSTANT_MATURITIES_DATA_DIR):
+    """
+    Snapshot token naming the data being served, read only
+
+    Equal tokens mean byte-identical csvs, so it can key any cache derived from them. In shared serving mode
+    it is the token the loader published the panel with. None when the csvs changed since the last recorded
+    snapshot; snapshots are recorded where the data is written (download_fred_data and the refresher).
+    """
+    if DATA_SNAPSHOT is not None and data_directory_path == CONSTANT_MATURITIES_DATA_DIR:
+        return DATA_SNAPSHOT
+    if shared_panel.SHARED_PANEL_DIR is not None:
+        return load_yield_panel(data_directory_path).snapshot
+    return snapshots.current_token(data_directory_path)
+
+
+@instrumented()
 def get_dated_yield_curve(yc_date):
+    """
+    Yield curve on the given date, using each maturity's latest value within the prior week
+
+    Returns:
+        ([(duration, yield), ...], "YYYY-MM-DD" of the most recent observation used)
+    """
     if yc_date is None:
         yc_date = date.today()
-    date_str = yc_date.strftime("%Y-%m-%d")
+
+    panel = load_yield_panel()
+    values, observation_dates = panel.asof(yc_date)
 
     data_dates = set()
     yield_curve = []
 
     for duration in TREASURY_SERIES:
-        csv_file = os.path.join(CONSTANT_MATURITIES_DATA_DIR, duration + ".csv")
+        col = panel.column(duration)
+        if np.isnan(values[0, col]):
+            continue
+        yield_curve.append((panel.maturities[col], values[0, col]))
+        data_dates.add(str(observation_dates[0, col].astype("datetime64[D]")))
 
-        yield_df = pd.read_csv(csv_file)
+    res_date = max(data_dates)
+    return yield_curve, res_date
 
-        formatted_duration = parse_duration_from_filename(csv_file)
 
-        last_entry = yield_df["observation_date"].iloc[-1]
+@instrumented()
+def get_dated_yield_curves(yc_dates, max_staleness_days=7):
+    """
+    Batch version of get_dated_yield_curve, one vectorized lookup for any number of dates
 
-        # check if the input date is more recent than the latest data entry
-        if date_str >= last_entry:
-            # index location, get last value in column
-            latest_yield = yield_df[duration].dropna().iloc[-1]
-            yield_curve.append((formatted_duration, latest_yield))
-            data_dates.add(last_entry)
-            continue
+    Returns:
+        DataFrame indexed by the requested dates with a column per maturity (NaN if unavailable)
+    """
+    panel = load_yield_panel()
+    values, _ = panel.asof(yc_dates, max_staleness_days=max_staleness_days)
 
-        for days_back in range(0, 8):
-            check_date = yc_date - timedelta(days=days_back)
-            formatted_date = check_date.strftime("%Y-%m-%d")
-        
-            matching_rows = yield_df[yield_df['observation_date'] == formatted_date].dropna()
-            if not matching_rows.empty:
-                latest_yield = matching_rows.iloc[0][duration]
-                yield_curve.append((formatted_duration, latest_yield))
-                data_dates.add(formatted_date)
-                break
+    cols = [panel.column(duration) for duration in TREASURY_SERIES]
+    return pd.DataFrame(values[:, cols],
+                        index=pd.DatetimeIndex(np.atleast_1d(yc_dates), name="observation_date"),
+                        columns=[panel.maturities[col] for col in cols])
 
-    res_date = max(data_dates)
-    return yield_curve, res_date
+
+@instrumented()
+def available_maturities(yc_date):
+    """
+    Treasury maturities published around a date (see availability.py), e.g. no 20-year in 1990
+    """
+    panel = load_yield_panel()
+    available = set(panel.availability().available_series(yc_date))
+    return [panel.maturities[panel.column(series_id)] for series_id in TREASURY_SERIES if series_id in available]
+
+
+@instrumented()
+def unavailable_periods(*durations):
+    """
+    Periods when any of the maturities was not published, within the span they all were (see availability.py)
+
+    Returns:
+        DataFrame with start and end columns
+    """
+    series_ids = [to_maturity(duration).series_id for duration in durations]
+    return load_yield_panel().availability().gaps(series_ids)
+
+
+def curve_step_dates(start_date, end_date, step="W"):
+    """
+    Step dates between two dates (inclusive), generated with numpy (pd.date_range("B") loops in python)
+    """
+    if step not in CURVE_STEPS:
+        raise ValueError(f"step must be one of {CURVE_STEPS}, got {step!r}")
+
+    start = np.datetime64(pd.Timestamp(start_date).date(), "D")
+    end = np.datetime64(pd.Timestamp(end_date).date(), "D")
+
+    if step == "ME":
+        months = np.arange(start.astype("datetime64[M]"), end.astype("datetime64[M]") + 1)
+        days = (months + 1).astype("datetime64[D]") - 1
+        days = days[(days >= start) & (days <= end)]
+    else:
+        days = np.arange(start, end + 1)
+        days = days[np.is_busday(days, weekmask="1111100" if step == "D" else "0000100")]
+
+    return pd.DatetimeIndex(days.astype("datetime64[ns]"), name="observation_date")
+
+
+@instrumented()
+def yield_curve_history(start_date, end_date, step="W", max_staleness_days=7):
+    """
+    Yield curve at every step between two dates, one batched as-of lookup for the whole range
+
+    step: "D" (business days), "W" (Fridays) or "ME" (month ends)
+    Returns:
+        DataFrame indexed by step date with a column per maturity, steps without any data dropped
+    """
+    dates = curve_step_dates(start_date, end_date, step)
+    curves = get_dated_yield_curves(dates, max_staleness_days=max_staleness_days)
+    return curves.dropna(how="all")
 
 
+@instrumented()
 def create_yield_df_dict(data_directory_path=CONSTANT_MATURITIES_DATA_DIR, fillna=True, sample_rate="W"):
     """
     Create yield time series dataframes from all csv files in given directory
@@ -121,28 +819,14 @@ def create_yield_df_dict(data_directory_path=CONSTANT_MATURITIES_DATA_DIR, filln
     Returns:
         dict(str : DataFrame)
     """
-    data_files = [os.path.join(data_directory_path, file)
-                    for file in os.listdir(data_directory_path)
-                        if file.endswith('.csv')]
+    panel = load_yield_panel(data_directory_path)
 
     maturity_datafile_dict = {}
 
-    for file in data_files:
-        duration = parse_duration_from_filename(file)
-        dataframe = pd.read_csv(
-            file,
-            parse_dates=["observation_date"],  # Automatically parse the date column
-            index_col="observation_date",      # Set the date column as the DataFrame index
-            na_values=[""]                     # Treat blank cells as NaN
-        )
-
-        second_column_name = dataframe.columns[0]  # Get the current name of the second column
-        dataframe.rename(columns={second_column_name: duration}, inplace=True)
-
+    for series_id, duration in zip(panel.series, panel.labels):
         # forward fill any empty rows and convert to sample rate
-        if fillna:
-            dataframe = dataframe.ffill()
-        dataframe = dataframe.resample(sample_rate).mean()
+        dataframe = panel.series_frame(series_id, fillna=fillna, sample_rate=sample_rate)
+        dataframe.columns = [duration]
         dataframe.title = duration
 
         maturity_datafile_dict[duration] = dataframe
@@ -150,85 +834,78 @@ def create_yield_df_dict(data_directory_path=CONSTANT_MATURITIES_DATA_DIR, filln
     return maturity_datafile_dict
 
 
+@instrumented()
+def resample_yields(sample_rate="W", how="mean", fillna=True):
+    """
+    Every maturity at the given resolution, served from the pre-aggregated pyramid
+
+    how: "mean", "min", "max" or "last" of the observations in each period
+    """
+    panel = load_yield_panel()
+    dates, matrix = panel.resampled(sample_rate, fillna=fillna, how=how)
+
+    return pd.DataFrame(matrix, columns=panel.labels,
+                        index=pd.DatetimeIndex(dates, name="observation_date"))
+
+
+@instrumented()
 def create_yield_dataframe():
     """
-    Create dataframe that concats all yield dataframes together
+    Create dataframe with every weekly yield series side by side
     Create columns for highest/lowest yields and min max spread
     """
-    yields_df_dict = create_yield_df_dict(fillna=False)
+    panel = load_yield_panel()
+    dates, matrix = panel.resampled("W", fillna=False)
+    derived_series = panel.derived_series("W")
 
-    combined_df = pd.concat(list(yields_df_dict.values()), axis=1, join="outer")
+    combined_df = pd.DataFrame(matrix, columns=panel.labels,
+                               index=pd.DatetimeIndex(dates, name="observation_date"))
 
-    combined_df["Highest Yield"] = combined_df.max(axis=1)
-    combined_df["Lowest Yield"] = combined_df.min(axis=1)
-
-    combined_df["Min Max Spread"] = combined_df["Highest Yield"] - combined_df["Lowest Yield"]
+    combined_df["Highest Yield"] = derived_series["highest_yield"]
+    combined_df["Lowest Yield"] = derived_series["lowest_yield"]
+    combined_df["Min Max Spread"] = derived_series["min_max_spread"]
 
     return combined_df
 
 
+@instrumented()
 def lowest_yield_dataframe(sample_rate="W"):
     """
     Create time indexed dataframe with column for weekly lowest yield treasury duration.
     Represent durations as float conversion of years('1-year' -> 1.0, '6-month' -> 0.5)
     """
-    yield_dfs = create_yield_df_dict(fillna=False, sample_rate=sample_rate)
-
-    converted_keys_dfs = {}
-    for duration, df in yield_dfs.items():
-        dur_num = duration.split('-')[0]
-        if duration.endswith("month"):
-            converted_keys_dfs[round(int(dur_num)/12, 3)] = df
-        else:
-            converted_keys_dfs[int(dur_num)] = df
-
-    combined_df = pd.concat(converted_keys_dfs, axis=1, join="outer")
-    lowest_yields = combined_df.idxmin(axis=1)
-
-    lowest_df = pd.DataFrame({"lowest_rate_duration": lowest_yields})
+    derived_series = load_yield_panel().derived_series(sample_rate)
 
-    # extract the first element from the (duration float, duration string) tuple
-    lowest_df["lowest_rate_duration"] = lowest_df["lowest_rate_duration"].apply(lambda x: x[0])
-
-    return lowest_df
+    return pd.DataFrame({"lowest_rate_duration": derived_series["lowest_rate_duration"]},
+                        index=pd.DatetimeIndex(derived_series["dates"], name="observation_date"))
 
 
+@instrumented()
 def highest_yield_dataframe(sample_rate="ME"):
     """
     Create time indexed dataframe with column for monthly highest yield treasury duration.
     Represent durations as float conversion of years('1-year' -> 1.0, '6-month' -> 0.5)
     """
-    yield_dfs = create_yield_df_dict(fillna=False, sample_rate=sample_rate)
-
-    converted_keys_dfs = {}
-    for duration, df in yield_dfs.items():
-        dur_num = duration.split('-')[0]
-        if duration.endswith("month"):
-            converted_keys_dfs[round(int(dur_num)/12, 3)] = df
-        else:
-            converted_keys_dfs[int(dur_num)] = df
+    derived_series = load_yield_panel().derived_series(sample_rate)
 
-    combined_df = pd.concat(converted_keys_dfs, axis=1, join="outer")
-    highest_yields = combined_df.idxmax(axis=1)
-
-    highest_df = pd.DataFrame({"highest_rate_duration": highest_yields})
-
-    # extract the first element from the (duration float, duration string) tuple
-    highest_df["highest_rate_duration"] = highest_df["highest_rate_duration"].apply(lambda x: x[0])
-
-    return highest_df
+    return pd.DataFrame({"highest_rate_duration": derived_series["highest_rate_duration"]},
+                        index=pd.DatetimeIndex(derived_series["dates"], name="observation_date"))
 
 
 def parse_duration_from_filename(csv_filepath):
     """
     Convert duration titles to more readable format('DGS1' -> '1-year', 'DGS3MO' -> '3-month')
+    None for series that are not a constant maturity ('DFII10', ...)
     """
     filename = os.path.basename(csv_filepath).split(".")[0]
 
     if filename.startswith("FF"):
         return "0-month"
 
-    duration_abrev = filename.split("DGS")[1]
+    match = re.fullmatch(r"DGS(\d+(?:MO)?)", filename)
+    if match is None:
+        return None
+    duration_abrev = match.group(1)
 
     if duration_abrev.endswith('MO'):
         months = duration_abrev.split('MO')[0]
@@ -237,63 +914,57 @@ def parse_duration_from_filename(csv_filepath):
         return f"{duration_abrev}-year"
 
 
+@instrumented()
 def fed_funds_rate_dataframe(start_date="1965-01-01"):
     """
     Create separate dataframe for Fed Funds Rate data
     """
     duration = "FF"
-    dataframe = pd.read_csv(
-        FED_FUNDS_CSV_FILE,
-        parse_dates=["observation_date"],
-        index_col="observation_date",
-        na_values=[""]
-    )
-
-    dataframe = dataframe.ffill()
-    dataframe = dataframe.resample("W").mean()
+    dataframe = load_yield_panel().series_frame(duration, fillna=True, sample_rate="W")
     dataframe.title = duration
 
     return dataframe
 
 
+@instrumented()
 def create_yield_differential_dataframe(d1, d2):
     """
     Create dataframe for a treasury yield spread (ex: 10 year - 2 year)
     """
-    df_yields_dict = create_yield_df_dict()
-    if d1 not in df_yields_dict or d2 not in df_yields_dict:
+    try:
+        maturity1, maturity2 = to_maturity(d1), to_maturity(d2)
+    except ValueError:
         print("invalid durations input")
         return None
-    
-    df1 = df_yields_dict[d1]
-    df2 = df_yields_dict[d2]
-
-    second_column_name = df1.columns[0]
-    df1.rename(columns={second_column_name: "yield"}, inplace=True)
-    second_column_name = df2.columns[0]
-    df2.rename(columns={second_column_name: "yield"}, inplace=True)
-    
-    d1_float = 0
-    d2_float = 0
-
-    if d1.endswith("month"):
-            d1_float = round(int(d1.split("mo")[0])/12, 3)
-    else:
-        d1_float = float(d1.split("-")[0])
-    
-    if d2.endswith("month"):
-        d2_float = round(int(d2.split("-")[0])/12, 3)
-    else:
-        d2_float = float(d2.split("-")[0])
 
-    if d2_float > d1_float:
-        df1, df2 = df1, df2
+    return pd.DataFrame({"Spread": load_yield_panel().spread(maturity1, maturity2)})
+
+
+@instrumented()
+def yield_spreads(pairs, sample_rate="W"):
+    """
+    Several spreads side by side, one column per (long, short) maturity pair ('10-year - 2-year')
+    """
+    panel = load_yield_panel()
+    spreads = {}
+    for d1, d2 in pairs:
+        maturity1, maturity2 = to_maturity(d1), to_maturity(d2)
+        spreads[f"{maturity1.label} - {maturity2.label}"] = panel.spread(maturity1, maturity2, sample_rate=sample_rate)
+
+    return pd.DataFrame(spreads)
+
 
-    df_spread = pd.DataFrame({
-        "Spread": (df1["yield"] - df2["yield"]).dropna()
-    })
+@instrumented()
+def yield_spread_matrix(sample_rate="W"):
+    """
+    Every maturity spread at once
 
-    return df_spread
+    Returns:
+        (DatetimeIndex, maturity labels, array[date, i, j] = yield of label i - yield of label j)
+    """
+    panel = load_yield_panel()
+    dates, spreads = panel.spread_matrix(sample_rate)
+    return pd.DatetimeIndex(dates, name="observation_date"), list(panel.labels), spreads
 
 
 if __name__ == "__main__":